@@ -0,0 +1,186 @@
+import contextvars
+import fnmatch
+import os
+import re
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from dataclasses import dataclass
+
+from blob_store import STORE_DIRNAME
+from fetch_engine import SharedFetches
+import sheets_scheduler
+
+# Audits processed at the same time; they share the Sheets quota and the HTTP connection pool
+DEFAULT_PARALLEL_AUDITS = 4
+
+# Spreadsheet IDs are the long key in the spreadsheet's URL
+SPREADSHEET_KEY = re.compile(r"^[A-Za-z0-9_-]{40,}$")
+
+# Label of the audit the current code runs for. FetchEngine, Pipeline and the other worker pools run their
+# jobs in a copy of the submitting context, so prints from their threads carry the audit's label too.
+current_label = contextvars.ContextVar("audit_label", default=None)
+
+
+def is_spreadsheet_key(target):
+    return bool(SPREADSHEET_KEY.match(target))
+
+
+def slug(name):
+    """A folder name for an audit, e.g. 'Media Library Audit - April 2025' -> 'Media-Library-Audit-April-2025'."""
+    return re.sub(r"[^\w.]+", "-", name).strip("-") or "audit"
+
+
+def resolve_targets(client, patterns):
+    """
+    The spreadsheet names or IDs to audit. Patterns with *, ? or [ are matched against the titles of
+    every spreadsheet the client can see; anything else is taken as a name or ID. Duplicates are dropped.
+    """
+    targets = []
+    titles = None
+    for pattern in patterns:
+        if not any(c in pattern for c in "*?["):
+            targets.append(pattern)
+            continue
+        if titles is None:
+            files = sheets_scheduler.call("drive", client.list_spreadsheet_files)
+            titles = sorted({f["name"] for f in files})
+        matched = [title for title in titles if fnmatch.fnmatchcase(title, pattern)]
+        if not matched:
+            print(f"⚠️ No spreadsheet matches '{pattern}'")
+        targets += matched
+    return list(dict.fromkeys(targets))
+
+
+@dataclass
+class Audit:
+    """One spreadsheet of a run and where its files go."""
+    target: str
+    label: str
+    multiple: bool = False  # more than one audit in the run
+    shared: SharedFetches = None
+    store_dir: str = None
+
+    def folder(self, base):
+        """base for a single audit; a subfolder per audit when several share a run."""
+        return os.path.join(base, slug(self.label)) if self.multiple else base
+
+
+@dataclass
+class AuditResult:
+    audit: Audit
+    seconds: float = 0.0
+    error: Exception = None
+
+    @property
+    def ok(self):
+        return self.error is None
+
+
+class LabelledOutput:
+    """
+    Stands in for sys.stdout while audits run side by side: each line printed for an audit, from its own
+    thread or a worker thread it started, is prefixed with that audit's label (current_label). Lines are
+    buffered per thread so they never interleave mid-line.
+    """
+
+    def __init__(self, stream):
+        self.stream = stream
+        self._local = threading.local()
+        self._lock = threading.Lock()
+
+    def set_label(self, label):
+        current_label.set(label)
+
+    def write(self, text):
+        buffer = getattr(self._local, "buffer", "") + text
+        *lines, self._local.buffer = buffer.split("\n")
+        if lines:
+            label = current_label.get()
+            prefix = f"[{label}] " if label else ""
+            with self._lock:
+                self.stream.write("".join(f"{prefix}{line}\n" for line in lines))
+        return len(text)
+
+    def flush(self):
+        with self._lock:
+            self.stream.flush()
+
+    def __getattr__(self, name):
+        return getattr(self.stream, name)
+
+
+class AuditRunner:
+    """
+    Runs a task over several spreadsheets at once. Every audit uses the same authenticated client,
+    the same Sheets quota scheduler and the same pooled HTTP session. A failing audit is reported and
+    does not stop the others. With download_root set, images that several audits reference are fetched
+    once, into a blob store shared under download_root.
+    """
+
+    def __init__(self, open_spreadsheet, parallel=DEFAULT_PARALLEL_AUDITS, download_root=None):
+        self.open_spreadsheet = open_spreadsheet
+        self.parallel = max(1, parallel)
+        self.download_root = download_root
+
+    def audits(self, targets):
+        multiple = len(targets) > 1
+        shared = SharedFetches() if multiple else None
+        store_dir = os.path.join(self.download_root, STORE_DIRNAME) if multiple and self.download_root else None
+        return [Audit(target, target, multiple, shared, store_dir) for target in targets]
+
+    def _run_one(self, audit, task, output=None):
+        if output:
+            output.set_label(audit.label)
+        start = time.perf_counter()
+        try:
+            spreadsheet = self.open_spreadsheet(audit.target)
+            audit.label = getattr(spreadsheet, "title", None) or audit.target
+            if output:
+                output.set_label(audit.label)
+            task(spreadsheet, audit)
+        except Exception as e:
+            print(f"❌ Audit failed: {e!r}")
+            return AuditResult(audit, time.perf_counter() - start, e)
+        finally:
+            sys.stdout.flush()
+        return AuditResult(audit, time.perf_counter() - start)
+
+    def run(self, targets, task):
+        """Calls task(spreadsheet, audit) for every target; returns the AuditResults in target order."""
+        audits = self.audits(targets)
+        if len(audits) <= 1:
+            return [self._run_one(audit, task) for audit in audits]
+
+        print(f"🗂️ Running {len(audits)} audits, {min(self.parallel, len(audits))} at a time")
+        output = LabelledOutput(sys.stdout)
+        stdout, sys.stdout = sys.stdout, output
+        results = {}
+        try:
+            with ThreadPoolExecutor(max_workers=self.parallel) as pool:
+                # Each audit gets its own context, so setting its label doesn't leak into the next audit on the thread
+                futures = {pool.submit(contextvars.copy_context().run, self._run_one, audit, task, output): audit
+                           for audit in audits}
+                for future in as_completed(futures):
+                    result = future.result()
+                    results[id(result.audit)] = result
+                    status = "✅ done" if result.ok else "❌ failed"
+                    print(f"{status} {result.audit.label} in {result.seconds:.1f}s ({len(results)} of {len(audits)} audits finished)")
+        finally:
+            sys.stdout = stdout
+
+        ordered = [results[id(audit)] for audit in audits]
+        report(ordered, audits[0].shared)
+        return ordered
+
+
+def report(results, shared=None):
+    failed = [r for r in results if not r.ok]
+    print(f"📋 {len(results) - len(failed)} of {len(results)} audits succeeded")
+    for result in results:
+        mark = "✅" if result.ok else "❌"
+        detail = f": {result.error}" if result.error else ""
+        print(f"   {mark} {result.audit.label} ({result.seconds:.1f}s){detail}")
+    if shared is not None and len(shared):
+        print(f"   {len(shared)} distinct images fetched across all audits")
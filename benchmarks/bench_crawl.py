@@ -0,0 +1,121 @@
+"""
+Crawls the local static-site stand-in and checks the crawler against the site's ground truth:
+a full crawl, an interrupted crawl that is resumed, an incremental recrawl after one page changed,
+and filling "Found on site" on a fake spreadsheet. Reports pages/s and exits 1 on any mismatch.
+
+    python benchmarks/bench_crawl.py --pages 500 --workers 8
+"""
+import argparse
+import contextlib
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from fake_sheets import FakeSpreadsheet
+from static_site import StaticSite, generate_site, ground_truth, write_page
+
+import crawler
+import script
+import sheet_cache
+
+IMAGES = 50
+DOCS = 20
+
+
+def indexed(index_path):
+    """{target: {pages}} as stored in the index."""
+    conn = sqlite3.connect(index_path)
+    try:
+        refs = {}
+        for target, page in conn.execute("SELECT target, page FROM refs"):
+            refs.setdefault(target, set()).add(page)
+        return refs
+    finally:
+        conn.close()
+
+
+def crawl(index_path, base_url, args, quiet=True, **kwargs):
+    with crawler.CrawlIndex(index_path) as index:
+        run = crawler.Crawler(index, [base_url + "/"], max_workers=args.workers, per_host=args.workers,
+                              max_pages=kwargs.pop("max_pages", crawler.MAX_PAGES))
+        with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull if quiet else sys.stdout):
+            start = time.perf_counter()
+            totals = run.run(**kwargs)
+        return totals, time.perf_counter() - start
+
+
+class Checks:
+    def __init__(self):
+        self.failed = 0
+
+    def expect(self, name, ok, detail=""):
+        print(f"{'✅' if ok else '❌'} {name}{': ' + detail if detail and not ok else ''}")
+        self.failed += not ok
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--pages", type=int, default=300)
+    parser.add_argument("--workers", type=int, default=8)
+    args = parser.parse_args()
+
+    work = tempfile.mkdtemp(prefix="bench-crawl-")
+    site_dir = os.path.join(work, "site")
+    generate_site(site_dir, args.pages, IMAGES, DOCS)
+    site = StaticSite(site_dir).start()
+    base = site.base_url
+    truth = ground_truth(base, args.pages, IMAGES, DOCS)
+    checks = Checks()
+
+    # Full crawl
+    full_index = os.path.join(work, "full.sqlite3")
+    totals, seconds = crawl(full_index, base, args)
+    print(f"Full crawl: {args.pages} pages in {seconds:.2f}s ({args.pages / seconds:.0f} pages/s), {totals}")
+    checks.expect("every page parsed once", totals["changed"] == args.pages and totals["failed"] == 0, str(totals))
+    checks.expect("inverted index matches the site", indexed(full_index) == truth)
+
+    # Interrupted after a third of the pages, then resumed
+    resumed_index = os.path.join(work, "resumed.sqlite3")
+    first, _ = crawl(resumed_index, base, args, max_pages=args.pages // 3)
+    rest, _ = crawl(resumed_index, base, args)
+    checks.expect("resumed crawl matches the full one", indexed(resumed_index) == truth,
+                  f"{first['changed']} + {rest['changed']} pages parsed")
+    checks.expect("resume fetched no page twice", first["changed"] + rest["changed"] == args.pages)
+
+    # Incremental: one page's content changes, everything is revalidated
+    changed = args.pages // 2
+    time.sleep(0.01)
+    write_page(site_dir, changed, args.pages, IMAGES, DOCS, revision=1)
+    site.reset()
+    totals, seconds = crawl(full_index, base, args, max_age=0)
+    print(f"Recrawl: {seconds:.2f}s, {totals}, server statuses {site.statuses}")
+    checks.expect("only the changed page is reparsed", totals["changed"] == 1 and totals["unchanged"] == args.pages - 1,
+                  str(totals))
+    checks.expect("index still matches after the recrawl", indexed(full_index) == truth)
+
+    # Fill "Found on site" on a fake spreadsheet
+    sheet_cache._default = sheet_cache.SheetCache(os.path.join(work, "sheet-cache"))
+    fake = FakeSpreadsheet()
+    image = f"{base}/files/img1.jpg"
+    doc = f"{base}/files/doc3.pdf"
+    fake.load("Images", [["Size", "Location", "Found on site", "Title"], ["1 MB", image, "", ""],
+                         ["1 MB", f"{base}/files/unused.jpg", "", ""]])
+    fake.load("Old Files", [["Name", "URL", "Type", "Owner", "Status"], ["doc3.pdf", doc, "PDF", "x", "Pending"]])
+    with crawler.CrawlIndex(full_index) as index, open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        script.fill_found_on_site(fake, index, pages_per_cell=1000)
+    images = fake.dump("Images")
+    old_files = fake.dump("Old Files")
+    checks.expect("Images rows filled", set(images[1][2].split("\n")) == truth[image] and images[2][2] == "")
+    checks.expect("Old Files rows filled", set(old_files[1][-1].split("\n")) == truth[doc] and old_files[0][-1] == "Found on site")
+
+    site.shutdown()
+    sys.exit(1 if checks.failed else 0)
+
+
+if __name__ == "__main__":
+    main()
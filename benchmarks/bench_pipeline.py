@@ -0,0 +1,191 @@
+"""
+Throughput of the script's stages against a fake spreadsheet and a local image server.
+The server runs in this process; each stage runs in its own subprocess so peak RSS is measured separately.
+Reports rows/s, MB/s, p50/p99 per-image latency, peak RSS and Sheets API call counts. Latency is
+measured in the client, per job: from the start of its fetch to the end of its encode (download) or
+probe (probe), queueing behind the per-host cap and the CPU stage included.
+
+    python benchmarks/bench_pipeline.py --rows 20000 --images 100 --latency 0.05 --error-rate 0.02
+    python benchmarks/bench_pipeline.py --stages probe,download --forbidden-every 10 --slow-every 7
+"""
+import argparse
+import contextlib
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from common import peak_rss_mb
+from fake_sheets import FakeSpreadsheet
+from image_server import ImageServer, make_corpus
+
+STAGES = ("filter", "titles", "probe", "download")
+
+
+def server_call(base_url, path):
+    with urllib.request.urlopen(base_url + path) as response:
+        body = response.read()
+    return json.loads(body) if body else None
+
+
+def report_rows(count, names):
+    """A storage report of count rows; every third row is a PDF, the rest point at corpus images."""
+    rows = [["Size", "Location", "Type", "Owner", "Transferred"]]
+    for i in range(count):
+        if i % 3 == 2:
+            rows.append([f"{i % 900 + 100} KB", f"/sites/stanfordlaw/files/doc{i}.pdf", "PDF", "bench", ""])
+        else:
+            rows.append([f"{i % 50 / 10 + 0.5:.1f} MB", f"/sites/stanfordlaw/files/{names[i % len(names)]}", "Image", "bench", ""])
+    return rows
+
+
+def images_rows(count, names, base_url, stale_titles=False):
+    """
+    An Images tab of count rows. With stale_titles, only every fourth row has its current title; the rest
+    are blank or stale, so write_image_titles has real writes to make, split into many ranges.
+    """
+    rows = [["Size", "Location", "Found on site", "Title", "Download", "Status"]]
+    for i in range(count):
+        name = names[i % len(names)]
+        title = os.path.splitext(name)[0]
+        if stale_titles:
+            title = (title, f"old-{title}", "", "")[i % 4]
+        rows.append(["", f"{base_url}/files/{name}", "", title, "true", ""])
+    return rows
+
+
+def run_stage(args):
+    """Runs one stage in this (child) process and prints its measurements as JSON."""
+    import filter_engine
+    import metrics
+    import script
+    import sheet_cache
+    import sheets_scheduler
+
+    work_dir = tempfile.mkdtemp(prefix=f"bench-{args.stage}-")
+    sheet_cache._default = sheet_cache.SheetCache(os.path.join(work_dir, "sheet-cache"))
+    names = json.loads(args.names)
+    fake = FakeSpreadsheet(latency=args.latency, error_rate=args.error_rate)
+    # Stages see the fake through the same quota scheduler as a real spreadsheet
+    ss = sheets_scheduler.configure(args.read_quota, args.write_quota).wrap(fake)
+
+    if args.stage == "filter":
+        filter_engine.SITE_URL = args.base_url  # public URLs point at the local server
+        fake.load("500 largest files", report_rows(args.rows, names))
+        rows, call = args.rows, lambda: script.filter_links(ss)
+    elif args.stage == "titles":
+        fake.load("Images", images_rows(args.rows, names, args.base_url, stale_titles=True))
+        rows, call = args.rows, lambda: script.write_image_titles(ss)
+    elif args.stage == "probe":
+        fake.load("Images", images_rows(args.images, names, args.base_url))
+        rows, call = args.images, lambda: script.probe_images(ss, args.workers, args.per_host)
+    else:
+        fake.load("Images", images_rows(args.images, names, args.base_url))
+        rows, call = args.images, lambda: script.download_image(
+            ss, args.workers, args.per_host, cpu_workers=args.cpu_workers,
+            download_dir=os.path.join(work_dir, "downloads"))
+
+    server_call(args.base_url, "/__reset")
+    metrics.reset()
+    error = None
+    start = time.perf_counter()
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        try:
+            call()
+        except Exception as e:
+            error = repr(e)
+    seconds = time.perf_counter() - start
+    summary = metrics.summary()
+
+    print(json.dumps({
+        "stage": args.stage,
+        "rows": rows,
+        "seconds": seconds,
+        "server": server_call(args.base_url, "/__stats"),
+        "api": fake.stats.summary(),
+        "peak_rss_mb": peak_rss_mb(resource.RUSAGE_SELF),
+        "workers_peak_rss_mb": peak_rss_mb(resource.RUSAGE_CHILDREN),
+        "error": error,
+        "stages": summary["stages"],
+        # Per-image latency: the whole pipeline for downloads, the fetch for probes
+        "latency": summary["latency"].get("pipeline_job") or summary["latency"].get("fetch_job"),
+    }))
+
+
+def print_table(results):
+    print(f"{'stage':<10}{'rows':>8}{'s':>8}{'rows/s':>10}{'MB/s':>8}{'p50 ms':>9}{'p99 ms':>9}"
+          f"{'RSS MB':>8}{'reads':>7}{'writes':>7}{'drive':>7}{'429s':>6}")
+    for r in results:
+        server, api = r["server"], r["api"]
+        mb_per_s = server["bytes_sent"] / 1e6 / r["seconds"] if r["seconds"] else 0.0
+        rss = max(r["peak_rss_mb"], r["workers_peak_rss_mb"])
+        latency = r["latency"]
+        p50, p99 = (f"{latency['p50_ms']:.1f}", f"{latency['p99_ms']:.1f}") if latency else ("-", "-")
+        print(f"{r['stage']:<10}{r['rows']:>8}{r['seconds']:>8.2f}{r['rows'] / r['seconds']:>10.0f}{mb_per_s:>8.1f}"
+              f"{p50:>9}{p99:>9}{rss:>8.0f}{api['reads']:>7}{api['writes']:>7}{api['drive']:>7}{api['throttled']:>6}")
+        if r["error"]:
+            print(f"{'':<10}❌ {r['error']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--stages", default=",".join(STAGES), help=f"Comma-separated subset of {', '.join(STAGES)}")
+    parser.add_argument("--rows", type=int, default=20000, help="Report rows for the filter and titles stages")
+    parser.add_argument("--images", type=int, default=60, help="Images for the probe and download stages")
+    parser.add_argument("--width", type=int, default=3000)
+    parser.add_argument("--height", type=int, default=2000)
+    parser.add_argument("--png-every", type=int, default=5)
+    parser.add_argument("--corpus", help="Directory for the generated images, reused between runs")
+    parser.add_argument("--forbidden-every", type=int, default=0, help="Every Nth image answers 403")
+    parser.add_argument("--slow-every", type=int, default=0, help="Every Nth image is delayed by --slow-delay")
+    parser.add_argument("--slow-delay", type=float, default=0.5)
+    parser.add_argument("--latency", type=float, default=0.0, help="Seconds added to every fake Sheets call")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Share of fake Sheets calls that fail with 429")
+    parser.add_argument("--read-quota", type=int, default=60, help="Sheets reads per minute allowed by the scheduler")
+    parser.add_argument("--write-quota", type=int, default=60, help="Sheets writes per minute allowed by the scheduler")
+    parser.add_argument("--workers", type=int, default=8)
+    parser.add_argument("--per-host", type=int, default=8)
+    parser.add_argument("--cpu-workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--json", action="store_true", help="Print raw JSON results instead of a table")
+    parser.add_argument("--stage", choices=STAGES, help=argparse.SUPPRESS)
+    parser.add_argument("--base-url", help=argparse.SUPPRESS)
+    parser.add_argument("--names", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.stage:
+        run_stage(args)
+        return
+
+    corpus = args.corpus or os.path.join(tempfile.gettempdir(), f"bench-images-{args.width}x{args.height}")
+    count = min(args.images, 200)  # larger runs cycle through the corpus
+    names = make_corpus(corpus, count, args.width, args.height, args.png_every)
+    server = ImageServer(corpus, names, forbidden_every=args.forbidden_every,
+                         slow_every=args.slow_every, slow_delay=args.slow_delay).start()
+    size_mb = sum(os.path.getsize(os.path.join(corpus, name)) for name in names) / 1e6
+    print(f"Corpus: {len(names)} images ({size_mb:.0f} MB) at {server.base_url}; "
+          f"Sheets latency {args.latency * 1000:.0f} ms, 429 rate {args.error_rate:.0%}")
+
+    results = []
+    for stage in args.stages.split(","):
+        cmd = [sys.executable, __file__, "--stage", stage, "--base-url", server.base_url, "--names", json.dumps(names)]
+        for flag in ("rows", "images", "latency", "error_rate", "read_quota", "write_quota", "workers", "per_host", "cpu_workers"):
+            cmd += [f"--{flag.replace('_', '-')}", str(getattr(args, flag))]
+        out = subprocess.run(cmd, check=True, capture_output=True, text=True).stdout
+        results.append(json.loads(out.strip().splitlines()[-1]))
+    server.shutdown()
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        print_table(results)
+
+
+if __name__ == "__main__":
+    main()
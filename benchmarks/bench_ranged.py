@@ -0,0 +1,304 @@
+"""
+Large-file PDF downloads, single stream vs parallel byte ranges, against a local server that caps each
+connection's bandwidth (like a CDN edge does per flow). Also checks the failure paths: a download cut
+off part-way or stopped by a server error resumes with only its missing pieces, a corrupted piece on disk
+is refetched, a changed file starts over, a server that ignores ranges falls back to one stream, a bad
+checksum is rejected, and range connections stay within the fetch engine's per-host cap.
+Exits 1 on any mismatch.
+
+    python benchmarks/bench_ranged.py --size-mb 64 --rate-mb 20 --connections 4
+"""
+import argparse
+import base64
+import contextlib
+import hashlib
+import http.server
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import ranged_download
+import script
+from fetch_engine import FetchEngine, FetchJob
+
+BLOCK = 64 * 1024
+
+
+class FileHandler(http.server.BaseHTTPRequestHandler):
+    """Serves the files of the server's directory with Range/If-Range, ETag and Repr-Digest, at a capped rate."""
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        with self.server.active():
+            self.respond(body=True)
+
+    def do_HEAD(self):
+        with self.server.active():
+            self.respond(body=False)
+
+    def respond(self, body):
+        server = self.server
+        path = os.path.join(server.directory, os.path.basename(self.path))
+        if not os.path.isfile(path):
+            self.send_response(404)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        size = os.path.getsize(path)
+        etag, digest = server.validators(path)
+        start, end, status = 0, size - 1, 200
+        ranged = self.headers.get("Range", "").startswith("bytes=") and server.ranges
+        if ranged and self.headers.get("If-Range") in (None, etag):
+            first, _, last = self.headers["Range"][6:].partition("-")
+            start, end, status = int(first), min(int(last or size - 1), size - 1), 206
+        if status == 206 and server.fail_from is not None and start >= server.fail_from:
+            status = 503  # ranges at or after this offset hit a server error
+        server.count(status if body else "HEAD")
+        if status == 503:
+            self.send_response(status)
+            self.send_header("Retry-After", "0")
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+
+        self.send_response(status)
+        self.send_header("Content-Type", "application/pdf")
+        self.send_header("Content-Length", str(end - start + 1))
+        self.send_header("ETag", etag)
+        self.send_header("Repr-Digest", f"sha-256=:{server.published_digest or digest}:")
+        if server.ranges:
+            self.send_header("Accept-Ranges", "bytes")
+        if status == 206:
+            self.send_header("Content-Range", f"bytes {start}-{end}/{size}")
+        self.end_headers()
+        if not body:
+            return
+
+        cut = status == 206 and server.cut_from is not None and start >= server.cut_from
+        with open(path, "rb") as f:
+            f.seek(start)
+            remaining = end - start + 1
+            try:
+                while remaining:
+                    if cut and remaining < (end - start + 1) // 2:
+                        self.close_connection = True
+                        return  # drop the connection half-way through the range
+                    block = f.read(min(BLOCK, remaining))
+                    self.wfile.write(block)
+                    remaining -= len(block)
+                    time.sleep(len(block) / server.rate)
+            except (BrokenPipeError, ConnectionResetError):
+                self.close_connection = True  # the client only wanted the headers
+
+
+class FileServer(http.server.ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, directory, rate):
+        super().__init__(("127.0.0.1", 0), FileHandler)
+        self.directory = directory
+        self.rate = rate  # bytes/s per connection
+        self.ranges = True
+        self.published_digest = None  # overrides the real digest, to test the checksum check
+        self.cut_from = None  # ranges starting at or after this offset are cut off half-way
+        self.fail_from = None  # ranges starting at or after this offset get a 503
+        self.statuses = {}
+        self.peak = 0  # most requests served at once since the last reset
+        self._active = 0
+        self._validators = {}
+        self._lock = threading.Lock()
+
+    def validators(self, path):
+        stat = os.stat(path)
+        key = (path, stat.st_size, stat.st_mtime_ns)
+        with self._lock:
+            if key not in self._validators:
+                etag = '"' + hashlib.md5(repr(key).encode()).hexdigest() + '"'
+                with open(path, "rb") as f:
+                    digest = base64.b64encode(hashlib.sha256(f.read()).digest()).decode()
+                self._validators[key] = etag, digest
+            return self._validators[key]
+
+    def count(self, status):
+        with self._lock:
+            self.statuses[status] = self.statuses.get(status, 0) + 1
+
+    @contextlib.contextmanager
+    def active(self):
+        with self._lock:
+            self._active += 1
+            self.peak = max(self.peak, self._active)
+        try:
+            yield
+        finally:
+            with self._lock:
+                self._active -= 1
+
+    def reset(self):
+        with self._lock:
+            self.statuses = {}
+            self.peak = 0
+
+    def start(self):
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+
+def sha256(path):
+    with open(path, "rb") as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+class Checks:
+    def __init__(self):
+        self.failed = 0
+
+    def expect(self, name, ok, detail=""):
+        print(f"{'✅' if ok else '❌'} {name}{': ' + detail if detail and not ok else ''}")
+        self.failed += not ok
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--size-mb", type=int, default=64)
+    parser.add_argument("--rate-mb", type=float, default=20, help="Bandwidth per connection, MB/s")
+    parser.add_argument("--connections", type=int, default=ranged_download.RANGE_CONNECTIONS)
+    args = parser.parse_args()
+
+    work = tempfile.mkdtemp(prefix="bench-ranged-")
+    served = os.path.join(work, "served")
+    os.makedirs(served)
+    source = os.path.join(served, "report.pdf")
+    with open(source, "wb") as f:
+        for _ in range(args.size_mb):
+            f.write(os.urandom(1024 * 1024))
+    with open(os.path.join(served, "small.pdf"), "wb") as f:
+        f.write(os.urandom(200 * 1024))
+    server = FileServer(served, args.rate_mb * 1e6).start()
+    url = f"http://127.0.0.1:{server.server_port}/report.pdf"
+    pieces = -(-args.size_mb * 1024 * 1024 // ranged_download.PIECE_SIZE)
+    checks = Checks()
+    quiet = contextlib.redirect_stdout(open(os.devnull, "w"))
+
+    def download(name, connections=args.connections, target=url, size=None):
+        directory = os.path.join(work, name)
+        os.makedirs(directory, exist_ok=True)
+        server.reset()
+        start = time.perf_counter()
+        path = script.save_pdf(target, directory, connections, threshold=1024 * 1024, size=size)
+        return path, time.perf_counter() - start
+
+    path, single = download("single", connections=1)
+    checks.expect("single stream is intact", sha256(path) == sha256(source))
+    path, ranged = download("ranged")
+    print(f"{args.size_mb} MB at {args.rate_mb:g} MB/s per connection: single stream {single:.2f}s, "
+          f"{args.connections} ranges {ranged:.2f}s ({single / ranged:.1f}x)")
+    checks.expect("ranged download is intact", sha256(path) == sha256(source))
+    checks.expect("a HEAD, then one request per piece", server.statuses == {"HEAD": 1, 206: pieces}, str(server.statuses))
+    checks.expect("no leftovers", sorted(os.listdir(os.path.dirname(path))) == ["report.pdf"])
+
+    # The second half of the file is cut off on every attempt; the rerun resumes
+    server.cut_from = os.path.getsize(source) // 2
+    try:
+        with quiet:
+            download("resumed")
+        checks.expect("cut-off download raises", False)
+    except Exception:
+        pass
+    state = ranged_download.RangeState.load(os.path.join(work, "resumed", "report.pdf.part.json"), url,
+                                            os.path.getsize(source), server.validators(source)[0])
+    done = len(state.done) if state else 0
+    server.cut_from = None
+    path, _ = download("resumed")
+    checks.expect("resume fetches only the missing pieces", server.statuses.get(206) == pieces - done,
+                  f"{done} kept, {server.statuses}")
+    checks.expect("resumed download is intact", sha256(path) == sha256(source))
+
+    # A server error outlives the retries: the run fails, but the finished pieces are kept and resumed
+    server.fail_from = os.path.getsize(source) // 2
+    try:
+        with quiet:
+            download("errored")
+        checks.expect("server error fails the download", False)
+    except script.DownloadFailed as e:
+        checks.expect("server error fails the download", e.status_code == 503, str(e))
+    state = ranged_download.RangeState.load(os.path.join(work, "errored", "report.pdf.part.json"), url,
+                                            os.path.getsize(source), server.validators(source)[0])
+    done = len(state.done) if state else 0
+    server.fail_from = None
+    path, _ = download("errored")
+    checks.expect("server error keeps the finished pieces", done > 0 and server.statuses.get(206) == pieces - done
+                  and 200 not in server.statuses, f"{done} kept, {server.statuses}")
+    checks.expect("download after a server error is intact", sha256(path) == sha256(source))
+
+    # A finished piece corrupted on disk (e.g. lost in a crash) is refetched
+    server.cut_from = os.path.getsize(source) // 2
+    with contextlib.suppress(Exception), quiet:
+        download("corrupted")
+    part = os.path.join(work, "corrupted", "report.pdf.part")
+    with open(part, "r+b") as f:
+        f.write(b"\0" * 16)
+    server.cut_from = None
+    path, _ = download("corrupted")
+    checks.expect("corrupted piece is refetched", sha256(path) == sha256(source))
+
+    # The file changes between the interruption and the rerun: start over
+    server.cut_from = os.path.getsize(source) // 2
+    with contextlib.suppress(Exception), quiet:
+        download("changed")
+    with open(source, "r+b") as f:
+        f.write(os.urandom(1024))
+    server.cut_from = None
+    path, _ = download("changed")
+    checks.expect("changed file is downloaded from scratch", sha256(path) == sha256(source)
+                  and server.statuses.get(206) == pieces, str(server.statuses))
+
+    # Ranges advertised but ignored: one stream instead
+    server.ranges = False
+    path, _ = download("ignored")
+    checks.expect("no ranges: one stream", sha256(path) == sha256(source)
+                  and server.statuses == {"HEAD": 1, 200: 1}, str(server.statuses))
+    server.ranges = True
+
+    # Checksum mismatch: nothing is kept
+    server.published_digest = base64.b64encode(b"\0" * 32).decode()
+    try:
+        download("mismatch")
+        checks.expect("bad checksum is rejected", False)
+    except ranged_download.ChecksumMismatch:
+        checks.expect("bad checksum is rejected", os.listdir(os.path.join(work, "mismatch")) == [])
+    server.published_digest = None
+
+    # Small files keep the simple path; no HEAD when the report already gives their size
+    small = url.replace("report", "small")
+    download("small", target=small)
+    checks.expect("small file: one stream", server.statuses == {"HEAD": 1, 200: 1}, str(server.statuses))
+    download("small-sized", target=small, size=200 * 1024)
+    checks.expect("small file of known size: no HEAD", server.statuses == {200: 1}, str(server.statuses))
+
+    # Range connections count against the engine's per-host cap
+    shutil.copy(source, os.path.join(served, "copy.pdf"))
+    directory = os.path.join(work, "capped")
+    os.makedirs(directory)
+    engine = FetchEngine(max_workers=4, per_host=2)
+    jobs = [FetchJob(2, url), FetchJob(3, url.replace("report", "copy"))]
+    server.reset()
+    results = list(engine.run(jobs, lambda job: script.save_pdf(job.url, directory, args.connections,
+                                                                 threshold=1024 * 1024, engine=engine)))
+    checks.expect("per-host cap holds with ranges", all(r.ok for r in results) and server.peak <= 2,
+                  f"{server.peak} requests at once, {[r.error for r in results if not r.ok]}")
+
+    server.shutdown()
+    sys.exit(1 if checks.failed else 0)
+
+
+if __name__ == "__main__":
+    main()
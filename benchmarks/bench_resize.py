@@ -0,0 +1,97 @@
+"""
+Compares fit_within (draft to DRAFT_GAP x the target, then one LANCZOS resample) with a full-size
+decode + LANCZOS resize and with the old thumbnail() path (which drafts with a 2x gap).
+Each variant runs in its own subprocess so peak RSS is measured separately.
+
+    python benchmarks/bench_resize.py --width 8000 --height 6000 --repeat 5
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from io import BytesIO
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from PIL import Image
+
+from common import make_image, peak_rss_mb
+from image_processing import fit_within, target_size, RESAMPLE
+
+MAX_SIZE = (2000, 2000)
+
+
+def full_decode(data):
+    image = Image.open(BytesIO(data))
+    image.load()
+    return image.resize(target_size(image.size, MAX_SIZE), RESAMPLE)
+
+
+def thumbnail(data):
+    image = Image.open(BytesIO(data))
+    image.thumbnail(MAX_SIZE)
+    return image
+
+
+def new_path(data):
+    image = Image.open(BytesIO(data))
+    return fit_within(image, MAX_SIZE)
+
+
+VARIANTS = {"full": full_decode, "thumbnail": thumbnail, "new": new_path}
+
+
+def run_variant(name, path, repeat):
+    with open(path, "rb") as f:
+        data = f.read()
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        image = VARIANTS[name](data)
+        image.load()
+        times.append(time.perf_counter() - start)
+    print(json.dumps({"variant": name, "size": image.size, "times": times, "peak_rss_mb": peak_rss_mb()}))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--width", type=int, default=8000)
+    parser.add_argument("--height", type=int, default=6000)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--variant", choices=VARIANTS, help=argparse.SUPPRESS)
+    parser.add_argument("--file", help=argparse.SUPPRESS)
+    parser.add_argument("--make", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.make:
+        make_image(args.file, args.width, args.height, seed=16)
+        return
+    if args.variant:
+        run_variant(args.variant, args.file, args.repeat)
+        return
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "large.jpg")
+        # Built in a child too: Linux carries the parent's peak RSS over into forked children
+        subprocess.run([sys.executable, __file__, "--make", "--file", path,
+                        "--width", str(args.width), "--height", str(args.height)], check=True)
+        print(f"Source: {args.width}x{args.height} JPEG, {os.path.getsize(path) / 1e6:.1f} MB, target box {MAX_SIZE}")
+        print(f"{'path':<11}{'output':>12}{'median ms':>12}{'min ms':>10}{'peak RSS MB':>14}")
+        for name in VARIANTS:
+            out = subprocess.run(
+                [sys.executable, __file__, "--variant", name, "--file", path, "--repeat", str(args.repeat)],
+                check=True, capture_output=True, text=True,
+            ).stdout
+            result = json.loads(out)
+            size = "x".join(str(n) for n in result["size"])
+            print(f"{name:<11}{size:>12}{statistics.median(result['times']) * 1000:>12.1f}"
+                  f"{min(result['times']) * 1000:>10.1f}{result['peak_rss_mb']:>14.1f}")
+
+
+if __name__ == "__main__":
+    main()
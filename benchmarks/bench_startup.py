@@ -0,0 +1,76 @@
+"""
+Cold-start time of the script: `import script` and `script.py --help`, each in a fresh interpreter.
+Fails (exit 1) if importing the script pulls in a module that only some commands need, so a stray
+top-level import of Selenium or Pillow is caught before it slows every run down, or if either takes
+longer than the budget on top of starting a bare interpreter.
+
+    python benchmarks/bench_startup.py --runs 7 --budget-ms 600
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Only imported by the commands that use them
+LAZY_MODULES = ("selenium", "webdriver_manager", "PIL", "oauth2client")
+# Startup time allowed on top of a bare interpreter; gspread (and the Google auth stack it pulls in)
+# is most of the ~350 ms measured when this was set
+BUDGET_MS = 500
+# Reported, not enforced
+WATCHED_MODULES = LAZY_MODULES + ("gspread", "requests", "sqlite3", "multiprocessing", "pyarrow")
+
+PROBE = f"""
+import json, sys
+sys.path.insert(0, {ROOT!r})
+import script
+print(json.dumps(sorted(m for m in {WATCHED_MODULES!r} if m in sys.modules)))
+"""
+
+
+def timed(cmd):
+    start = time.perf_counter()
+    out = subprocess.run(cmd, check=True, capture_output=True, text=True, cwd=ROOT).stdout
+    return time.perf_counter() - start, out
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--budget-ms", type=float, default=BUDGET_MS,
+                        help="Fail if the median import or --help takes longer than this over a bare interpreter "
+                             "(0 to only check lazy imports)")
+    args = parser.parse_args()
+
+    baseline = statistics.median(timed([sys.executable, "-c", "pass"])[0] for _ in range(args.runs)) * 1000
+    imports = [timed([sys.executable, "-c", PROBE]) for _ in range(args.runs)]
+    helps = [timed([sys.executable, os.path.join(ROOT, "script.py"), "--help"])[0] for _ in range(args.runs)]
+    import_ms = statistics.median(seconds for seconds, _ in imports) * 1000
+    help_ms = statistics.median(helps) * 1000
+    loaded = json.loads(imports[0][1])
+
+    print(f"Interpreter alone:  {baseline:7.0f} ms")
+    print(f"import script:      {import_ms:7.0f} ms")
+    print(f"script.py --help:   {help_ms:7.0f} ms")
+    print(f"Loaded: {', '.join(loaded) or 'none of the watched modules'}")
+
+    failed = False
+    eager = [m for m in loaded if m in LAZY_MODULES]
+    if eager:
+        print(f"❌ import script loads {', '.join(eager)}; import them where they are used")
+        failed = True
+    for name, ms in (("import script", import_ms), ("script.py --help", help_ms)):
+        if args.budget_ms and ms - baseline > args.budget_ms:
+            print(f"❌ {name} took {ms - baseline:.0f} ms over the interpreter, more than the {args.budget_ms:.0f} ms budget")
+            failed = True
+    if not failed:
+        print("✅ Startup within limits")
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
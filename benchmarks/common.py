@@ -0,0 +1,23 @@
+"""Helpers shared by the benchmarks: synthetic images and peak memory."""
+import resource
+import sys
+
+from PIL import Image
+
+
+def make_image(path, width, height, seed=0):
+    # Noise over a gradient compresses like a photo rather than a flat fill
+    gradient = Image.linear_gradient("L").resize((width, height))
+    noise = Image.effect_noise((width, height), 32 + seed % 32)
+    image = Image.merge("RGB", (gradient, noise, gradient.transpose(Image.FLIP_LEFT_RIGHT)))
+    if path.endswith(".png"):
+        image.save(path, optimize=False)
+    else:
+        image.save(path, quality=90)
+
+
+def peak_rss_mb(who=resource.RUSAGE_SELF):
+    peak = resource.getrusage(who).ru_maxrss
+    if sys.platform == "darwin":
+        peak //= 1024  # macOS reports bytes
+    return peak / 1024
@@ -0,0 +1,200 @@
+"""
+In-process stand-in for the parts of gspread the script uses, for benchmarks.
+Every call is counted, can be slowed down by a fixed latency and can fail with an injected 429,
+so stages can be measured without a live spreadsheet. Contents live in memory.
+"""
+import collections
+import os
+import random
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from gspread.exceptions import APIError, WorksheetNotFound
+from gspread.utils import a1_to_rowcol
+
+import tables
+
+# Which calls count against the Sheets read quota, the write quota or Drive
+READS = {"get_all_values", "get_all_records", "get_values", "worksheets", "worksheet"}
+WRITES = {"update", "update_cell", "batch_update", "values_batch_update", "add_cols", "add_rows",
+          "add_worksheet", "del_worksheet"}
+DRIVE = {"get_lastUpdateTime"}
+
+
+class FakeResponse:
+    """Just enough of requests.Response for gspread's APIError."""
+
+    def __init__(self, status_code, message):
+        self.status_code = status_code
+        self.text = message
+        self.headers = {"Retry-After": "1"}
+
+    def json(self):
+        return {"error": {"code": self.status_code, "message": self.text, "status": "RESOURCE_EXHAUSTED"}}
+
+
+class MemoryBackend(tables.TableBackend):
+    def __init__(self):
+        self.path = "memory"
+        self._tables = {}
+
+    def tabs(self):
+        return list(self._tables)
+
+    def read_chunks(self, tab, chunk_size=tables.CHUNK_ROWS):
+        rows = self._tables[tab]
+        for start in range(0, len(rows), chunk_size):
+            yield [list(row) for row in rows[start:start + chunk_size]]
+
+    def write_table(self, tab, rows):
+        self._tables[tab] = [list(row) for row in rows]
+
+    def delete_table(self, tab):
+        del self._tables[tab]
+
+
+class CallStats:
+    def __init__(self):
+        self.calls = collections.Counter()
+        self.throttled = 0
+        self._lock = threading.Lock()
+
+    def add(self, name):
+        with self._lock:
+            self.calls[name] += 1
+
+    def summary(self):
+        with self._lock:
+            calls = dict(self.calls)
+        return {
+            "reads": sum(n for name, n in calls.items() if name in READS),
+            "writes": sum(n for name, n in calls.items() if name in WRITES),
+            "drive": sum(n for name, n in calls.items() if name in DRIVE),
+            "throttled": self.throttled,
+            "calls": calls,
+        }
+
+
+class FakeSpreadsheet:
+    """
+    Spreadsheet with gspread's method names. latency (seconds) is added to every call;
+    error_rate is the chance that a call fails with APIError 429 before doing anything.
+    """
+
+    def __init__(self, title="Benchmark", latency=0.0, error_rate=0.0, seed=0):
+        self.id = f"fake-{title}"
+        self.title = title
+        self.latency = latency
+        self.error_rate = error_rate
+        self.stats = CallStats()
+        self._local = tables.LocalSpreadsheet(MemoryBackend(), title)
+        self._random = random.Random(seed)
+        self._revision = 0
+        self._lock = threading.Lock()
+
+    def _call(self, name, write=False):
+        self.stats.add(name)
+        if self.latency:
+            time.sleep(self.latency)
+        with self._lock:
+            throttled = self.error_rate and self._random.random() < self.error_rate
+            if throttled:
+                self.stats.throttled += 1
+            elif write:
+                self._revision += 1
+        if throttled:
+            raise APIError(FakeResponse(429, f"Quota exceeded (injected) on {name}"))
+
+    # Setup helpers; not counted
+    def load(self, tab, rows):
+        self._local.backend.write_table(tab, rows)
+        self._revision += 1
+        return FakeWorksheet(self, tab)
+
+    def dump(self, tab):
+        return list(self._local.backend.rows(tab))
+
+    # gspread surface
+    def worksheets(self):
+        self._call("worksheets")
+        return [FakeWorksheet(self, tab) for tab in self._local.backend.tabs()]
+
+    def worksheet(self, title):
+        self._call("worksheet")
+        if title not in self._local.backend.tabs():
+            raise WorksheetNotFound(title)
+        return FakeWorksheet(self, title)
+
+    def batch_update(self, body):
+        self._call("batch_update", write=True)
+        return self._local.batch_update(body)
+
+    def get_lastUpdateTime(self):
+        self._call("get_lastUpdateTime")
+        return f"rev-{self._revision}"
+
+    def add_worksheet(self, title, rows, cols):
+        self._call("add_worksheet", write=True)
+        self._local.backend.write_table(title, [])
+        return FakeWorksheet(self, title)
+
+    def del_worksheet(self, worksheet):
+        self._call("del_worksheet", write=True)
+        self._local.backend.delete_table(worksheet.title)
+
+
+class FakeWorksheet:
+    def __init__(self, spreadsheet, title):
+        self.spreadsheet = spreadsheet
+        self.title = title
+        self._local = tables.LocalWorksheet(spreadsheet._local, title)
+        self.id = self._local.id
+
+    @property
+    def col_count(self):
+        return max(self._local.col_count, 26)
+
+    @property
+    def row_count(self):
+        return max(len(self.spreadsheet.dump(self.title)), 1000)
+
+    def get_all_values(self):
+        self.spreadsheet._call("get_all_values")
+        return self._local.get_all_values()
+
+    def get_all_records(self):
+        self.spreadsheet._call("get_all_records")
+        return self._local.get_all_records()
+
+    def get_values(self, range_name=None):
+        self.spreadsheet._call("get_values")
+        values = self._local.get_all_values()
+        if range_name and ":" in range_name:
+            first, last = range_name.split(":")
+            if first.isdigit() and last.isdigit():
+                return values[int(first) - 1:int(last)]
+            (r1, c1), (r2, c2) = a1_to_rowcol(first), a1_to_rowcol(last)
+            return [row[c1 - 1:c2] for row in values[r1 - 1:r2]]
+        return values
+
+    def update(self, range_name, values=None, **kwargs):
+        self.spreadsheet._call("update", write=True)
+        self._local.update(range_name, values)
+
+    def batch_update(self, data, **kwargs):
+        self.spreadsheet._call("batch_update", write=True)
+        self._local.batch_update(data)
+
+    def update_cell(self, row, col, value):
+        self.spreadsheet._call("update_cell", write=True)
+        self._local.update_cell(row, col, value)
+
+    def add_cols(self, cols):
+        self.spreadsheet._call("add_cols", write=True)
+
+    def add_rows(self, rows):
+        self.spreadsheet._call("add_rows", write=True)
+
@@ -0,0 +1,190 @@
+"""
+Local HTTP server for benchmarks: serves a generated corpus of JPEG/PNG images under /files/,
+with Range, ETag/If-None-Match and optional 403 or slow responses on a fixed share of the images.
+Per-request latency and bytes sent are kept and served as JSON from /__stats (reset with /__reset).
+
+    python benchmarks/image_server.py --count 50 --width 3000 --height 2000 --port 8765
+"""
+import argparse
+import hashlib
+import http.server
+import json
+import os
+import statistics
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from common import make_image
+from metrics import percentile
+
+
+def make_corpus(directory, count, width, height, png_every=5):
+    """count images named img0000.jpg, ...; every png_every-th one is a PNG. Existing files are reused."""
+    os.makedirs(directory, exist_ok=True)
+    names = []
+    for i in range(count):
+        name = f"img{i:04d}.{'png' if png_every and i % png_every == png_every - 1 else 'jpg'}"
+        path = os.path.join(directory, name)
+        if not os.path.exists(path):
+            make_image(path, width, height, i)
+        names.append(name)
+    return names
+
+
+class ServerStats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.latencies = []
+            self.bytes_sent = 0
+            self.statuses = {}
+
+    def record(self, status, sent, seconds):
+        with self._lock:
+            self.latencies.append(seconds)
+            self.bytes_sent += sent
+            self.statuses[str(status)] = self.statuses.get(str(status), 0) + 1
+
+    def summary(self):
+        with self._lock:
+            latencies = sorted(self.latencies)
+            return {
+                "requests": len(latencies),
+                "bytes_sent": self.bytes_sent,
+                "statuses": dict(self.statuses),
+                "p50_ms": percentile(latencies, 50) * 1000,
+                "p99_ms": percentile(latencies, 99) * 1000,
+                "mean_ms": (statistics.fmean(latencies) * 1000) if latencies else 0.0,
+            }
+
+
+class ImageHandler(http.server.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    server_version = "BenchImageServer/1.0"
+
+    def log_message(self, *args):
+        pass
+
+    def _send(self, status, body=b"", headers=None):
+        self.send_response(status)
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        if self.command != "HEAD" and body:
+            self.wfile.write(body)
+        return len(body) if self.command != "HEAD" else 0
+
+    def _image(self, name):
+        server = self.server
+        path = os.path.join(server.directory, name)
+        if "/" in name or not os.path.isfile(path):
+            return self._send(404)
+        index = server.names.index(name) if name in server.names else 0
+        if server.forbidden_every and index % server.forbidden_every == server.forbidden_every - 1:
+            return self._send(403)
+        if server.slow_every and index % server.slow_every == 0:
+            time.sleep(server.slow_delay)
+
+        with open(path, "rb") as f:
+            data = f.read()
+        stat = os.stat(path)
+        etag = '"' + hashlib.md5(f"{name}-{stat.st_size}-{stat.st_mtime_ns}".encode()).hexdigest() + '"'
+        headers = {
+            "Content-Type": "image/png" if name.endswith(".png") else "image/jpeg",
+            "ETag": etag,
+            "Last-Modified": self.date_time_string(int(stat.st_mtime)),
+            "Accept-Ranges": "bytes",
+        }
+        if self.headers.get("If-None-Match") == etag:
+            return self._send(304, headers={"ETag": etag})
+
+        range_header = self.headers.get("Range", "")
+        if range_header.startswith("bytes="):
+            start, _, end = range_header[6:].partition("-")
+            start = int(start or 0)
+            end = min(int(end) if end else len(data) - 1, len(data) - 1)
+            if start >= len(data):
+                return self._send(416, headers={"Content-Range": f"bytes */{len(data)}"})
+            headers["Content-Range"] = f"bytes {start}-{end}/{len(data)}"
+            return self._send(206, data[start:end + 1], headers)
+        return self._send(200, data, headers)
+
+    def _handle(self):
+        start = time.perf_counter()
+        path = self.path.split("?")[0]
+        if path == "/__stats":
+            self._send(200, json.dumps(self.server.stats.summary()).encode(), {"Content-Type": "application/json"})
+            return
+        if path == "/__reset":
+            self.server.stats.reset()
+            self._send(204)
+            return
+        if path.startswith("/files/"):
+            sent = self._image(path[len("/files/"):])
+        else:
+            sent = self._send(404)
+        self.server.stats.record(self._status, sent, time.perf_counter() - start)
+
+    def send_response(self, code, message=None):
+        self._status = code
+        super().send_response(code, message)
+
+    do_GET = _handle
+    do_HEAD = _handle
+
+
+class ImageServer(http.server.ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, directory, names, port=0, forbidden_every=0, slow_every=0, slow_delay=0.5):
+        super().__init__(("127.0.0.1", port), ImageHandler)
+        self.directory = directory
+        self.names = names
+        self.forbidden_every = forbidden_every
+        self.slow_every = slow_every
+        self.slow_delay = slow_delay
+        self.stats = ServerStats()
+
+    @property
+    def base_url(self):
+        return f"http://127.0.0.1:{self.server_port}"
+
+    def start(self):
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--dir", help="Corpus directory (default: a temporary one)")
+    parser.add_argument("--count", type=int, default=50)
+    parser.add_argument("--width", type=int, default=3000)
+    parser.add_argument("--height", type=int, default=2000)
+    parser.add_argument("--png-every", type=int, default=5, help="Every Nth image is a PNG (0 for none)")
+    parser.add_argument("--forbidden-every", type=int, default=0, help="Every Nth image answers 403")
+    parser.add_argument("--slow-every", type=int, default=0, help="Every Nth image is delayed by --slow-delay")
+    parser.add_argument("--slow-delay", type=float, default=0.5)
+    parser.add_argument("--port", type=int, default=8765)
+    args = parser.parse_args()
+
+    directory = args.dir or tempfile.mkdtemp(prefix="bench-images-")
+    names = make_corpus(directory, args.count, args.width, args.height, args.png_every)
+    server = ImageServer(directory, names, args.port, args.forbidden_every, args.slow_every, args.slow_delay)
+    print(f"Serving {len(names)} images from {directory} at {server.base_url}/files/")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
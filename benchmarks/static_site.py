@@ -0,0 +1,177 @@
+"""
+Local stand-in for the website, for exercising the crawler: a generated tree of static HTML pages that
+reference images (img src, srcset), PDFs (a href), each other, a non-HTML feed and an external site.
+Pages are served with ETag and 304 Not Modified, like the real site's CDN.
+ground_truth() gives what the crawler should find: every referenced URL -> the pages referencing it.
+
+    python benchmarks/static_site.py --pages 200 --port 8766
+"""
+import argparse
+import functools
+import hashlib
+import http.server
+import os
+import tempfile
+import threading
+
+
+def page_name(i):
+    return "index.html" if i == 0 else f"pages/page{i}.html"
+
+
+def page_path(i):
+    """Path pages link to page i by; the home page is "/", never "/index.html"."""
+    return "" if i == 0 else page_name(i)
+
+
+def page_html(i, pages, images, docs, revision=0):
+    """Page i of the tree: links to its children (2i+1, 2i+2) and back to its parent."""
+    image = i % images
+    doc = i % docs
+    body = [
+        "<!doctype html><html><head>",
+        f'<meta charset="utf-8"><title>Page {i}</title>',
+        '<link rel="stylesheet" href="/static/site.css">',
+        "</head><body>",
+        f"<h1>Page {i} (revision {revision})</h1>",
+        f'<img src="/files/img{image}.jpg" alt="">',
+        f'<img src="/files/img{(image + 1) % images}.png" srcset="/files/img{(image + 1) % images}-800.png 800w, '
+        f'/files/img{(image + 1) % images}.png 1600w">',
+        f'<picture><source srcset="/files/img{(image + 2) % images}.webp"></picture>',
+        f'<a href="/files/doc{doc}.pdf#page=2">Report</a>',
+        '<a href="/feed.xml">Feed</a>',
+        '<a href="https://example.com/elsewhere">Elsewhere</a>',
+        '<a href="mailto:webmaster@example.com">Mail</a>',
+        '<a href="#top">Top</a>',
+    ]
+    for child in (2 * i + 1, 2 * i + 2):
+        if child < pages:
+            body.append(f'<a href="/{page_name(child)}">Page {child}</a>')
+    if i:
+        # Relative link, resolved against the page's own URL
+        parent = (i - 1) // 2
+        body.append(f'<a href="../{page_path(parent)}">Up</a>')
+    body.append("</body></html>")
+    return "\n".join(body)
+
+
+def page_references(i, pages, images, docs, base_url):
+    """The URLs page i references, as the crawler should index them."""
+    image = i % images
+    refs = {
+        "/static/site.css",
+        f"/files/img{image}.jpg",
+        f"/files/img{(image + 1) % images}.png",
+        f"/files/img{(image + 1) % images}-800.png",
+        f"/files/img{(image + 2) % images}.webp",
+        f"/files/doc{i % docs}.pdf",
+        "/feed.xml",
+    }
+    refs |= {"/" + page_name(child) for child in (2 * i + 1, 2 * i + 2) if child < pages}
+    if i:
+        refs.add("/" + page_path((i - 1) // 2))
+    return {base_url + ref for ref in refs} | {"https://example.com/elsewhere"}
+
+
+def page_url(base_url, i):
+    return f"{base_url}/{page_path(i)}"
+
+
+def generate_site(directory, pages, images=50, docs=20):
+    """Writes the site into directory."""
+    os.makedirs(os.path.join(directory, "pages"), exist_ok=True)
+    for i in range(pages):
+        write_page(directory, i, pages, images, docs)
+    with open(os.path.join(directory, "feed.xml"), "w") as f:
+        f.write('<?xml version="1.0"?><rss version="2.0"><channel><title>Feed</title></channel></rss>')
+
+
+def write_page(directory, i, pages, images=50, docs=20, revision=0):
+    with open(os.path.join(directory, page_name(i)), "w") as f:
+        f.write(page_html(i, pages, images, docs, revision))
+
+
+def ground_truth(base_url, pages, images=50, docs=20):
+    """{referenced URL: {pages referencing it}} for the whole site."""
+    truth = {}
+    for i in range(pages):
+        for ref in page_references(i, pages, images, docs, base_url):
+            truth.setdefault(ref, set()).add(page_url(base_url, i))
+    return truth
+
+
+class SiteHandler(http.server.SimpleHTTPRequestHandler):
+    """Static files with an ETag; If-None-Match answers 304. Counts responses by status."""
+
+    def log_message(self, *args):
+        pass
+
+    def send_head(self):
+        path = self.translate_path(self.path)
+        if os.path.isdir(path):
+            path = os.path.join(path, "index.html")
+        self._etag = None
+        if os.path.isfile(path):
+            stat = os.stat(path)
+            self._etag = '"' + hashlib.md5(f"{stat.st_size}-{stat.st_mtime_ns}".encode()).hexdigest() + '"'
+            if self.headers.get("If-None-Match") == self._etag:
+                self.send_response(304)
+                self.end_headers()
+                return None
+        return super().send_head()
+
+    def send_response(self, code, message=None):
+        self.server.count(code)
+        super().send_response(code, message)
+
+    def end_headers(self):
+        if getattr(self, "_etag", None):
+            self.send_header("ETag", self._etag)
+        super().end_headers()
+
+
+class StaticSite(http.server.ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, directory, port=0):
+        super().__init__(("127.0.0.1", port), functools.partial(SiteHandler, directory=directory))
+        self.directory = directory
+        self.statuses = {}
+        self._lock = threading.Lock()
+
+    def count(self, code):
+        with self._lock:
+            self.statuses[code] = self.statuses.get(code, 0) + 1
+
+    def reset(self):
+        with self._lock:
+            self.statuses = {}
+
+    @property
+    def base_url(self):
+        return f"http://127.0.0.1:{self.server_port}"
+
+    def start(self):
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--dir", help="Site directory (default: a temporary one)")
+    parser.add_argument("--pages", type=int, default=200)
+    parser.add_argument("--port", type=int, default=8766)
+    args = parser.parse_args()
+
+    directory = args.dir or tempfile.mkdtemp(prefix="bench-site-")
+    generate_site(directory, args.pages)
+    server = StaticSite(directory, args.port)
+    print(f"Serving {args.pages} pages from {directory} at {server.base_url}/")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,217 @@
+import hashlib
+import os
+import shutil
+import tempfile
+import threading
+from collections import OrderedDict
+
+STORE_DIRNAME = ".store"
+
+# Disk budget for cached originals; the least recently used ones are evicted past it (None: no limit)
+ORIGINALS_BUDGET = 10 * 1024 ** 3
+
+
+def link_or_copy(src, dst):
+    """Hard-links src to dst (replacing dst atomically), falling back to a copy across filesystems."""
+    if os.path.exists(dst) and os.path.samefile(src, dst):
+        return
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(dst), prefix=".link-")
+    os.close(fd)
+    os.remove(tmp)
+    try:
+        os.link(src, tmp)
+    except OSError:
+        shutil.copyfile(src, tmp)
+    try:
+        os.replace(tmp, dst)
+    finally:
+        # rename() is a no-op that leaves tmp behind when dst was linked to the same file in the meantime
+        if os.path.exists(tmp):
+            os.remove(tmp)
+
+
+class BlobIndex:
+    """
+    Sizes of the blobs under a store, least recently used first, kept within a byte budget.
+    Recency is the file's mtime, which is bumped on every use, so the order carries over between runs.
+    One index is shared by every BlobStore over the same directory in a process (see blob_index).
+    Pinned blobs are in use by this process and are never evicted.
+    """
+
+    def __init__(self, blobs_dir, budget=ORIGINALS_BUDGET):
+        self.blobs_dir = blobs_dir
+        self.budget = budget
+        self.total = 0
+        self._lock = threading.Lock()
+        self._sizes = OrderedDict()  # digest -> bytes, least recently used first
+        self._pins = {}  # digest -> pin count
+        entries = []
+        if os.path.isdir(blobs_dir):
+            for prefix in os.scandir(blobs_dir):
+                if prefix.is_dir():
+                    entries += [(e.stat().st_mtime, e.name, e.stat().st_size) for e in os.scandir(prefix.path) if e.is_file()]
+        for _, digest, size in sorted(entries):
+            self._sizes[digest] = size
+            self.total += size
+
+    def path(self, digest):
+        return os.path.join(self.blobs_dir, digest[:2], digest)
+
+    def touch(self, digest, size=None):
+        """Marks a blob as just used (adding it if new) and evicts past the budget."""
+        path = self.path(digest)
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            self.discard(digest)
+            return
+        with self._lock:
+            if digest not in self._sizes:
+                size = size if size is not None else os.path.getsize(path)
+                self._sizes[digest] = size
+                self.total += size
+            self._sizes.move_to_end(digest)
+        self.evict()
+
+    def discard(self, digest):
+        with self._lock:
+            self.total -= self._sizes.pop(digest, 0)
+
+    def pin(self, digest):
+        with self._lock:
+            self._pins[digest] = self._pins.get(digest, 0) + 1
+
+    def unpin(self, digest):
+        with self._lock:
+            count = self._pins.pop(digest, 0) - 1
+            if count > 0:
+                self._pins[digest] = count
+
+    def evict(self):
+        """Removes least recently used, unpinned blobs until the total fits the budget. Returns bytes freed."""
+        if self.budget is None:
+            return 0
+        freed = 0
+        with self._lock:
+            victims = []
+            for digest, size in self._sizes.items():
+                if self.total - freed <= self.budget:
+                    break
+                if digest not in self._pins:
+                    victims.append(digest)
+                    freed += size
+            for digest in victims:
+                self.total -= self._sizes.pop(digest)
+        for digest in victims:
+            try:
+                os.remove(self.path(digest))
+            except FileNotFoundError:
+                pass
+        return freed
+
+
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+
+def blob_index(blobs_dir, budget=ORIGINALS_BUDGET):
+    """The process-wide BlobIndex for a blobs directory; a later call may change its budget."""
+    key = os.path.abspath(blobs_dir)
+    with _indexes_lock:
+        index = _indexes.get(key)
+        if index is None:
+            index = _indexes[key] = BlobIndex(blobs_dir, budget)
+        else:
+            index.budget = budget
+    index.evict()
+    return index
+
+
+class BlobStore:
+    """
+    Content-addressed store for downloaded originals and their encoded outputs.
+
+    blobs/ab/<sha256>                     one copy of every unique original, whatever URL it came from
+    outputs/ab/<sha256>-<settings><ext>   the encoded output of a blob for one set of encode settings
+
+    Files in download_dir are hard links into the store, so identical images cost disk space once.
+    Originals double as a cache for re-encoding with other settings: they are kept within budget bytes,
+    least recently used first out. Outputs are not evicted.
+    """
+
+    def __init__(self, root, budget=ORIGINALS_BUDGET):
+        self.root = root
+        self.tmp_dir = os.path.join(root, "tmp")
+        os.makedirs(self.tmp_dir, exist_ok=True)
+        self.index = blob_index(os.path.join(root, "blobs"), budget)
+        self._claims_lock = threading.Lock()
+        self._claims = {}  # named output path -> (url, content hash) that owns it
+
+    def blob_path(self, digest):
+        return os.path.join(self.root, "blobs", digest[:2], digest)
+
+    def find_blob(self, digest):
+        """Path of the stored original with this hash, pinned against eviction until unpin(), or None."""
+        path = self.blob_path(digest)
+        self.index.pin(digest)
+        if os.path.exists(path):
+            self.index.touch(digest)
+            if os.path.exists(path):
+                return path
+        self.index.unpin(digest)
+        return None
+
+    def unpin(self, digest):
+        self.index.unpin(digest)
+
+    def output_path(self, digest, settings_key, ext):
+        settings_hash = hashlib.sha256(settings_key.encode()).hexdigest()[:12]
+        return os.path.join(self.root, "outputs", digest[:2], f"{digest}-{settings_hash}{ext}")
+
+    def put(self, spool):
+        """Stores the spooled body under its content hash (once) and returns the blob path."""
+        digest = spool.sha256
+        path = self.blob_path(digest)
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            spool.finish()
+            if spool.in_memory:
+                fd, tmp = tempfile.mkstemp(dir=self.tmp_dir)
+                with os.fdopen(fd, "wb") as f:
+                    f.write(spool.source())
+                os.chmod(tmp, 0o644)  # mkstemp creates files readable by the owner only
+                os.replace(tmp, path)
+            else:
+                link_or_copy(spool.path, path)
+                os.chmod(path, 0o644)
+        self.index.touch(digest, spool.size)
+        return path
+
+    def add_claims(self, owners):
+        """Seeds the named-path owners ({path: (url, content hash)}), e.g. from the manifest of an earlier run."""
+        with self._claims_lock:
+            for path, owner in owners.items():
+                self._claims.setdefault(path, owner)
+
+    def claim(self, named_path, url, digest):
+        """
+        Returns the path in download_dir this URL's content should be written to.
+        A name stays with the URL that first claimed it (or with identical content). A different image
+        with the same file name, e.g. from another folder, gets the first 8 hash characters appended
+        instead of overwriting it.
+        """
+        with self._claims_lock:
+            owner_url, owner_digest = self._claims.setdefault(named_path, (url, digest))
+            if owner_url == url or owner_digest == digest:
+                self._claims[named_path] = (owner_url, digest)
+                return named_path
+            base, ext = os.path.splitext(named_path)
+            path = f"{base}-{digest[:8]}{ext}"
+            self._claims[path] = (url, digest)
+            return path
+
+    def materialize(self, store_path, named_path):
+        """Makes named_path point at a file in the store."""
+        os.makedirs(os.path.dirname(named_path), exist_ok=True)
+        link_or_copy(store_path, named_path)
+        return named_path
@@ -0,0 +1,166 @@
+import os
+import queue
+import threading
+import time
+from contextlib import contextmanager
+from urllib.parse import urlparse
+
+import transport
+
+# selenium is imported where it is used, so importing this module stays cheap for runs that never start a browser
+
+DEFAULT_BROWSERS = 2
+PAGE_LOAD_TIMEOUT = 15
+
+# Cookies without an expiry are reused for this long before being harvested again
+DEFAULT_COOKIE_TTL = 30 * 60
+
+# Where the resolved chromedriver path is remembered between runs
+DRIVER_PATH_CACHE = os.path.join(os.path.expanduser("~"), ".cache", "filter-large-files", "chromedriver-path")
+
+
+def chrome_options():
+    from selenium.webdriver.chrome.options import Options
+    options = Options()
+    options.add_argument("--headless")  # Run in background
+    options.add_argument("--no-sandbox")
+    options.add_argument("--disable-dev-shm-usage")
+    options.add_argument("--disable-gpu")
+    options.add_argument("--window-size=1920,1080")
+    options.add_argument(f"--user-agent={transport.USER_AGENT}")
+    return options
+
+
+def chromedriver_path():
+    """
+    Path to chromedriver. ChromeDriverManager().install() can hit the network, so its answer is
+    cached on disk and reused for as long as the binary it points at still exists.
+    """
+    try:
+        with open(DRIVER_PATH_CACHE) as f:
+            path = f.read().strip()
+        if path and os.path.exists(path):
+            return path
+    except FileNotFoundError:
+        pass
+
+    from webdriver_manager.chrome import ChromeDriverManager
+    path = ChromeDriverManager().install()
+    os.makedirs(os.path.dirname(DRIVER_PATH_CACHE), exist_ok=True)
+    with open(DRIVER_PATH_CACHE, "w") as f:
+        f.write(path)
+    return path
+
+
+def wait_for_page(driver, timeout=PAGE_LOAD_TIMEOUT):
+    """Waits until the document has finished loading instead of sleeping a fixed time."""
+    from selenium.webdriver.support.ui import WebDriverWait
+    WebDriverWait(driver, timeout, poll_frequency=0.1).until(
+        lambda d: d.execute_script("return document.readyState") == "complete"
+    )
+
+
+class BrowserPool:
+    """A fixed number of long-lived headless Chrome drivers, started on demand and shared between threads."""
+
+    def __init__(self, size=DEFAULT_BROWSERS):
+        self.size = max(1, size)
+        self._idle = queue.Queue()
+        self._all = []
+        self._lock = threading.Lock()
+        self._service = None
+
+    def _start_driver(self):
+        from selenium import webdriver
+        from selenium.webdriver.chrome.service import Service
+        if self._service is None:
+            self._service = Service(chromedriver_path())
+        driver = webdriver.Chrome(service=self._service, options=chrome_options())
+        driver.set_page_load_timeout(PAGE_LOAD_TIMEOUT)
+        return driver
+
+    def start(self):
+        """Starts the first driver so setup errors surface before any work is queued."""
+        with self.driver():
+            pass
+
+    @contextmanager
+    def driver(self):
+        driver = None
+        try:
+            driver = self._idle.get_nowait()
+        except queue.Empty:
+            with self._lock:
+                if len(self._all) < self.size:
+                    driver = self._start_driver()
+                    self._all.append(driver)
+            if driver is None:
+                driver = self._idle.get()
+        try:
+            yield driver
+        finally:
+            self._idle.put(driver)
+
+    def close(self):
+        with self._lock:
+            for driver in self._all:
+                try:
+                    driver.quit()
+                except Exception:
+                    pass
+            self._all = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+        return False
+
+
+class CookieCache:
+    """
+    Browser cookies harvested once per host and reused for every download from that host,
+    until the earliest cookie expires or the host answers 403 again.
+    """
+
+    def __init__(self, pool):
+        self.pool = pool
+        self._entries = {}  # host -> (cookies, expires_at)
+        self._locks = {}
+        self._lock = threading.Lock()
+
+    def _host_lock(self, host):
+        with self._lock:
+            return self._locks.setdefault(host, threading.Lock())
+
+    def get(self, url):
+        """Cookies for url's host, visiting url in a browser first if there are none (or they went stale)."""
+        host = urlparse(url).netloc.lower()
+        # One harvest per host at a time; other threads for the same host wait for its result
+        with self._host_lock(host):
+            entry = self._entries.get(host)
+            if entry and entry[1] > time.time():
+                return entry[0]
+            cookies, expires_at = self._harvest(url)
+            self._entries[host] = (cookies, expires_at)
+            return cookies
+
+    def invalidate(self, url, cookies):
+        """Drops the cached cookies for url's host if they are still the ones that just got a 403."""
+        host = urlparse(url).netloc.lower()
+        with self._host_lock(host):
+            entry = self._entries.get(host)
+            if entry and entry[0] is cookies:
+                del self._entries[host]
+
+    def _harvest(self, url):
+        print(f"🍪 Harvesting cookies from {url}")
+        with self.pool.driver() as driver:
+            driver.get(url)
+            wait_for_page(driver)
+            raw = driver.get_cookies()
+        cookies = {cookie['name']: cookie['value'] for cookie in raw}
+        expiries = [cookie['expiry'] for cookie in raw if cookie.get('expiry')]
+        expires_at = min(expiries) if expiries else time.time() + DEFAULT_COOKIE_TTL
+        return cookies, expires_at
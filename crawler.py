@@ -0,0 +1,298 @@
+import sqlite3
+import threading
+import time
+from html.parser import HTMLParser
+from urllib.parse import unquote, urldefrag, urljoin, urlparse, urlunparse
+
+import metrics
+import transport
+from fetch_engine import FetchEngine, FetchJob, DEFAULT_WORKERS, DEFAULT_PER_HOST
+
+CRAWL_INDEX_FILENAME = "crawl-index.sqlite3"
+
+# Stop after this many pages per run, and this many links away from the seeds
+MAX_PAGES = 20000
+MAX_DEPTH = 10
+
+# Links to these are recorded as references but never fetched as pages
+ASSET_EXTENSIONS = (".jpg", ".jpeg", ".png", ".gif", ".webp", ".svg", ".ico", ".bmp", ".tif", ".tiff",
+                    ".pdf", ".doc", ".docx", ".xls", ".xlsx", ".ppt", ".pptx", ".zip",
+                    ".mp3", ".mp4", ".mov", ".webm", ".css", ".js", ".woff", ".woff2", ".ttf")
+
+# Pages fetched per round; each round's results are committed to the index before the next starts
+BATCH_SIZE = 200
+
+# Attributes that reference other URLs, by tag
+URL_ATTRIBUTES = {
+    "a": ("href",),
+    "area": ("href",),
+    "link": ("href",),
+    "img": ("src", "data-src"),
+    "source": ("src",),
+    "video": ("src", "poster"),
+    "audio": ("src",),
+    "embed": ("src",),
+    "iframe": ("src",),
+    "script": ("src",),
+    "object": ("data",),
+}
+SRCSET_ATTRIBUTES = ("srcset", "data-srcset")
+
+
+def normalize_url(url):
+    """
+    The form URLs are compared in: no fragment, lower-case scheme and host, decoded path, no default port.
+    The query string is kept, except on assets, where it is usually a cache-buster.
+    """
+    url, _ = urldefrag(url.strip())
+    parts = urlparse(url)
+    netloc = parts.netloc.lower()
+    if (parts.scheme == "http" and netloc.endswith(":80")) or (parts.scheme == "https" and netloc.endswith(":443")):
+        netloc = netloc.rsplit(":", 1)[0]
+    path = unquote(parts.path) or "/"
+    query = "" if is_asset(path) else parts.query
+    return urlunparse((parts.scheme.lower(), netloc, path, "", query, ""))
+
+
+def is_asset(url):
+    return urlparse(url).path.lower().endswith(ASSET_EXTENSIONS)
+
+
+def parse_srcset(value):
+    """URLs of a srcset attribute ('a.jpg 1x, b.jpg 2x' -> ['a.jpg', 'b.jpg'])."""
+    return [candidate.split()[0] for candidate in value.split(",") if candidate.strip()]
+
+
+class ReferenceParser(HTMLParser):
+    """Collects every URL a page references through URL_ATTRIBUTES and srcset, resolved against the page."""
+
+    def __init__(self, base_url):
+        super().__init__(convert_charrefs=True)
+        self.base_url = base_url
+        self.references = set()
+
+    def handle_starttag(self, tag, attrs):
+        attrs = dict(attrs)
+        if tag == "base" and attrs.get("href"):
+            self.base_url = urljoin(self.base_url, attrs["href"])
+            return
+        values = [attrs.get(name) for name in URL_ATTRIBUTES.get(tag, ())]
+        for name in SRCSET_ATTRIBUTES:
+            if attrs.get(name):
+                values += parse_srcset(attrs[name])
+        for value in values:
+            if value and not value.startswith(("data:", "javascript:", "mailto:", "tel:", "#")):
+                url = urljoin(self.base_url, value.strip())
+                if urlparse(url).scheme in ("http", "https"):
+                    self.references.add(normalize_url(url))
+
+    handle_startendtag = handle_starttag
+
+
+def extract_references(html, base_url):
+    parser = ReferenceParser(base_url)
+    parser.feed(html)
+    parser.close()
+    return parser.references
+
+
+class CrawlIndex:
+    """
+    On-disk crawl state and inverted index (SQLite), so a crawl can stop at any point and resume.
+
+    pages: every page seen, with its crawl status ('queued', 'done', 'failed'), depth and validators
+    refs:  asset or page URL -> the pages that reference it
+
+    A page's references are replaced together with its status in one transaction, so the index never
+    holds half a page.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript("""
+            CREATE TABLE IF NOT EXISTS pages (
+                url TEXT PRIMARY KEY,
+                status TEXT NOT NULL,
+                depth INTEGER NOT NULL,
+                etag TEXT,
+                last_modified TEXT,
+                crawled_at REAL
+            );
+            CREATE INDEX IF NOT EXISTS pages_status ON pages (status, depth);
+            CREATE TABLE IF NOT EXISTS refs (
+                target TEXT NOT NULL,
+                page TEXT NOT NULL,
+                PRIMARY KEY (target, page)
+            );
+            CREATE INDEX IF NOT EXISTS refs_page ON refs (page);
+        """)
+        self._conn.commit()
+
+    def enqueue(self, urls, depth):
+        """Queues pages not seen before; returns how many were new."""
+        with self._lock, self._conn:
+            before = self._conn.total_changes
+            self._conn.executemany("INSERT OR IGNORE INTO pages (url, status, depth) VALUES (?, 'queued', ?)",
+                                   [(url, depth) for url in urls])
+            return self._conn.total_changes - before
+
+    def requeue_stale(self, max_age):
+        """Queues pages crawled more than max_age seconds ago again (they are revalidated, not refetched blindly)."""
+        with self._lock, self._conn:
+            return self._conn.execute("UPDATE pages SET status = 'queued' WHERE status != 'queued' AND "
+                                      "(crawled_at IS NULL OR crawled_at < ?)", (time.time() - max_age,)).rowcount
+
+    def queued(self, limit, max_depth=MAX_DEPTH):
+        with self._lock:
+            rows = self._conn.execute("SELECT url, depth, etag, last_modified FROM pages WHERE status = 'queued' "
+                                      "AND depth <= ? ORDER BY depth, rowid LIMIT ?", (max_depth, limit)).fetchall()
+        return [{"url": url, "depth": depth, "etag": etag, "last_modified": last_modified}
+                for url, depth, etag, last_modified in rows]
+
+    def record(self, page, status, references=None, etag=None, last_modified=None):
+        """Stores a crawled page; references (if not None) replace the ones it had."""
+        with self._lock, self._conn:
+            self._conn.execute("UPDATE pages SET status = ?, etag = COALESCE(?, etag), "
+                               "last_modified = COALESCE(?, last_modified), crawled_at = ? WHERE url = ?",
+                               (status, etag, last_modified, time.time(), page))
+            if references is not None:
+                self._conn.execute("DELETE FROM refs WHERE page = ?", (page,))
+                self._conn.executemany("INSERT OR IGNORE INTO refs (target, page) VALUES (?, ?)",
+                                       [(target, page) for target in references])
+
+    def pages_referencing(self, url):
+        """Pages referencing url, whether they link to it over http or https."""
+        url = normalize_url(url)
+        variants = {url, "https:" + url.split(":", 1)[1], "http:" + url.split(":", 1)[1]} if ":" in url else {url}
+        with self._lock:
+            rows = self._conn.execute(f"SELECT DISTINCT page FROM refs WHERE target IN ({', '.join('?' * len(variants))}) "
+                                      "ORDER BY page", tuple(variants)).fetchall()
+        return [row[0] for row in rows]
+
+    def lookup(self, urls):
+        """{url: [pages referencing it]} for many URLs at once."""
+        return {url: self.pages_referencing(url) for url in urls}
+
+    def counts(self):
+        with self._lock:
+            statuses = dict(self._conn.execute("SELECT status, COUNT(*) FROM pages GROUP BY status").fetchall())
+            refs = self._conn.execute("SELECT COUNT(*) FROM refs").fetchone()[0]
+        return statuses, refs
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+        return False
+
+
+class NotHtml(Exception):
+    pass
+
+
+def fetch_page(url, etag=None, last_modified=None):
+    """
+    GETs a page, conditionally when validators are known. Returns (html or None if unchanged, etag,
+    last_modified, final URL). Non-HTML responses raise NotHtml without their body being read.
+    """
+    headers = {}
+    if etag:
+        headers["If-None-Match"] = etag
+    if last_modified:
+        headers["If-Modified-Since"] = last_modified
+    with metrics.stage("crawl", items=1):
+        response = transport.get(url, headers=headers, stream=True)
+        try:
+            validators = response.headers.get("ETag"), response.headers.get("Last-Modified")
+            if response.status_code == 304:
+                return (None, *validators, url)
+            response.raise_for_status()
+            if "html" not in response.headers.get("Content-Type", "text/html"):
+                raise NotHtml(response.headers.get("Content-Type"))
+            body = response.content
+            metrics.add("crawl", bytes_in=len(body))
+            text = body.decode(response.encoding or response.apparent_encoding or "utf-8", errors="replace")
+            return (text, *validators, response.url)
+        finally:
+            response.close()
+
+
+class Crawler:
+    """
+    Breadth-first crawl of the seed sites on the FetchEngine (bounded threads, per-host cap, pooled session).
+    Only pages on the seeds' hosts (or allowed_hosts) are followed; every reference is indexed.
+    Progress lives in the CrawlIndex, so an interrupted crawl resumes where it stopped. A rerun with
+    max_age revalidates pages older than that with conditional GETs and reparses only the changed ones.
+    """
+
+    def __init__(self, index, seeds, allowed_hosts=(), max_workers=DEFAULT_WORKERS, per_host=DEFAULT_PER_HOST,
+                 max_pages=MAX_PAGES, max_depth=MAX_DEPTH):
+        self.index = index
+        self.seeds = [normalize_url(seed) for seed in seeds]
+        self.hosts = {urlparse(seed).netloc for seed in self.seeds} | {host.lower() for host in allowed_hosts}
+        self.engine = FetchEngine(max_workers, per_host)
+        self.max_pages = max_pages
+        self.max_depth = max_depth
+
+    def follows(self, url):
+        return urlparse(url).netloc in self.hosts and not is_asset(url)
+
+    def run(self, max_age=None):
+        """Crawls until nothing is queued or max_pages were fetched. Returns {status: pages} for this run."""
+        self.index.enqueue(self.seeds, 0)
+        if max_age is not None:
+            requeued = self.index.requeue_stale(max_age)
+            if requeued:
+                print(f"🔁 Revalidating {requeued} pages crawled more than {max_age / 3600:.1f}h ago")
+        totals = {"changed": 0, "unchanged": 0, "failed": 0, "skipped": 0}
+        fetched = 0
+        while fetched < self.max_pages:
+            batch = self.index.queued(min(BATCH_SIZE, self.max_pages - fetched), self.max_depth)
+            if not batch:
+                break
+            jobs = [FetchJob(i, page["url"], data=page) for i, page in enumerate(batch)]
+
+            def fetch(job):
+                return fetch_page(job.url, job.data["etag"], job.data["last_modified"])
+
+            for result in self.engine.run(jobs, fetch):
+                fetched += 1
+                page = result.job.data
+                if isinstance(result.error, NotHtml):
+                    self.index.record(page["url"], "done", references=())
+                    totals["skipped"] += 1
+                    continue
+                if not result.ok:
+                    self.index.record(page["url"], "failed")
+                    totals["failed"] += 1
+                    print(f"❌ {page['url']}: {result.error}")
+                    continue
+                html, etag, last_modified, final_url = result.value
+                if html is None:
+                    self.index.record(page["url"], "done", etag=etag, last_modified=last_modified)
+                    totals["unchanged"] += 1
+                    continue
+                with metrics.stage("crawl_parse", items=1):
+                    references = extract_references(html, final_url)
+                self.index.record(page["url"], "done", references, etag, last_modified)
+                self.index.enqueue([url for url in references if self.follows(url)], page["depth"] + 1)
+                totals["changed"] += 1
+            statuses, refs = self.index.counts()
+            print(f"🕸️ {fetched} pages fetched this run; {statuses.get('done', 0)} done, "
+                  f"{statuses.get('queued', 0)} queued, {refs} references indexed")
+        return totals
+
+
+def found_on_site_text(pages, limit):
+    """Cell text for a list of referencing pages: one per line, at most `limit` of them."""
+    if len(pages) <= limit:
+        return "\n".join(pages)
+    return "\n".join(pages[:limit] + [f"… and {len(pages) - limit} more"])
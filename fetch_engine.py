@@ -0,0 +1,159 @@
+import contextvars
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from concurrent.futures import Future, ThreadPoolExecutor, FIRST_COMPLETED, wait
+from dataclasses import dataclass, field
+from urllib.parse import urlparse
+
+import metrics
+
+# Global worker count and per-host cap (keeps law.stanford.edu from being hammered)
+DEFAULT_WORKERS = 8
+DEFAULT_PER_HOST = 4
+
+
+@dataclass
+class FetchJob:
+    row_idx: int
+    url: str
+    data: dict = field(default_factory=dict)
+    size: int = None  # bytes, from the report's "Size" column, used for scheduling
+
+    @property
+    def host(self):
+        return urlparse(self.url).netloc.lower()
+
+
+@dataclass
+class FetchResult:
+    job: FetchJob
+    value: object = None
+    error: Exception = None
+    skipped: bool = False  # True when the job needed no work (e.g. unchanged since the last run)
+    started: float = None  # time.perf_counter() when the job started, and when it finished
+    finished: float = None
+
+    @property
+    def ok(self):
+        return self.error is None
+
+    @property
+    def seconds(self):
+        return self.finished - self.started if self.started is not None and self.finished is not None else None
+
+
+class FetchEngine:
+    """
+    Runs a fetch function over many jobs on a thread pool.
+    At most `max_workers` jobs run at once and at most `per_host` connections hit the same host,
+    counting the extra ones a job borrows (e.g. the byte ranges of a large download).
+    """
+
+    def __init__(self, max_workers=DEFAULT_WORKERS, per_host=DEFAULT_PER_HOST):
+        self.max_workers = max(1, max_workers)
+        self.per_host = max(1, per_host)
+        self._in_flight = {}  # host -> connections open on it: running jobs plus borrowed ones
+        self._lock = threading.Lock()
+
+    def _take(self, host, wanted):
+        with self._lock:
+            count = max(0, min(wanted, self.per_host - self._in_flight.get(host, 0)))
+            self._in_flight[host] = self._in_flight.get(host, 0) + count
+            return count
+
+    def _give_back(self, host, count):
+        with self._lock:
+            self._in_flight[host] -= count
+
+    @contextmanager
+    def borrow(self, host, wanted):
+        """
+        For a running job that opens more connections to its host: takes up to `wanted` of the host's
+        free slots without waiting and yields how many it got (possibly 0). Queued jobs for the host
+        wait until they are given back.
+        """
+        count = self._take(host, wanted)
+        try:
+            yield count
+        finally:
+            self._give_back(host, count)
+
+    def run(self, jobs, fetch):
+        """
+        Calls fetch(job) for every job and yields a FetchResult for each one as it completes.
+        Results are yielded on the calling thread, so sheet updates can happen there safely.
+        Each fetch runs in a copy of the caller's contextvars (e.g. the audit label of its prints).
+        """
+        queues = {}
+        for job in jobs:
+            queues.setdefault(job.host, deque()).append(job)
+
+        futures = {}
+
+        pool = ThreadPoolExecutor(max_workers=self.max_workers)
+        try:
+            while queues or futures:
+                # Hand out work round-robin across hosts until the pool or every host cap is full
+                progress = True
+                while progress and len(futures) < self.max_workers:
+                    progress = False
+                    for host in list(queues):
+                        if len(futures) >= self.max_workers:
+                            break
+                        if not self._take(host, 1):
+                            continue
+                        job = queues[host].popleft()
+                        if not queues[host]:
+                            del queues[host]
+                        futures[pool.submit(contextvars.copy_context().run, fetch, job)] = job, time.perf_counter()
+                        progress = True
+
+                done, _ = wait(futures, return_when=FIRST_COMPLETED)
+                for future in done:
+                    job, started = futures.pop(future)
+                    self._give_back(job.host, 1)
+                    try:
+                        result = FetchResult(job, value=future.result())
+                    except Exception as e:
+                        result = FetchResult(job, error=e)
+                    result.started, result.finished = started, time.perf_counter()
+                    metrics.observe("fetch_job", result.seconds)
+                    yield result
+        finally:
+            # Stop queued work if the caller bails out early
+            pool.shutdown(wait=True, cancel_futures=True)
+            for job, _ in futures.values():
+                self._give_back(job.host, 1)
+
+
+class SharedFetches:
+    """
+    Fetch-once registry for runs that process several audits at the same time.
+    The first caller for a URL runs the fetch; callers for the same URL, concurrent or later,
+    wait for it and get the same value. A failed fetch is forgotten so a later caller can retry.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._futures = {}  # url -> Future
+
+    def fetch(self, url, fn):
+        """Returns (value, fetched), where fetched is False when the value came from another caller."""
+        with self._lock:
+            future = self._futures.get(url)
+            fetched = future is None
+            if fetched:
+                future = self._futures[url] = Future()
+        if fetched:
+            try:
+                future.set_result(fn())
+            except BaseException as e:
+                with self._lock:
+                    del self._futures[url]
+                future.set_exception(e)
+        return future.result(), fetched
+
+    def __len__(self):
+        return len(self._futures)
@@ -0,0 +1,335 @@
+import itertools
+import random
+from collections import deque
+from dataclasses import dataclass, field
+
+from gspread.exceptions import WorksheetNotFound
+from gspread.utils import a1_range_to_grid_range
+
+import metrics
+import sheet_cache
+from size_index import SizeIndex, parse_size
+
+SOURCE_TAB = '500 largest files'
+NOTES_TAB = 'Notes'
+OUTPUT_HEADERS = ["Size", "Location", "Found on site"]
+
+# Report paths are site-relative; this turns them into public URLs
+SITE_PATH_PREFIX = "/sites/stanfordlaw"
+SITE_URL = "https://law.stanford.edu"
+
+TRANSFERRED_COL = 5  # Column E = "Transferred" checkbox in the source tab
+
+# Rows are matched on this column in incremental runs; of the output columns, only these are refreshed.
+# Everything else in the tab (Found on site, Title, Download, Status, ...) belongs to later stages and users.
+KEY_HEADER = "Location"
+REFRESHED_HEADERS = ("Size",)
+
+@dataclass(frozen=True)
+class FilterRule:
+    """
+    Declarative routing rule: rows of the source report that match go to `tab`.
+    Empty criteria match everything; a row is copied to every tab whose rule it matches.
+    """
+    tab: str
+    extensions: tuple = ()      # e.g. (".jpg", ".png"), compared case-insensitively
+    path_prefixes: tuple = ()   # on the raw report Location, e.g. ("/sites/stanfordlaw/files/",)
+    min_size: int = None        # bytes, inclusive
+    max_size: int = None        # bytes, inclusive
+    mark_transferred: bool = True
+
+    def matches(self, location, size_bytes):
+        lowered = location.strip().lower()
+        if self.extensions and not lowered.endswith(tuple(ext.lower() for ext in self.extensions)):
+            return False
+        if self.path_prefixes and not location.strip().startswith(self.path_prefixes):
+            return False
+        if self.min_size is not None and (size_bytes is None or size_bytes < self.min_size):
+            return False
+        if self.max_size is not None and (size_bytes is None or size_bytes > self.max_size):
+            return False
+        return True
+
+
+DEFAULT_RULES = (FilterRule("Images", extensions=(".jpg", ".png")),)
+
+
+def public_url(location):
+    return location.replace(SITE_PATH_PREFIX, SITE_URL, 1)
+
+
+def route_rows(all_values, rules, skip_marked=False):
+    """
+    Applies every rule to the report in a single pass; all_values may be any iterable of rows, header first.
+    Returns ({tab: [output rows]}, [source row numbers to mark as transferred], number of source rows).
+    With skip_marked, rows whose Transferred cell already holds a value are not listed for marking.
+    """
+    all_values = iter(all_values)
+    headers = next(all_values)
+    location_idx = headers.index("Location")
+    size_idx = headers.index("Size")
+
+    outputs = {rule.tab: [] for rule in rules}
+    transferred = []
+    row_num = 1
+    for row_num, row in enumerate(all_values, start=2):  # account for header offset
+        location = row[location_idx] if len(row) > location_idx else ""
+        size = row[size_idx] if len(row) > size_idx else ""
+        size_bytes = parse_size(size)
+        marked = False
+        for rule in rules:
+            if rule.matches(location, size_bytes):
+                outputs[rule.tab].append([size, public_url(location), ""])  # No "Found on site" content
+                marked = marked or rule.mark_transferred
+        if marked and not (skip_marked and len(row) >= TRANSFERRED_COL and row[TRANSFERRED_COL - 1] != ""):
+            transferred.append(row_num)
+    return outputs, transferred, row_num
+
+
+def cell_value(value):
+    if isinstance(value, bool):
+        return {"userEnteredValue": {"boolValue": value}}
+    if isinstance(value, (int, float)):
+        return {"userEnteredValue": {"numberValue": value}}
+    return {"userEnteredValue": {"stringValue": "" if value is None else str(value)}}
+
+
+def update_cells_request(sheet_id, start_row, start_col, rows):
+    """updateCells request writing rows starting at the zero-based (start_row, start_col)."""
+    return {
+        "updateCells": {
+            "start": {"sheetId": sheet_id, "rowIndex": start_row, "columnIndex": start_col},
+            "rows": [{"values": [cell_value(v) for v in row]} for row in rows],
+            "fields": "userEnteredValue",
+        }
+    }
+
+
+def checkbox_request(sheet_id, a1_range):
+    return {
+        "setDataValidation": {
+            "range": a1_range_to_grid_range(a1_range, sheet_id),
+            "rule": {"condition": {"type": "BOOLEAN"}, "showCustomUi": True},
+        }
+    }
+
+
+def contiguous_runs(numbers):
+    """Groups sorted row numbers into (first, last) runs of consecutive numbers."""
+    runs = []
+    for n in numbers:
+        if runs and n == runs[-1][1] + 1:
+            runs[-1][1] = n
+        else:
+            runs.append([n, n])
+    return [tuple(run) for run in runs]
+
+
+def new_sheet_id(taken):
+    while True:
+        sheet_id = random.randint(1, 2 ** 31 - 1)
+        if sheet_id not in taken:
+            taken.add(sheet_id)
+            return sheet_id
+
+
+def create_tab_requests(tab, rows, existing, taken):
+    """Requests that (re)create an output tab holding just the header and rows."""
+    requests = []
+    if tab in existing:
+        requests.append({"deleteSheet": {"sheetId": existing[tab]}})
+    sheet_id = new_sheet_id(taken)
+    requests.append({"addSheet": {"properties": {
+        "sheetId": sheet_id,
+        "title": tab,
+        "gridProperties": {"rowCount": len(rows) + 1, "columnCount": len(OUTPUT_HEADERS)},
+    }}})
+    requests.append(update_cells_request(sheet_id, 0, 0, [OUTPUT_HEADERS] + rows))
+    return requests
+
+
+def source_requests(source_id, source_rows, transferred):
+    """Transferred checkboxes for the source report."""
+    requests = []
+    col_letter = chr(ord("A") + TRANSFERRED_COL - 1)
+    for first, last in contiguous_runs(transferred):
+        requests.append(update_cells_request(source_id, first - 1, TRANSFERRED_COL - 1, [[False]] * (last - first + 1)))
+    if source_rows > 1:
+        requests.append(checkbox_request(source_id, f"{col_letter}2:{col_letter}{source_rows}"))
+    return requests
+
+
+def notes_requests(existing, outputs, taken):
+    if NOTES_TAB in existing or NOTES_TAB in outputs:
+        return []
+    return [{"addSheet": {"properties": {
+        "sheetId": new_sheet_id(taken),
+        "title": NOTES_TAB,
+        "gridProperties": {"rowCount": 100, "columnCount": 5},
+    }}}]
+
+
+def build_requests(existing, source_id, source_rows, outputs, transferred):
+    """
+    Every change of a filter run as one list of batchUpdate requests:
+    recreate each output tab with its rows, tick-box the transferred source rows, ensure the Notes tab.
+    `existing` maps current tab titles to sheet IDs.
+    """
+    taken = set(existing.values())
+    requests = []
+    for tab, rows in outputs.items():
+        requests += create_tab_requests(tab, rows, existing, taken)
+    return requests + source_requests(source_id, source_rows, transferred) + notes_requests(existing, outputs, taken)
+
+
+@dataclass
+class TabDiff:
+    """What an incremental filter run changes in one output tab (sheet row numbers of the current tab)."""
+    added: list = field(default_factory=list)      # output rows to append
+    removed: list = field(default_factory=list)    # row numbers no longer in the report
+    changed: list = field(default_factory=list)    # (row number, {column: new value})
+    unchanged: int = 0
+    recreated: bool = False                        # tab was missing or had no Location column
+
+    @property
+    def empty(self):
+        return not (self.added or self.removed or self.changed or self.recreated)
+
+
+def diff_tab(current, rows):
+    """
+    Matches the output rows to the tab's current values by Location and returns a TabDiff.
+    Rows sharing a Location are paired in order; leftovers on either side count as added or removed.
+    """
+    headers = current[0] if current else []
+    if KEY_HEADER not in headers:
+        return TabDiff(added=rows, recreated=True)
+    key_idx = headers.index(KEY_HEADER)
+    out_key = OUTPUT_HEADERS.index(KEY_HEADER)
+    refreshed = [(OUTPUT_HEADERS.index(name), headers.index(name) + 1) for name in REFRESHED_HEADERS if name in headers]
+
+    existing = {}
+    for row_num, row in enumerate(current[1:], start=2):
+        key = row[key_idx].strip() if len(row) > key_idx else ""
+        if key:
+            existing.setdefault(key, deque()).append((row_num, row))
+
+    diff = TabDiff()
+    for row in rows:
+        matches = existing.get(row[out_key].strip())
+        if not matches:
+            diff.added.append(row)
+            continue
+        row_num, old = matches.popleft()
+        changes = {col: row[out_idx] for out_idx, col in refreshed
+                   if (old[col - 1] if len(old) >= col else "") != str(row[out_idx])}
+        if changes:
+            diff.changed.append((row_num, changes))
+        else:
+            diff.unchanged += 1
+    diff.removed = sorted(row_num for matches in existing.values() for row_num, _ in matches)
+    return diff
+
+
+def diff_requests(sheet_id, headers, diff):
+    """
+    batchUpdate requests applying a TabDiff: changed cells first (at their current rows), then row
+    deletions bottom-up so the row numbers above stay valid, then the new rows appended at the end.
+    """
+    requests = []
+    columns = {}  # col -> {row number: value}
+    for row_num, changes in diff.changed:
+        for col, value in changes.items():
+            columns.setdefault(col, {})[row_num] = value
+    for col, values in sorted(columns.items()):
+        for first, last in contiguous_runs(sorted(values)):
+            requests.append(update_cells_request(sheet_id, first - 1, col - 1,
+                                                 [[values[row_num]] for row_num in range(first, last + 1)]))
+    for first, last in reversed(contiguous_runs(diff.removed)):
+        requests.append({"deleteDimension": {"range": {
+            "sheetId": sheet_id, "dimension": "ROWS", "startIndex": first - 1, "endIndex": last,
+        }}})
+    if diff.added:
+        # New rows carry the output columns wherever the tab has them; other columns stay blank
+        placed = [(i, headers.index(name)) for i, name in enumerate(OUTPUT_HEADERS) if name in headers]
+        width = max(pos for _, pos in placed) + 1
+        appended = []
+        for row in diff.added:
+            cells = [""] * width
+            for out_idx, pos in placed:
+                cells[pos] = row[out_idx]
+            appended.append({"values": [cell_value(v) for v in cells]})
+        requests.append({"appendCells": {"sheetId": sheet_id, "rows": appended, "fields": "userEnteredValue"}})
+    return requests
+
+
+def read_source(spreadsheet, source_tab=SOURCE_TAB):
+    """Returns (the spreadsheet's worksheets, {title: sheet ID}, the source worksheet, its rows header first)."""
+    with metrics.stage("sheet_read"):
+        worksheets = spreadsheet.worksheets()
+    existing = {ws.title: ws.id for ws in worksheets}
+    source_ws = next((ws for ws in worksheets if ws.title == source_tab), None)
+    if source_ws is None:
+        raise WorksheetNotFound(source_tab)
+
+    if hasattr(source_ws, "iter_rows"):
+        # Local exports can run to millions of rows; stream them instead of loading the whole report
+        all_values = itertools.chain.from_iterable(source_ws.iter_rows())
+    else:
+        all_values = sheet_cache.get_all_values(source_ws)
+    return worksheets, existing, source_ws, all_values
+
+
+def run_filters(spreadsheet, rules=DEFAULT_RULES, source_tab=SOURCE_TAB):
+    """
+    Reads the source report once, routes its rows through the rules and commits every output tab,
+    checkbox and the Notes tab in a single batch_update.
+    Returns {tab: SizeIndex of the rows copied there}, built from their parsed "Size" values.
+    """
+    _, existing, source_ws, all_values = read_source(spreadsheet, source_tab)
+    with metrics.stage("filter"):
+        outputs, transferred, source_rows = route_rows(all_values, rules)
+        requests = build_requests(existing, source_ws.id, source_rows, outputs, transferred)
+        metrics.add("filter", items=source_rows - 1)
+
+    with metrics.stage("write_back", items=len(requests)):
+        spreadsheet.batch_update({"requests": requests})
+    sheet_cache.invalidate(spreadsheet)
+    return {tab: SizeIndex.from_rows(rows, lambda row: row[0]) for tab, rows in outputs.items()}
+
+
+def run_incremental_filters(spreadsheet, rules=DEFAULT_RULES, source_tab=SOURCE_TAB):
+    """
+    Like run_filters, but updates existing output tabs in place: rows are matched by Location, new rows
+    are appended, rows gone from the report are deleted and changed sizes are rewritten. Every other
+    column (Title, Download, Status, notes, ...) is left as it is. Only unmarked source rows get a checkbox.
+    Returns ({tab: SizeIndex of the tab's rows}, {tab: TabDiff}); nothing is written if nothing changed.
+    """
+    worksheets, existing, source_ws, all_values = read_source(spreadsheet, source_tab)
+    by_title = {ws.title: ws for ws in worksheets}
+    with metrics.stage("filter"):
+        outputs, transferred, source_rows = route_rows(all_values, rules, skip_marked=True)
+        metrics.add("filter", items=source_rows - 1)
+
+    taken = set(existing.values())
+    diffs = {}
+    requests = []
+    for tab, rows in outputs.items():
+        ws = by_title.get(tab)
+        current = sheet_cache.get_all_values(ws) if ws is not None else []
+        with metrics.stage("filter"):
+            diff = diff_tab(current, rows)
+            if diff.recreated:
+                requests += create_tab_requests(tab, rows, existing, taken)
+            else:
+                requests += diff_requests(ws.id, current[0], diff)
+        diffs[tab] = diff
+    if transferred:
+        requests += source_requests(source_ws.id, source_rows, transferred)
+    requests += notes_requests(existing, outputs, taken)
+
+    if requests:
+        with metrics.stage("write_back", items=len(requests)):
+            spreadsheet.batch_update({"requests": requests})
+        sheet_cache.invalidate(spreadsheet)
+    return {tab: SizeIndex.from_rows(rows, lambda row: row[0]) for tab, rows in outputs.items()}, diffs
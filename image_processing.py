@@ -0,0 +1,208 @@
+import json
+import os
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import asdict, dataclass
+from io import BytesIO
+
+from PIL import Image
+
+import metrics
+
+# Final resample filter once the decoder has done the coarse downscaling
+RESAMPLE = Image.LANCZOS
+
+# JPEGs are decoded at the smallest DCT scale (1/2, 1/4, 1/8) that is still at least this many times the target,
+# so one LANCZOS pass over at most 2x the target finishes the job (thumbnail() keeps 2x, decoding far more)
+DRAFT_GAP = 1.0
+# Other formats are box-reduced in resize() until they are this many times larger than the target
+REDUCING_GAP = 2.0
+
+
+# Output formats by name and by file extension: (Pillow format, extension)
+FORMATS = {
+    "jpeg": ("JPEG", ".jpg"),
+    "jpg": ("JPEG", ".jpg"),
+    "png": ("PNG", ".png"),
+    "webp": ("WEBP", ".webp"),
+}
+EXTENSION_FORMATS = {".jpg": "JPEG", ".jpeg": "JPEG", ".png": "PNG", ".webp": "WEBP"}
+
+# Upper bound on the threads writing one image's renditions
+MAX_ENCODE_THREADS = 4
+
+
+@dataclass(frozen=True)
+class Rendition:
+    """
+    An extra, smaller output of each image, e.g. Rendition(800) for an 800px-wide responsive copy.
+    height None means only the width is bounded; format None keeps the main output's format and
+    quality None its quality. Saved next to the main output as <name>-<label><ext>.
+    """
+    width: int
+    height: int = None
+    format: str = None
+    quality: int = None
+
+    @property
+    def max_size(self):
+        return self.width, self.height or 1 << 30
+
+    @property
+    def label(self):
+        return f"{self.width}x{self.height}" if self.height else f"{self.width}w"
+
+
+@dataclass(frozen=True)
+class EncodeSettings:
+    max_size: tuple = (2000, 2000)  # Fit within 2000x2000 box
+    quality: int = 95
+    optimize: bool = True
+    keep_icc: bool = True
+    renditions: tuple = ()  # Rendition()s made from the same decode
+
+    def key(self):
+        """Stable string form, used to tell whether an output was made with the same settings."""
+        settings = asdict(self)
+        if not self.renditions:
+            del settings["renditions"]  # keeps the key of outputs made before renditions existed
+        return json.dumps(settings, sort_keys=True)
+
+
+def parse_rendition(spec):
+    """'800', '1200x800', '800:webp' or '400:jpeg:70' -> Rendition."""
+    size, _, rest = spec.strip().partition(":")
+    fmt, _, quality = rest.partition(":")
+    width, _, height = size.lower().partition("x")
+    if fmt and fmt.lower() not in FORMATS:
+        raise ValueError(f"Unknown rendition format {fmt!r}, expected one of {', '.join(FORMATS)}")
+    return Rendition(int(width), int(height) if height else None, fmt.lower() or None, int(quality) if quality else None)
+
+
+def rendition_path(output_path, rendition):
+    """Where a rendition of the image saved at output_path goes."""
+    base, ext = os.path.splitext(output_path)
+    if rendition.format:
+        ext = FORMATS[rendition.format][1]
+    return f"{base}-{rendition.label}{ext}"
+
+
+def target_size(size, max_size):
+    """Largest size with the same aspect ratio that fits within max_size, or None if it already fits."""
+    width, height = size
+    max_width, max_height = max_size
+    if width <= max_width and height <= max_height:
+        return None
+    scale = min(max_width / width, max_height / height)
+    return max(1, round(width * scale)), max(1, round(height * scale))
+
+
+def fit_within(image, max_size):
+    """
+    Returns image scaled down to fit within max_size, keeping its aspect ratio.
+    Images that already fit are returned untouched without a resample.
+    Call this before the image is loaded: JPEGs are then decoded at 1/2, 1/4 or 1/8 scale via draft(),
+    keeping at least DRAFT_GAP times the target size, and always finish with a LANCZOS resample.
+    """
+    target = target_size(image.size, max_size)
+    with metrics.stage("decode"):
+        if target is not None and image.format == "JPEG" and image.tile:
+            # The decoder picks the smallest DCT scale that is still at least `target` x DRAFT_GAP
+            image.draft(None, (round(target[0] * DRAFT_GAP), round(target[1] * DRAFT_GAP)))
+        image.load()
+    if target is None:
+        return image
+
+    with metrics.stage("resize"):
+        return image.resize(target, RESAMPLE, reducing_gap=REDUCING_GAP)
+
+
+def save_args(fmt, quality, settings, icc_profile):
+    args = {"format": fmt, "optimize": settings.optimize}
+    if quality is not None:
+        args["quality"] = quality
+    if fmt == "JPEG" and icc_profile:
+        args["icc_profile"] = icc_profile
+    return args
+
+
+def write_temp(image, output_path, args):
+    """Encodes image next to output_path and returns the temp file, to be renamed into place by the caller."""
+    with metrics.stage("encode"):
+        # Convert if saving as JPEG and incompatible mode
+        if args["format"] == "JPEG" and image.mode not in ("RGB", "L"):
+            image = image.convert("RGB")
+        os.makedirs(os.path.dirname(output_path), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(output_path), suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as out:
+                image.save(out, **args)
+            os.chmod(tmp_path, 0o644)  # mkstemp creates files readable by the owner only
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        metrics.add("encode", bytes_out=os.path.getsize(tmp_path))
+        return tmp_path
+
+
+def encode_image(source, output_path, settings=EncodeSettings()):
+    """
+    Decodes source (raw bytes or a file path), fits it within settings.max_size and saves it to output_path,
+    plus one file per rendition in settings.renditions (see rendition_path).
+    The image is decoded once; each rendition is resampled from the next larger one, and all outputs
+    are encoded in parallel. The output format follows the output_path extension (or the rendition's
+    format). Files are replaced atomically, the main output last, so once it exists so do its renditions.
+    Module-level so it can run in a worker process.
+    """
+    original_ext = os.path.splitext(output_path)[1].lower()
+    body = BytesIO(source) if isinstance(source, (bytes, bytearray)) else open(source, "rb")
+    metrics.add("decode", bytes_in=len(source) if isinstance(source, (bytes, bytearray)) else os.path.getsize(source))
+    with body:
+        image = Image.open(body)
+        source_format = image.format
+        icc_profile = image.info.get("icc_profile") if settings.keep_icc else None  # Try to retain ICC color profile
+        image = fit_within(image, settings.max_size)  # Resize while keeping aspect ratio, decoding JPEGs at reduced scale
+
+    main_format = "JPEG" if original_ext in (".jpg", ".jpeg") else source_format or "PNG"  # fallback
+    main_quality = settings.quality if main_format in ("JPEG", "WEBP") else None
+    outputs = [(image, output_path, save_args(main_format, main_quality, settings, icc_profile))]
+
+    # Largest first, each resampled from the previous one rather than from the full-size original
+    previous = image
+    for rendition in sorted(settings.renditions, key=lambda r: r.max_size, reverse=True):
+        target = target_size(previous.size, rendition.max_size)
+        if target is not None:
+            with metrics.stage("resize"):
+                previous = previous.resize(target, RESAMPLE, reducing_gap=REDUCING_GAP)
+        fmt = FORMATS[rendition.format][0] if rendition.format else main_format
+        quality = rendition.quality or (settings.quality if fmt in ("JPEG", "WEBP") else None)
+        args = save_args(fmt, quality, settings, icc_profile)
+        outputs.append((previous, rendition_path(output_path, rendition), args))
+
+    if len(outputs) == 1:
+        tmp_paths = [write_temp(*outputs[0])]
+    else:
+        # Pillow's encoders release the GIL, so the outputs really are encoded side by side
+        seen = set()
+        with ThreadPoolExecutor(max_workers=min(len(outputs), MAX_ENCODE_THREADS)) as pool:
+            futures = []
+            for img, path, args in outputs:
+                # Renditions that needed no resize share an image; give each thread its own
+                img = img.copy() if id(img) in seen else img
+                seen.add(id(img))
+                futures.append(pool.submit(write_temp, img, path, args))
+        tmp_paths, error = [], None
+        for future in futures:
+            try:
+                tmp_paths.append(future.result())
+            except BaseException as e:
+                error = error or e
+        if error:
+            for tmp_path in tmp_paths:
+                os.remove(tmp_path)
+            raise error
+
+    for tmp_path, (_, path, _) in reversed(list(zip(tmp_paths, outputs))):
+        os.replace(tmp_path, path)
+    return output_path
@@ -0,0 +1,88 @@
+import os
+import sqlite3
+import threading
+import time
+
+MANIFEST_FILENAME = ".download-manifest.sqlite3"
+
+
+class Manifest:
+    """
+    Local SQLite record of every URL download_image has finished, keyed by the 'Location' URL.
+    Stores the validators the server sent (ETag / Last-Modified), the content hash, the output path
+    and the encode settings, so a rerun can send a conditional GET and skip unchanged rows.
+    Safe to share between the fetch threads.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS downloads (
+                url TEXT PRIMARY KEY,
+                etag TEXT,
+                last_modified TEXT,
+                content_hash TEXT,
+                output_path TEXT,
+                settings TEXT,
+                updated_at REAL
+            )
+        """)
+        self._conn.commit()
+
+    def get(self, url):
+        with self._lock:
+            row = self._conn.execute("SELECT * FROM downloads WHERE url = ?", (url,)).fetchone()
+        return dict(row) if row else None
+
+    def get_current(self, url, settings_key):
+        """The entry for url if it was processed with these settings and its output still exists, else None."""
+        entry = self.get(url)
+        if entry and entry["settings"] == settings_key and entry["output_path"] and os.path.exists(entry["output_path"]):
+            return entry
+        return None
+
+    def output_owners(self):
+        """{output path: (url, content hash)} for everything recorded so far."""
+        with self._lock:
+            rows = self._conn.execute("SELECT output_path, url, content_hash FROM downloads").fetchall()
+        return {row["output_path"]: (row["url"], row["content_hash"]) for row in rows if row["output_path"]}
+
+    def record(self, url, output_path, settings_key, etag=None, last_modified=None, content_hash=None):
+        with self._lock:
+            self._conn.execute("""
+                INSERT INTO downloads (url, etag, last_modified, content_hash, output_path, settings, updated_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT(url) DO UPDATE SET
+                    etag = COALESCE(excluded.etag, etag),
+                    last_modified = COALESCE(excluded.last_modified, last_modified),
+                    content_hash = COALESCE(excluded.content_hash, content_hash),
+                    output_path = excluded.output_path,
+                    settings = excluded.settings,
+                    updated_at = excluded.updated_at
+            """, (url, etag, last_modified, content_hash, output_path, settings_key, time.time()))
+            self._conn.commit()
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+        return False
+
+
+def conditional_headers(entry):
+    """If-None-Match / If-Modified-Since headers for a manifest entry."""
+    headers = {}
+    if entry and entry.get("etag"):
+        headers["If-None-Match"] = entry["etag"]
+    if entry and entry.get("last_modified"):
+        headers["If-Modified-Since"] = entry["last_modified"]
+    return headers
@@ -0,0 +1,275 @@
+import cProfile
+import copy
+import json
+import math
+import os
+import pstats
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+# Counters kept for every stage; add() accepts other names too
+COUNTERS = ("calls", "items", "bytes_in", "bytes_out", "retries", "api_calls", "quota_wait_seconds", "errors")
+
+PROMETHEUS_PREFIX = "filter_large_files"
+DEFAULT_PROFILE_DIR = "profiles"
+
+
+class Metrics:
+    """
+    Wall time and counters per pipeline stage (sheet_read, filter, probe, fetch, decode, resize, encode,
+    write_back, ...) for one run. Stages are timed with `with metrics.stage(name):` from any thread;
+    busy_seconds sums the time spent inside the stage, wall_seconds spans its first start to last end.
+    Worker processes send their figures back with snapshot() and merge().
+
+    cProfile and tracemalloc can be switched on for chosen stages with configure().
+    tracemalloc is process-wide, so its peak covers whatever else runs while the stage does.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._profiles = {}  # stage -> pstats.Stats
+        self._tracing = 0
+        self.profile_stages = set()
+        self.trace_stages = set()
+        self.profile_dir = DEFAULT_PROFILE_DIR
+        self.reset()
+
+    def configure(self, profile=(), trace_memory=(), profile_dir=DEFAULT_PROFILE_DIR):
+        self.profile_stages = set(profile)
+        self.trace_stages = set(trace_memory)
+        self.profile_dir = profile_dir
+
+    def config(self):
+        """Arguments for configure(), e.g. to set up worker processes the same way."""
+        return tuple(self.profile_stages), tuple(self.trace_stages), self.profile_dir
+
+    def reset(self):
+        with self._lock:
+            self.stages = {}
+            self.latencies = {}  # name -> per-job seconds, see observe()
+            self.started = time.time()
+
+    def _entry(self, stage):
+        entry = self.stages.get(stage)
+        if entry is None:
+            entry = dict.fromkeys(COUNTERS, 0)
+            entry.update(busy_seconds=0.0, max_seconds=0.0, first_start=None, last_end=None)
+            self.stages[stage] = entry
+        return entry
+
+    def add(self, stage=None, **counts):
+        """Adds to a stage's counters; without a stage, to the stage running on this thread (or "other")."""
+        stage = stage or self.current() or "other"
+        with self._lock:
+            entry = self._entry(stage)
+            for name, value in counts.items():
+                entry[name] = entry.get(name, 0) + value
+
+    def observe(self, name, seconds):
+        """Records one job's end-to-end latency (e.g. fetch start to encode done); summary() gives percentiles."""
+        with self._lock:
+            self.latencies.setdefault(name, []).append(seconds)
+
+    def current(self):
+        stack = getattr(self._local, "stack", None)
+        return stack[-1] if stack else None
+
+    @contextmanager
+    def stage(self, name, **counts):
+        stack = self._local.__dict__.setdefault("stack", [])
+        stack.append(name)
+        profiler = self._start_profile(name)
+        tracing = self._start_trace() if name in self.trace_stages else False
+        started_at = time.time()
+        start = time.perf_counter()
+        failed = False
+        try:
+            yield self
+        except BaseException:
+            failed = True
+            raise
+        finally:
+            elapsed = time.perf_counter() - start
+            if profiler:
+                self._stop_profile(name, profiler)
+            peak = self._stop_trace() if tracing else None
+            stack.pop()
+            with self._lock:
+                entry = self._entry(name)
+                entry["calls"] += 1
+                entry["errors"] += failed
+                entry["busy_seconds"] += elapsed
+                entry["max_seconds"] = max(entry["max_seconds"], elapsed)
+                entry["first_start"] = min(started_at, entry["first_start"] or started_at)
+                entry["last_end"] = max(started_at + elapsed, entry["last_end"] or 0)
+                if peak is not None:
+                    entry["peak_traced_bytes"] = max(entry.get("peak_traced_bytes", 0), peak)
+                for counter, value in counts.items():
+                    entry[counter] = entry.get(counter, 0) + value
+
+    def _start_profile(self, name):
+        if name not in self.profile_stages:
+            return None
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+        except ValueError:
+            # Python 3.12+ allows one active profiler per process; overlapping entries go unprofiled
+            return None
+        return profiler
+
+    def _stop_profile(self, name, profiler):
+        profiler.disable()
+        with self._lock:
+            stats = self._profiles.get(name)
+            if stats is None:
+                self._profiles[name] = pstats.Stats(profiler)
+            else:
+                stats.add(profiler)
+
+    def _start_trace(self):
+        with self._lock:
+            self._tracing += 1
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+            tracemalloc.reset_peak()
+        return True
+
+    def _stop_trace(self):
+        with self._lock:
+            peak = tracemalloc.get_traced_memory()[1]
+            self._tracing -= 1
+            if self._tracing == 0:
+                tracemalloc.stop()
+        return peak
+
+    def snapshot(self):
+        with self._lock:
+            return copy.deepcopy(self.stages)
+
+    def merge(self, stages):
+        """Folds in another process's snapshot()."""
+        with self._lock:
+            for name, other in stages.items():
+                entry = self._entry(name)
+                for key, value in other.items():
+                    if key in ("max_seconds", "peak_traced_bytes", "last_end"):
+                        entry[key] = max(entry.get(key) or 0, value or 0)
+                    elif key == "first_start":
+                        starts = [v for v in (entry[key], value) if v]
+                        entry[key] = min(starts) if starts else None
+                    else:
+                        entry[key] = entry.get(key, 0) + value
+
+    def summary(self):
+        with self._lock:
+            stages = copy.deepcopy(self.stages)
+            latencies = {name: sorted(values) for name, values in self.latencies.items()}
+            started = self.started
+        for entry in stages.values():
+            first, last = entry.pop("first_start"), entry.pop("last_end")
+            entry["wall_seconds"] = (last - first) if first and last else 0.0
+            entry["mb_in_per_second"] = entry["bytes_in"] / 1e6 / entry["wall_seconds"] if entry["wall_seconds"] else 0.0
+        return {
+            "started": datetime.fromtimestamp(started, timezone.utc).isoformat(),
+            "wall_seconds": time.time() - started,
+            "stages": stages,
+            "latency": {name: {"jobs": len(values), "p50_ms": percentile(values, 50) * 1000,
+                               "p99_ms": percentile(values, 99) * 1000, "max_ms": values[-1] * 1000}
+                        for name, values in latencies.items() if values},
+        }
+
+    def write_json(self, path):
+        _write_atomic(path, json.dumps(self.summary(), indent=2, sort_keys=True))
+
+    def write_prometheus(self, path):
+        """Prometheus textfile-collector format, replaced atomically so the collector never reads half a file."""
+        summary = self.summary()
+        lines = [
+            f"# HELP {PROMETHEUS_PREFIX}_run_seconds Wall time of the run so far.",
+            f"# TYPE {PROMETHEUS_PREFIX}_run_seconds gauge",
+            f"{PROMETHEUS_PREFIX}_run_seconds {summary['wall_seconds']:.3f}",
+        ]
+        names = sorted({key for entry in summary["stages"].values() for key in entry})
+        for name in names:
+            metric = f"{PROMETHEUS_PREFIX}_stage_{name}"
+            lines.append(f"# TYPE {metric} gauge")
+            for stage, entry in sorted(summary["stages"].items()):
+                if name in entry:
+                    lines.append(f'{metric}{{stage="{stage}"}} {entry[name]}')
+        _write_atomic(path, "\n".join(lines) + "\n")
+
+    def dump_profiles(self):
+        """Writes one .prof file per profiled stage (and process), readable with pstats or snakeviz."""
+        with self._lock:
+            profiles = dict(self._profiles)
+        if profiles:
+            os.makedirs(self.profile_dir, exist_ok=True)
+        for stage, stats in profiles.items():
+            stats.dump_stats(os.path.join(self.profile_dir, f"{stage}.{os.getpid()}.prof"))
+
+    def report(self):
+        summary = self.summary()
+        print(f"📈 Run took {summary['wall_seconds']:.1f}s")
+        print(f"   {'stage':<12}{'calls':>8}{'busy s':>9}{'wall s':>9}{'MB in':>9}{'MB out':>9}"
+              f"{'retries':>8}{'API':>6}{'quota s':>8}{'errors':>7}")
+        for stage, entry in sorted(summary["stages"].items(), key=lambda item: -item[1]["busy_seconds"]):
+            print(f"   {stage:<12}{entry['calls']:>8}{entry['busy_seconds']:>9.1f}{entry['wall_seconds']:>9.1f}"
+                  f"{entry['bytes_in'] / 1e6:>9.1f}{entry['bytes_out'] / 1e6:>9.1f}{entry['retries']:>8}"
+                  f"{entry['api_calls']:>6}{entry['quota_wait_seconds']:>8.1f}{entry['errors']:>7}")
+
+    def emit(self, json_path=None, prometheus_path=None):
+        """Prints the summary and writes whichever outputs are configured."""
+        self.report()
+        if json_path:
+            self.write_json(json_path)
+        if prometheus_path:
+            self.write_prometheus(prometheus_path)
+        self.dump_profiles()
+
+
+def percentile(values, pct):
+    """Nearest-rank percentile of sorted values: the smallest value with at least pct% of them at or below it."""
+    if not values:
+        return 0.0
+    return values[max(0, math.ceil(pct * len(values) / 100) - 1)]
+
+
+def _write_atomic(path, text):
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "w") as f:
+        f.write(text)
+    os.replace(tmp, path)
+
+
+_default = Metrics()
+
+configure = _default.configure
+config = _default.config
+reset = _default.reset
+add = _default.add
+observe = _default.observe
+stage = _default.stage
+snapshot = _default.snapshot
+merge = _default.merge
+summary = _default.summary
+emit = _default.emit
+dump_profiles = _default.dump_profiles
+
+
+def measured(process, *args):
+    """
+    Runs process(*args) in a worker process and returns (value, the worker's metrics for that call),
+    so the parent can merge() decode/resize/encode figures measured in the pool.
+    """
+    reset()
+    value = process(*args)
+    dump_profiles()
+    return value, snapshot()
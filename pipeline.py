@@ -0,0 +1,104 @@
+import contextvars
+import os
+import queue
+import threading
+import time
+
+import metrics
+from fetch_engine import FetchEngine, FetchResult, DEFAULT_WORKERS, DEFAULT_PER_HOST
+
+DEFAULT_CPU_WORKERS = os.cpu_count() or 1
+
+
+class PipelineStopped(Exception):
+    pass
+
+
+class Pipeline:
+    """
+    Two-stage pipeline: I/O threads fetch with the FetchEngine, a process pool does the CPU-bound work.
+
+    fetch(job) runs on an I/O thread and returns (spool, args); process(spool.source(), *args) then runs
+    in a worker process. At most queue_depth fetched bodies wait for or sit in the process pool; once
+    that many are queued the I/O threads block, which throttles the network to what the CPUs can take.
+    If fetch returns (None, value) instead, the job needs no processing and finishes right away as a
+    skipped result carrying value.
+    """
+
+    def __init__(self, max_workers=DEFAULT_WORKERS, per_host=DEFAULT_PER_HOST,
+                 cpu_workers=DEFAULT_CPU_WORKERS, queue_depth=None):
+        self.engine = FetchEngine(max_workers, per_host)
+        self.cpu_workers = max(1, cpu_workers)
+        self.queue_depth = queue_depth or self.cpu_workers * 2
+
+    def run(self, jobs, fetch, process):
+        """Yields a FetchResult for each job once it has been fetched and processed (or failed)."""
+        # Imported here: it pulls in multiprocessing, which sheet-only runs never need
+        from concurrent.futures import ProcessPoolExecutor
+
+        jobs = list(jobs)
+        results = queue.Queue()
+        slots = threading.BoundedSemaphore(self.queue_depth)
+        stop = threading.Event()
+
+        # Workers get the same profiling switches and report their stage metrics back with each result
+        with ProcessPoolExecutor(max_workers=self.cpu_workers, initializer=metrics.configure,
+                                 initargs=metrics.config()) as pool:
+
+            def fetch_and_submit(job):
+                if stop.is_set():
+                    raise PipelineStopped()
+                started = time.perf_counter()
+                spool, args = fetch(job)
+                if spool is None:
+                    results.put(FetchResult(job, value=args, skipped=True, started=started, finished=time.perf_counter()))
+                    return
+                # Backpressure: wait for room in the CPU stage before taking on more network work
+                while not slots.acquire(timeout=0.5):
+                    if stop.is_set():
+                        spool.close()
+                        raise PipelineStopped()
+                try:
+                    future = pool.submit(metrics.measured, process, spool.source(), *args)
+                except BaseException:
+                    slots.release()
+                    spool.close()
+                    raise
+
+                def done(f):
+                    finished = time.perf_counter()
+                    slots.release()
+                    spool.close()
+                    try:
+                        value, stages = f.result()
+                        metrics.merge(stages)
+                        results.put(FetchResult(job, value=value, started=started, finished=finished))
+                    except BaseException as e:
+                        results.put(FetchResult(job, error=e, started=started, finished=finished))
+
+                future.add_done_callback(done)
+
+            def feed():
+                # Fetch-stage failures are final; successes report in from the process future callback
+                try:
+                    for result in self.engine.run(jobs, fetch_and_submit):
+                        if not result.ok:
+                            results.put(result)
+                except BaseException as e:
+                    results.put(e)
+
+            feeder = threading.Thread(target=contextvars.copy_context().run, args=(feed,), daemon=True)
+            feeder.start()
+            try:
+                for _ in range(len(jobs)):
+                    item = results.get()
+                    if isinstance(item, BaseException):
+                        raise item
+                    if item.seconds is not None:
+                        # From the start of the fetch to the end of the CPU stage, queueing included
+                        metrics.observe("pipeline_job", item.seconds)
+                    yield item
+            finally:
+                stop.set()
+                feeder.join()
+                pool.shutdown(wait=True, cancel_futures=True)
@@ -0,0 +1,161 @@
+import struct
+from dataclasses import dataclass
+
+import metrics
+import transport
+
+# First range request; doubled (up to MAX_PROBE_BYTES) when a JPEG's SOF marker sits behind large EXIF/ICC blocks
+PROBE_BYTES = 32 * 1024
+MAX_PROBE_BYTES = 1024 * 1024
+
+# Columns the probe writes to the Images tab
+PROBE_COLUMNS = ["Width", "Height", "Format", "Bytes"]
+
+_JPEG_SOF = {0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF}
+_JPEG_STANDALONE = {0x01, 0xD0, 0xD1, 0xD2, 0xD3, 0xD4, 0xD5, 0xD6, 0xD7, 0xD8, 0xD9}
+
+
+class IncompleteHeader(Exception):
+    """The bytes seen so far end before the image header does."""
+
+
+@dataclass
+class ProbeResult:
+    width: int = None
+    height: int = None
+    format: str = None
+    content_length: int = None
+
+    def fits(self, max_size):
+        return (self.width is not None and self.height is not None
+                and self.width <= max_size[0] and self.height <= max_size[1])
+
+    def as_row(self):
+        return [self.width or "", self.height or "", self.format or "", self.content_length or ""]
+
+
+def _jpeg_size(data):
+    pos = 2
+    while True:
+        # Skip to the next marker, allowing fill bytes
+        while pos < len(data) and data[pos] != 0xFF:
+            pos += 1
+        while pos < len(data) and data[pos] == 0xFF:
+            pos += 1
+        if pos >= len(data):
+            raise IncompleteHeader()
+        marker = data[pos]
+        pos += 1
+        if marker in _JPEG_STANDALONE:
+            continue
+        if pos + 2 > len(data):
+            raise IncompleteHeader()
+        length = struct.unpack(">H", data[pos:pos + 2])[0]
+        if marker in _JPEG_SOF:
+            if pos + 7 > len(data):
+                raise IncompleteHeader()
+            height, width = struct.unpack(">HH", data[pos + 3:pos + 7])
+            return width, height
+        pos += length
+
+
+def _webp_size(data):
+    chunk = data[12:16]
+    if chunk == b"VP8 ":
+        if len(data) < 30:
+            raise IncompleteHeader()
+        width, height = struct.unpack("<HH", data[26:30])
+        return width & 0x3FFF, height & 0x3FFF
+    if chunk == b"VP8L":
+        if len(data) < 25:
+            raise IncompleteHeader()
+        bits = struct.unpack("<I", data[21:25])[0]
+        return (bits & 0x3FFF) + 1, ((bits >> 14) & 0x3FFF) + 1
+    if chunk == b"VP8X":
+        if len(data) < 30:
+            raise IncompleteHeader()
+        width = int.from_bytes(data[24:27], "little") + 1
+        height = int.from_bytes(data[27:30], "little") + 1
+        return width, height
+    return None
+
+
+def image_header(data):
+    """
+    (format, width, height) from the first bytes of a JPEG, PNG or WebP file, or None if it is none of those.
+    Raises IncompleteHeader when more bytes are needed.
+    """
+    if data[:8] == b"\x89PNG\r\n\x1a\n":
+        if len(data) < 24:
+            raise IncompleteHeader()
+        width, height = struct.unpack(">II", data[16:24])
+        return "PNG", width, height
+    if data[:2] == b"\xff\xd8":
+        return ("JPEG",) + _jpeg_size(data)
+    if data[:4] == b"RIFF" and data[8:12] == b"WEBP":
+        size = _webp_size(data)
+        return ("WEBP",) + size if size else None
+    if len(data) < 12:
+        raise IncompleteHeader()
+    return None
+
+
+def _read_range(url, start, end):
+    """
+    Bytes start..end (inclusive) of url and the total size if the server reported it.
+    A server that ignores Range answers 200; then only the needed bytes are read before the stream is dropped.
+    """
+    response = transport.get(url, headers={"Range": f"bytes={start}-{end}"}, stream=True)
+    try:
+        response.raise_for_status()
+        total = None
+        if response.status_code == 206:
+            content_range = response.headers.get("Content-Range", "")
+            if "/" in content_range and content_range.rsplit("/", 1)[1].isdigit():
+                total = int(content_range.rsplit("/", 1)[1])
+            return response.content, total
+        length = response.headers.get("Content-Length")
+        total = int(length) if length and length.isdigit() else None
+        data = bytearray()
+        for chunk in response.iter_content(chunk_size=8192):
+            data += chunk
+            if len(data) > end:
+                break
+        return bytes(data[start:end + 1]), total
+    finally:
+        response.close()
+
+
+def probe(url, probe_bytes=PROBE_BYTES, max_bytes=MAX_PROBE_BYTES):
+    """Width, height, format and size of a remote image, from its first few KB instead of the whole file."""
+    with metrics.stage("probe", items=1):
+        return _probe(url, probe_bytes, max_bytes)
+
+
+def _probe(url, probe_bytes, max_bytes):
+    data, total = _read_range(url, 0, probe_bytes - 1)
+    requested = probe_bytes
+    result = ProbeResult(content_length=total)
+    while True:
+        try:
+            header = image_header(data)
+            break
+        except IncompleteHeader:
+            at_end = len(data) < requested or (total is not None and len(data) >= total)
+            if at_end or len(data) >= max_bytes:
+                header = None
+                break
+            more, _ = _read_range(url, len(data), len(data) * 2 - 1)
+            requested = len(data) * 2
+            data += more
+    metrics.add("probe", bytes_in=len(data))
+    if header:
+        result.format, result.width, result.height = header
+
+    if result.content_length is None:
+        # Ranged responses without a total: fall back to HEAD for the full size
+        response = transport.head(url)
+        length = response.headers.get("Content-Length")
+        if response.ok and length and length.isdigit():
+            result.content_length = int(length)
+    return result
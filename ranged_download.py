@@ -0,0 +1,272 @@
+import base64
+import binascii
+import contextvars
+import hashlib
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import requests
+
+import metrics
+import transport
+
+# Files at least this large are fetched as parallel byte ranges when the server accepts them
+RANGED_THRESHOLD = 32 * 1024 * 1024
+# Ranges in flight per file; each one is a connection on the shared pool
+RANGE_CONNECTIONS = 4
+# Files are split into pieces of this size; an interrupted download keeps its finished pieces
+PIECE_SIZE = 8 * 1024 * 1024
+# Attempts per piece when its stream breaks off (the request itself is retried by transport)
+PIECE_ATTEMPTS = 3
+CHUNK_SIZE = 256 * 1024
+
+PART_SUFFIX = ".part"
+STATE_SUFFIX = ".part.json"
+
+# Digest names servers use (Repr-Digest, Digest, x-goog-hash) -> hashlib names
+DIGEST_ALGORITHMS = {"sha-512": "sha512", "sha-256": "sha256", "sha256": "sha256", "md5": "md5"}
+
+
+class RangeNotSatisfied(Exception):
+    """The server ignored a Range request, or the file changed since the download started (If-Range)."""
+
+
+class ChecksumMismatch(Exception):
+    def __init__(self, algorithm, expected, actual):
+        super().__init__(f"{algorithm} {actual} does not match the server's {expected}")
+
+
+def content_length(headers):
+    value = headers.get("Content-Length", "")
+    return int(value) if value.isdigit() else None
+
+
+def wants_ranges(response, threshold=RANGED_THRESHOLD):
+    """True when a 200 response (HEAD or GET) is for a file large enough to split and the server advertises byte ranges."""
+    size = content_length(response.headers)
+    return (size is not None and size >= threshold
+            and response.headers.get("Accept-Ranges", "").lower() == "bytes"
+            and not response.headers.get("Content-Encoding"))
+
+
+def expected_digest(headers):
+    """(hashlib name, hex digest) the server published for the whole file, or None."""
+    for header in ("Repr-Digest", "Digest", "x-goog-hash"):
+        for item in headers.get(header, "").split(","):
+            name, _, value = item.strip().partition("=")
+            algorithm = DIGEST_ALGORITHMS.get(name.lower())
+            if algorithm and value:
+                try:
+                    return algorithm, base64.b64decode(value.strip(":")).hex()
+                except (binascii.Error, ValueError):
+                    continue
+    if headers.get("Content-MD5"):
+        try:
+            return "md5", base64.b64decode(headers["Content-MD5"]).hex()
+        except (binascii.Error, ValueError):
+            pass
+    return None
+
+
+def if_range(etag, last_modified):
+    """If-Range value that makes the server answer 200 (not 206) once the file has changed; weak ETags don't qualify."""
+    if etag and not etag.startswith("W/"):
+        return etag
+    return last_modified
+
+
+def preallocate(fd, size):
+    """Reserves the whole file up front, so pieces can be written at their offsets in any order."""
+    if hasattr(os, "posix_fallocate"):
+        try:
+            os.posix_fallocate(fd, 0, size)
+            return
+        except OSError:
+            pass  # filesystems without fallocate
+    if os.fstat(fd).st_size != size:
+        os.ftruncate(fd, size)
+
+
+_seek_lock = threading.Lock()
+
+
+def write_at(fd, data, offset):
+    """Writes data at offset without moving a shared file position (pwrite where the OS has it)."""
+    view = memoryview(data)
+    if hasattr(os, "pwrite"):
+        while view:
+            written = os.pwrite(fd, view, offset)
+            view, offset = view[written:], offset + written
+        return
+    with _seek_lock:
+        os.lseek(fd, offset, os.SEEK_SET)
+        while view:
+            view = view[os.write(fd, view):]
+
+
+class RangeState:
+    """
+    Progress of a ranged download, kept next to the .part file: the file it is for (URL, size, validators)
+    and the SHA-256 of every finished piece. A state for another version of the file is ignored.
+    """
+
+    def __init__(self, path, url, size, validator, piece_size=PIECE_SIZE, done=None):
+        self.path = path
+        self.url = url
+        self.size = size
+        self.validator = validator
+        self.piece_size = piece_size
+        self.done = done or {}
+
+    @classmethod
+    def load(cls, path, url, size, validator):
+        try:
+            with open(path) as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if (data.get("url"), data.get("size"), data.get("validator")) != (url, size, validator) or not validator:
+            return None
+        return cls(path, url, size, validator, data["piece_size"], {int(i): digest for i, digest in data["done"].items()})
+
+    @property
+    def pieces(self):
+        return [(i, start, min(start + self.piece_size, self.size) - 1)
+                for i, start in enumerate(range(0, self.size, self.piece_size))]
+
+    def save(self):
+        tmp = self.path + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump({"url": self.url, "size": self.size, "validator": self.validator,
+                       "piece_size": self.piece_size, "done": self.done}, f)
+        os.replace(tmp, self.path)
+
+    def verify(self, part_path):
+        """Drops finished pieces whose bytes on disk no longer match their hash (e.g. lost in a crash)."""
+        if not self.done:
+            return
+        with open(part_path, "rb") as f:
+            for i, start, end in self.pieces:
+                if i in self.done:
+                    f.seek(start)
+                    if hashlib.sha256(f.read(end - start + 1)).hexdigest() != self.done[i]:
+                        del self.done[i]
+
+    def remove(self):
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
+
+
+def fetch_piece(url, fd, start, end, validator):
+    """
+    GETs bytes start..end and writes them at their offset; returns their SHA-256.
+    Raises RangeNotSatisfied when the server doesn't answer with exactly that range, and requests.HTTPError
+    on an error status.
+    """
+    headers = {"Range": f"bytes={start}-{end}"}
+    if validator:
+        headers["If-Range"] = validator
+    for attempt in range(PIECE_ATTEMPTS):
+        response = transport.get(url, headers=headers, stream=True)
+        try:
+            if response.status_code in (200, 416):
+                # Range ignored, or the file changed (If-Range) or shrank since the download started
+                raise RangeNotSatisfied(f"status {response.status_code} for bytes {start}-{end}")
+            response.raise_for_status()  # errors that outlived transport's retries; the finished pieces are kept
+            if response.status_code != 206 or not response.headers.get("Content-Range", "").startswith(f"bytes {start}-{end}/"):
+                raise RangeNotSatisfied(f"status {response.status_code} for bytes {start}-{end}")
+            digest = hashlib.sha256()
+            offset = start
+            for chunk in response.iter_content(chunk_size=CHUNK_SIZE):
+                write_at(fd, chunk, offset)
+                digest.update(chunk)
+                offset += len(chunk)
+                metrics.add("fetch", bytes_in=len(chunk))
+            if offset != end + 1:
+                raise requests.ConnectionError(f"bytes {start}-{end} ended after {offset - start} bytes")
+            return digest.hexdigest()
+        except (requests.ConnectionError, requests.Timeout, requests.exceptions.ChunkedEncodingError):
+            if attempt == PIECE_ATTEMPTS - 1:
+                raise
+            delay = transport.backoff_delay(attempt)
+            metrics.add("fetch", retries=1, backoff_seconds=delay)
+            time.sleep(delay)
+        finally:
+            response.close()
+
+
+def file_digest(path, algorithm):
+    digest = hashlib.new(algorithm)
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def download_ranged(url, filename, headers, connections=RANGE_CONNECTIONS, piece_size=PIECE_SIZE):
+    """
+    Downloads url into filename as PIECE_SIZE byte ranges, `connections` at a time, written in place into a
+    preallocated .part file. `headers` are those of a HEAD or plain GET of url (size, validators, published digest).
+
+    Finished pieces are recorded in a .part.json state file, so a rerun after an interruption fetches only
+    the missing ones, as long as the server still reports the same size and ETag/Last-Modified. The whole
+    file is checked against a digest the server publishes (Repr-Digest, Digest, Content-MD5); a mismatch
+    discards the download. Raises RangeNotSatisfied when the server doesn't honour the ranges (the pieces on
+    disk are dropped); any other error, such as requests.HTTPError, keeps them for the next attempt.
+    """
+    size = content_length(headers)
+    validator = if_range(headers.get("ETag"), headers.get("Last-Modified"))
+    part_path = filename + PART_SUFFIX
+    state = RangeState.load(filename + STATE_SUFFIX, url, size, validator)
+    if state is None or not os.path.exists(part_path):
+        state = RangeState(filename + STATE_SUFFIX, url, size, validator, piece_size)
+        if os.path.exists(part_path):
+            os.remove(part_path)
+    else:
+        state.verify(part_path)
+        print(f"⏯️ Resuming {os.path.basename(filename)}: {len(state.done)} of {len(state.pieces)} pieces already on disk")
+
+    fd = os.open(part_path, os.O_RDWR | os.O_CREAT | getattr(os, "O_BINARY", 0), 0o644)
+    error = None
+    try:
+        preallocate(fd, size)
+        todo = [piece for piece in state.pieces if piece[0] not in state.done]
+        with ThreadPoolExecutor(max_workers=max(1, min(connections, len(todo)))) as pool:
+            futures = {pool.submit(contextvars.copy_context().run, fetch_piece, url, fd, start, end, validator): i
+                       for i, start, end in todo}
+            for future in as_completed(futures):
+                try:
+                    state.done[futures[future]] = future.result()
+                except Exception as e:
+                    # Stop handing out pieces; the ones already running still finish and are kept
+                    error = error or e
+                    for pending in futures:
+                        pending.cancel()
+                    continue
+                if validator:
+                    state.save()
+    finally:
+        os.close(fd)
+    if isinstance(error, RangeNotSatisfied):
+        # The pieces on disk may belong to another version of the file
+        os.remove(part_path)
+        state.remove()
+    if error:
+        raise error
+
+    published = expected_digest(headers)
+    if published:
+        algorithm, expected = published
+        actual = file_digest(part_path, algorithm)
+        if actual != expected:
+            os.remove(part_path)
+            state.remove()
+            raise ChecksumMismatch(algorithm, expected, actual)
+    os.replace(part_path, filename)
+    state.remove()
+    return filename
@@ -1,143 +1,91 @@
+import argparse
 import gspread
-import requests
-from oauth2client.service_account import ServiceAccountCredentials
+from gspread.utils import rowcol_to_a1
 import re
 import os
-import time
-from selenium import webdriver
-from selenium.webdriver.chrome.service import Service
-from selenium.webdriver.chrome.options import Options
-from webdriver_manager.chrome import ChromeDriverManager
+import threading
+from concurrent.futures import Future
+from contextlib import nullcontext
 from urllib.parse import unquote, urlparse
-from PIL import Image
-from io import BytesIO
-
-
-def filter_links(spreadsheet):
-    source_ws = spreadsheet.worksheet('500 largest files')
-    all_values = source_ws.get_all_values()
-    headers = all_values[0]
-    data_rows = all_values[1:]
-
-    # Indexes
-    location_idx = headers.index("Location")
-    size_idx = headers.index("Size")
-
-    # Prepare image entries and transferred row indices
-    image_rows = []
-    transferred_row_nums = []
-
-    for i, row in enumerate(data_rows):
-        location = row[location_idx].strip().lower()
-        if location.endswith((".jpg", ".png")):
-            full_url = row[location_idx].replace("/sites/stanfordlaw", "https://law.stanford.edu", 1)
-            size = row[size_idx]
-            image_rows.append([size, full_url, ""])  # No "Found on site" content
-            transferred_row_nums.append(i + 2)  # account for header offset
-
-    # --- Create Images tab ---
-    try:
-        spreadsheet.del_worksheet(spreadsheet.worksheet("Images"))
-    except gspread.exceptions.WorksheetNotFound:
-        pass
-    image_ws = spreadsheet.add_worksheet(title="Images", rows=str(len(image_rows)+1), cols="3")
-    image_ws.update("A1:D1", [["Size", "Location", "Found on site", "Notes"]])
-    if image_rows:
-        image_ws.update(f"A2:C{len(image_rows)+1}", image_rows)
-
-    print(f"✅ {len(image_rows)} images copied to 'Images'. Checkboxes added in '500 largest files'. Notes tab ensured.")
-
-    source_ws = spreadsheet.worksheet('500 largest files')
-    all_values = source_ws.get_all_values()
-    headers = all_values[0]
-    data_rows = all_values[1:]
-
-    # Indexes
-    location_idx = headers.index("Location")
-    size_idx = headers.index("Size")
-
-    # Prepare rows
-    image_rows = []
-    transferred_rows = []
-
-    for i, row in enumerate(data_rows):
-        location = row[location_idx].strip().lower()
-        if location.endswith(".jpg") or location.endswith(".png"):
-            full_url = row[location_idx].replace("/sites/stanfordlaw", "https://law.stanford.edu", 1)
-            size = row[size_idx]
-            image_rows.append([size, full_url, ""])  # No "Found on site"
-            transferred_rows.append(i + 2)  # Google Sheets row numbers start at 1
-
-    # --- Create Images tab ---
-    try:
-        spreadsheet.del_worksheet(spreadsheet.worksheet("Images"))
-    except gspread.exceptions.WorksheetNotFound:
-        pass
-    image_ws = spreadsheet.add_worksheet(title="Images", rows=str(len(image_rows)+1), cols="3")
-    image_ws.update("A1:C1", [["Size", "Location", "Found on site"]])
-    if image_rows:
-        image_ws.update(f"A2:C{len(image_rows)+1}", image_rows)
-
-    # --- Add "Transferred" checkboxes in original sheet ---
-    source_ws.batch_update([{
-        "range": f"E{row}",
-        "values": [["FALSE"]]
-    } for row in transferred_rows])
-    source_ws.format(f"E2:E{len(data_rows)+1}", {"checkbox": True})
-
-    # --- Create Notes tab if not exists ---
-    try:
-        spreadsheet.add_worksheet(title="Notes", rows="100", cols="5")
-    except gspread.exceptions.APIError:
-        pass
-
-    print(f"✅ {len(image_rows)} images copied to 'Images'. Checkboxes added. Notes tab ensured.")
-
-    source_ws = spreadsheet.worksheet('500 largest files')
-    all_values = source_ws.get_all_values()
-    headers = all_values[0]
-    data_rows = all_values[1:]
-
-    # Identify column indexes
-    location_idx = headers.index("Location")
-    size_idx = headers.index("Size")
-    found_idx = headers.index("Found on site")
-
-    # Prepare rows for the Images tab
-    image_rows = []
-    transferred_rows = []
-
-    for i, row in enumerate(data_rows):
-        location = row[location_idx].strip().lower()
-        if location.endswith(".jpg") or location.endswith(".png"):
-            # Fix URL
-            full_url = row[location_idx].replace("/sites/stanfordlaw", "https://law.stanford.edu", 1)
-            size = row[size_idx]
-            image_rows.append([size, full_url, ""])  # Leave "Found on site" blank
-            transferred_rows.append(i + 2)  # Save the row number (1-indexed + 1 header)
-
-    # --- Create the Images tab ---
-    try:
-        spreadsheet.del_worksheet(spreadsheet.worksheet("Images"))
-    except gspread.exceptions.WorksheetNotFound:
-        pass
-    image_ws = spreadsheet.add_worksheet(title="Images", rows=str(len(image_rows)+1), cols="3")
+import requests
+from filter_engine import run_filters, run_incremental_filters, contiguous_runs, DEFAULT_RULES, SITE_URL
+from size_index import SizeIndex, parse_size, order_jobs, format_bytes, format_duration, ESTIMATED_BANDWIDTH, ORDERS
+from fetch_engine import FetchEngine, FetchJob, DEFAULT_WORKERS, DEFAULT_PER_HOST
+from sheet_writer import SheetWriteBuffer
+from spool import spool_response, StoredBody, DEFAULT_MEMORY_LIMIT
+from pipeline import Pipeline, DEFAULT_CPU_WORKERS
+from blob_store import BlobStore, STORE_DIRNAME, ORIGINALS_BUDGET
+from ranged_download import download_ranged, wants_ranges, RangeNotSatisfied, RANGED_THRESHOLD, RANGE_CONNECTIONS
+import metrics
+import sheet_cache
+import sheets_scheduler
+from tables import open_workbook, sync_to_sheets
+import transport
+from probe import probe, ProbeResult, PROBE_COLUMNS
+from browser_pool import BrowserPool, CookieCache, DEFAULT_BROWSERS
+from crawler import Crawler, CrawlIndex, found_on_site_text, CRAWL_INDEX_FILENAME, MAX_PAGES, MAX_DEPTH
+from audit_runner import AuditRunner, resolve_targets, is_spreadsheet_key, DEFAULT_PARALLEL_AUDITS
+
+# Default spreadsheet and output folders; all can be overridden on the command line
+DEFAULT_SPREADSHEET = 'Media Library Audit - April 2025'
+CREDENTIALS_FILE = 'credentials.json'
+IMAGE_DOWNLOAD_DIR = "/Users/tpham/Documents/Stanford Webmaster Files/Images/Automated Downloads"
+PDF_DOWNLOAD_DIR = "/Users/tpham/Documents/Stanford Webmaster Files/File Reuploads/Automated Downloads"
+BROWSER_DOWNLOAD_DIR = os.path.join(os.path.expanduser("~"), "Documents", "Stanford Webmaster Files", "Images", "Downloaded Images")
+
+# File name and extension at the end of an image URL
+TITLE_PATTERN = re.compile(r'/([^/]+)\.(jpg|jpeg|png|webp)$', re.IGNORECASE)
+
+# Tabs whose "Found on site" column the crawl fills, with the column holding each row's URL
+FOUND_ON_SITE_TABS = {"Images": "Location", "Old Files": "URL"}
+# Referencing pages listed per cell; cells hold at most 50,000 characters
+PAGES_PER_CELL = 20
+# Pages crawled longer ago than this are revalidated by the next crawl
+CRAWL_MAX_AGE_HOURS = 24
+
+# Per-stage run metrics; set METRICS_PROMETHEUS to a node_exporter textfile path to export them there too
+METRICS_JSON = "run-metrics.json"
+METRICS_PROMETHEUS = None
+
+
+def filter_links(spreadsheet, rules=DEFAULT_RULES, incremental=False):
+    """
+    Copies the image rows of '500 largest files' into the Images tab (or whatever tabs `rules` route to),
+    ticks their "Transferred" checkbox in the source and ensures the Notes tab exists.
+    The source is read once and everything is written in one batch_update.
+    With incremental=True an existing Images tab is updated in place, keeping its Title/Download/Status columns.
+    """
+    if incremental:
+        indexes, diffs = run_incremental_filters(spreadsheet, rules)
+    else:
+        indexes, diffs = run_filters(spreadsheet, rules), {}
+    for tab, index in indexes.items():
+        count = len(index) + len(index.unknown)
+        diff = diffs.get(tab)
+        if diff and not diff.recreated:
+            print(f"🔁 '{tab}': {len(diff.added)} added, {len(diff.removed)} removed, {len(diff.changed)} changed, "
+                  f"{diff.unchanged} unchanged ({count} rows, {format_bytes(index.total_bytes())} in total).")
+        else:
+            print(f"✅ {count} rows copied to '{tab}' ({format_bytes(index.total_bytes())} in total).")
+        for size, row in index.largest(3):
+            print(f"   {format_bytes(size):>10}  {row[1]}")
+    print("Checkboxes added in '500 largest files'. Notes tab ensured.")
 
-    # Add headers and data
-    image_ws.append_row(["Size", "Location", "Found on site"])
-    for row in image_rows:
-        image_ws.append_row(row)
 
-    # --- Add checkboxes to the original sheet for those transferred ---
-    for row_num in transferred_rows:
-        source_ws.update_cell(row_num, 5, "FALSE")  # Column E = "Transferred"
-    source_ws.format(f"E2:E{len(data_rows)+1}", {"checkbox": True})
+def image_title(url):
+    """File name without its extension for an image URL, or "" if it is not a JPEG/PNG/WebP link."""
+    match = TITLE_PATTERN.search(url.strip())
+    return match.group(1) if match else ""
 
-    print(f"✅ {len(image_rows)} image rows copied to 'Images'. Checkboxes added in '500 largest files'.")
 
 def write_image_titles(spreadsheet):
+    """
+    Fills the Title column of the Images tab from each row's Location.
+    Only the Title cells whose value changes are written, as contiguous ranges of that one column,
+    so other columns are never overwritten.
+    """
     source_ws = spreadsheet.worksheet('Images')
-    all_values = source_ws.get_all_values()
+    all_values = sheet_cache.get_all_values(source_ws)
     headers = all_values[0]
 
     try:
@@ -146,315 +94,505 @@ def write_image_titles(spreadsheet):
         print("No 'Location' column found.")
         return
 
+    data = []
     # Add "Title" column if not present
     if "Title" not in headers:
         headers.append("Title")
-        source_ws.update('A1', [headers])  # update the first row with new headers
-        title_index = len(headers) - 1
-    else:
-        title_index = headers.index("Title")
-
-    # Collect values to update
-    updated_values = []
-    for row in all_values[1:]:
-        url = row[location_index].strip() if len(row) > location_index else ""
-        match = re.search(r'/([^/]+)\.(jpg|jpeg|png|webp)$', url, re.IGNORECASE)
-        title = match.group(1) if match else ""
-
-        # Pad the row if it's too short
-        while len(row) <= title_index:
-            row.append("")
-
-        row[title_index] = title
-        updated_values.append(row)
-
-    # Write back only the data rows
-    start_cell = f"A2"
-    source_ws.update(start_cell, updated_values)
-    print("Image titles written successfully.")
-
-    source_ws = spreadsheet.worksheet('Images')
-    all_values = source_ws.get_all_values()
-    headers = all_values[0]
-    data_rows = all_values[1:]
-
-    try:
-        location_index = headers.index("Location")
-    except ValueError:
-        print("No 'Location' column found.")
-        return
-
-    for row in data_rows:
-        if len(row) > location_index:
-            url = row[location_index].strip()
-            # Match the filename without extension
-            match = re.search(r'/([^/]+)\.(jpg|jpeg|png|webp)$', url, re.IGNORECASE)
-            if match:
-                print(match.group(1))  # Prints filename without extension
-
-
+        data.append({"range": rowcol_to_a1(1, len(headers)), "values": [["Title"]]})
+        if len(headers) > source_ws.col_count:
+            with metrics.stage("write_back"):
+                source_ws.add_cols(len(headers) - source_ws.col_count)
+    title_index = headers.index("Title")
+    title_col = title_index + 1
+
+    # Compare the computed titles with what the column already holds
+    titles = []
+    changed = []
+    for row_num, row in enumerate(all_values[1:], start=2):
+        title = image_title(row[location_index]) if len(row) > location_index else ""
+        current = row[title_index] if len(row) > title_index else ""
+        titles.append(title)
+        if title != current:
+            changed.append(row_num)
+
+    for first, last in contiguous_runs(changed):
+        values = [[titles[row_num - 2]] for row_num in range(first, last + 1)]
+        data.append({"range": f"{rowcol_to_a1(first, title_col)}:{rowcol_to_a1(last, title_col)}", "values": values})
+
+    if data:
+        with metrics.stage("write_back", items=len(changed)):
+            source_ws.batch_update(data)
+        sheet_cache.invalidate(spreadsheet, source_ws.id)
+    print(f"Image titles written successfully ({len(changed)} of {len(titles)} changed).")
+
+    # Prints filenames without extension
+    for title in titles:
+        if title:
+            print(title)
+
+
+def probe_images(spreadsheet, max_workers=DEFAULT_WORKERS, per_host=DEFAULT_PER_HOST):
     """
-    Downloads images from the 'Location' column for rows marked 'true' in the 'Download' column.
-    Saves the images to the specified output folder.
+    Fetches just the header bytes of every image in the Images tab (HTTP Range) to learn its
+    width, height, format and size, then writes them to the Width/Height/Format/Bytes columns in one batch.
+    download_image uses these columns to skip or deprioritize images that already fit.
     """
-    # Define the output folder path
-    home_dir = os.path.expanduser("~")  # Get the user's home directory
-    output_folder = os.path.join(home_dir, "Documents", "Stanford Webmaster Files", "Images", "Downloaded Images")
-
-    # Ensure the output folder exists
-    os.makedirs(output_folder, exist_ok=True)
+    image_links = spreadsheet.worksheet('Images')
+    all_values = sheet_cache.get_all_values(image_links)
+    headers = all_values[0]
+    location_index = headers.index("Location")
 
-    # Fetch all rows from the spreadsheet
-    data_rows = spreadsheet.get_all_values()
-    headers = data_rows[0]
+    jobs = [FetchJob(row_idx, row[location_index].strip())
+            for row_idx, row in enumerate(all_values[1:], start=2)
+            if len(row) > location_index and row[location_index].strip()]
 
-    # Find indices for 'Download' and 'Location' columns
-    try:
-        download_index = headers.index('Download')
-        location_index = headers.index('Location')
-    except ValueError as e:
-        print(f"❌ Required column missing: {e}")
-        return
-
-    # Iterate through rows and download images
-    for row_num, row in enumerate(data_rows[1:], start=2):  # Skip header, start row_num at 2
-        if len(row) > download_index and row[download_index].strip().lower() == 'true':
-            if len(row) > location_index:
-                image_url = row[location_index].strip()
-                if image_url:
-                    try:
-                        # Fetch the image
-                        response = requests.get(image_url, stream=True)
-                        response.raise_for_status()  # Raise an error for bad responses
-
-                        # Extract the filename from the URL
-                        filename = os.path.basename(image_url)
-                        if not filename:  # Handle cases where the URL doesn't have a valid filename
-                            filename = f"image_{row_num}.jpg"
-                        output_path = os.path.join(output_folder, filename)
-
-                        # Save the image
-                        with open(output_path, "wb") as file:
-                            file.write(response.content)
-                        print(f"✅ Row {row_num}: Downloaded {filename} to {output_path}")
-                    except Exception as e:
-                        print(f"❌ Row {row_num}: Failed to download {image_url}: {e}")
-                else:
-                    print(f"⚠️ Row {row_num}: No URL found in 'Location' column.")
+    results = {}
+    for result in FetchEngine(max_workers, per_host).run(jobs, lambda job: probe(job.url)):
+        if result.ok:
+            results[result.job.row_idx] = result.value
         else:
-            print(f"⚠️ Row {row_num}: 'Download' not marked as true.")
-
-
-    # Define the output folder path
-    home_dir = os.path.expanduser("~")  # Get the user's home directory
-    output_folder = os.path.join(home_dir, "Documents", "Stanford Webmaster Files", "Images", "Downloaded Images")
+            print(f"❌ Row {result.job.row_idx}: Failed to probe {result.job.url}: {result.error}")
+
+    # Probe columns go after the existing ones the first time, and are reused after that
+    columns = []
+    for name in PROBE_COLUMNS:
+        if name not in headers:
+            headers.append(name)
+        columns.append(headers.index(name) + 1)
+    if len(headers) > image_links.col_count:
+        with metrics.stage("write_back"):
+            image_links.add_cols(len(headers) - image_links.col_count)
+
+    data = [{"range": rowcol_to_a1(1, col), "values": [[name]]} for name, col in zip(PROBE_COLUMNS, columns)]
+    # Only probed rows are written, so a failed probe keeps whatever an earlier run found
+    for first, last in contiguous_runs(sorted(results)):
+        probe_rows = [results[row_idx].as_row() for row_idx in range(first, last + 1)]
+        for i, col in enumerate(columns):
+            data.append({"range": f"{rowcol_to_a1(first, col)}:{rowcol_to_a1(last, col)}",
+                         "values": [[row[i]] for row in probe_rows]})
+    with metrics.stage("write_back", items=len(results)):
+        image_links.batch_update(data)
+    sheet_cache.invalidate(spreadsheet, image_links.id)
+
+    fitting = sum(1 for r in results.values() if r.fits((2000, 2000)))
+    print(f"🔎 Probed {len(results)} of {len(jobs)} images; {fitting} already fit within 2000x2000.")
+
+
+def fill_found_on_site(spreadsheet, index, tabs=FOUND_ON_SITE_TABS, pages_per_cell=PAGES_PER_CELL):
+    """
+    Writes the pages referencing each row's URL (from a CrawlIndex) to the "Found on site" column of
+    every tab in `tabs`, adding the column where it is missing. Only cells whose text changes are
+    written, in one batch_update per tab.
+    """
+    for tab, url_header in tabs.items():
+        try:
+            ws = spreadsheet.worksheet(tab)
+        except gspread.exceptions.WorksheetNotFound:
+            print(f"⏭️ No '{tab}' tab; skipped.")
+            continue
+        all_values = sheet_cache.get_all_values(ws)
+        headers = all_values[0] if all_values else []
+        if url_header not in headers:
+            print(f"❌ No '{url_header}' column in '{tab}'.")
+            continue
+        url_index = headers.index(url_header)
+
+        data = []
+        if "Found on site" not in headers:
+            headers.append("Found on site")
+            data.append({"range": rowcol_to_a1(1, len(headers)), "values": [["Found on site"]]})
+            if len(headers) > ws.col_count:
+                with metrics.stage("write_back"):
+                    ws.add_cols(len(headers) - ws.col_count)
+        found_index = headers.index("Found on site")
+        found_col = found_index + 1
+
+        texts, changed, referenced = {}, [], 0
+        for row_num, row in enumerate(all_values[1:], start=2):
+            url = row[url_index].strip() if len(row) > url_index else ""
+            pages = index.pages_referencing(url) if url else []
+            referenced += bool(pages)
+            texts[row_num] = found_on_site_text(pages, pages_per_cell)
+            if texts[row_num] != (row[found_index] if len(row) > found_index else ""):
+                changed.append(row_num)
+
+        for first, last in contiguous_runs(changed):
+            values = [[texts[row_num]] for row_num in range(first, last + 1)]
+            data.append({"range": f"{rowcol_to_a1(first, found_col)}:{rowcol_to_a1(last, found_col)}", "values": values})
+        if data:
+            with metrics.stage("write_back", items=len(changed)):
+                ws.batch_update(data)
+            sheet_cache.invalidate(spreadsheet, ws.id)
+        print(f"🔗 '{tab}': {referenced} of {len(texts)} files found on the site ({len(changed)} cells updated).")
+
+
+def crawl_site(seeds=(SITE_URL,), index_path=CRAWL_INDEX_FILENAME, max_workers=DEFAULT_WORKERS,
+               per_host=DEFAULT_PER_HOST, max_pages=MAX_PAGES, max_depth=MAX_DEPTH,
+               max_age_hours=CRAWL_MAX_AGE_HOURS, allowed_hosts=()):
+    """
+    Crawls the site from the seed URLs into an on-disk index of which pages reference which files.
+    The index persists between runs: an interrupted crawl resumes, and pages older than max_age_hours
+    are revalidated with conditional GETs. Runs once per run, however many spreadsheets are filled from it.
+    """
+    with CrawlIndex(index_path) as index:
+        crawler = Crawler(index, seeds, allowed_hosts, max_workers, per_host, max_pages, max_depth)
+        totals = crawler.run(max_age_hours * 3600 if max_age_hours is not None else None)
+    print(f"🕸️ Crawl finished: {totals['changed']} pages parsed, {totals['unchanged']} unchanged, "
+          f"{totals['skipped']} not HTML, {totals['failed']} failed.")
 
-    # Authenticate and open the spreadsheet
-    data_rows = spreadsheet.get_all_values()
-    headers = data_rows[0]
-    download_index = headers.index('Download')  # Find the column index for 'Download'
 
-    # Find indices for 'Location' and 'Download'
-    try:
-        download_index = headers.index('Download')
-        location_index = headers.index('Location')
-    except ValueError:
-        print("Required columns not found in the spreadsheet.")
-        return
+def fill_from_crawl_index(spreadsheet, index_path=CRAWL_INDEX_FILENAME):
+    """Fills "Found on site" in the Images and Old Files tabs from the index crawl_site built."""
+    with CrawlIndex(index_path) as index:
+        fill_found_on_site(spreadsheet, index)
 
-    # Ensure the output folder exists
-    os.makedirs(output_folder, exist_ok=True)
 
-    for row in data_rows[1:]: # skip header
-        if len(row) > download_index and row[download_index].strip().lower() == 'true':
-            image_url = row[headers.index('Location')].strip()
-            if image_url:
+class DownloadFailed(Exception):
+    """Raised by a fetch worker when the server answers with a non-200 status."""
 
-                try:
-                    # Fetch the image
-                    response = requests.get(image_url, stream=True)
-                    response.raise_for_status()  # Raise an error for bad responses
+    def __init__(self, status_code):
+        super().__init__(f"status {status_code}")
+        self.status_code = status_code
 
-                    # Extract the filename from the URL
-                    filename = os.path.basename(image_url)
-                    output_path = os.path.join(output_folder, filename)
 
-                    # Save the image
-                    with open(output_path, "wb") as file:
-                        file.write(response.content)
-                    print(f"✅ Downloaded: {filename} to {output_path}")
-                except Exception as e:
-                    print(f"❌ Failed to download {image_url}: {e}")
+def image_output_path(url, download_dir):
+    """Where the resized copy of the image at url is saved: its file name, with the extension lower-cased."""
+    parsed_url = urlparse(url)
+    base_filename = os.path.splitext(os.path.basename(parsed_url.path))[0]
+    original_ext = os.path.splitext(parsed_url.path)[1].lower()
+    return os.path.join(download_dir, base_filename + original_ext)
 
 
+def fetch_image(url, download_dir, memory_limit=DEFAULT_MEMORY_LIMIT, request_headers=None, spool_dir=None):
     """
-    Downloads images from the 'Location' column for rows marked 'true' in the 'Download' column.
-    Saves the images to the specified output folder.
+    Fetches one image into a Spool (in memory up to memory_limit, on disk past it).
+    Returns the spool, the path its resized copy should be saved to and the response validators.
+    The spool is None when a conditional request came back 304 Not Modified.
     """
-    # Define the output folder path
-    home_dir = os.path.expanduser("~")
-    output_folder = os.path.join(home_dir, "Documents", "Stanford Webmaster Files", "Images", "Downloaded Images")
-
-    # Ensure the output folder exists
-    os.makedirs(output_folder, exist_ok=True)
-
-    # Fetch all rows from the Images worksheet
-    try:
-        images_ws = spreadsheet.worksheet('Images')
-        data_rows = images_ws.get_all_values()
-        headers = data_rows[0]
-    except gspread.exceptions.WorksheetNotFound:
-        print("❌ 'Images' worksheet not found. Run filter_links() first.")
-        return
-
-    # Find indices for 'Download' and 'Location' columns
+    with metrics.stage("fetch", items=1):
+        response = transport.get(url, headers=request_headers, stream=True)
+        output_path = image_output_path(url, download_dir)
+
+        validators = {
+            "etag": response.headers.get("ETag"),
+            "last_modified": response.headers.get("Last-Modified"),
+        }
+        if response.status_code == 304 and request_headers:
+            response.close()
+            return None, output_path, validators
+        if response.status_code != 200:
+            response.close()
+            raise DownloadFailed(response.status_code)
+
+        spool = spool_response(response, memory_limit, spool_dir)
+        metrics.add("fetch", bytes_in=spool.size)
+        return spool, output_path, validators
+
+
+def get_pdf(url):
+    response = transport.get(url, stream=True)
+    if response.status_code != 200:
+        response.close()
+        raise DownloadFailed(response.status_code)
+    return response
+
+
+def probe_ranges(url, threshold):
+    """HEAD of url when it is large enough to fetch as byte ranges, or None (its body is fetched in one stream)."""
     try:
-        download_index = headers.index('Download')
-        location_index = headers.index('Location')
-    except ValueError as e:
-        print(f"❌ Required column missing: {e}")
-        return
-
-    # Iterate through rows and download images
-    downloaded_count = 0
-    for row_num, row in enumerate(data_rows[1:], start=2):
-        if len(row) > download_index and row[download_index].strip().lower() == 'true':
-            if len(row) > location_index:
-                image_url = row[location_index].strip()
-                if image_url:
-                    try:
-                        # Fetch the image
-                        response = requests.get(image_url, stream=True, timeout=30)
-                        response.raise_for_status()
-
-                        # Extract the filename from the URL
-                        filename = os.path.basename(image_url)
-                        if not filename or '.' not in filename:
-                            filename = f"image_{row_num}.jpg"
-                        
-                        output_path = os.path.join(output_folder, filename)
-
-                        # Save the image
-                        with open(output_path, "wb") as file:
-                            file.write(response.content)
-                        
-                        print(f"✅ Row {row_num}: Downloaded {filename}")
-                        downloaded_count += 1
-                        
-                    except Exception as e:
-                        print(f"❌ Row {row_num}: Failed to download {image_url}: {e}")
-                else:
-                    print(f"⚠️ Row {row_num}: No URL found in 'Location' column.")
-
-    print(f"📊 Total images downloaded: {downloaded_count}")
+        response = transport.head(url)
+    except requests.RequestException:
+        return None  # the GET reports the real failure
+    response.close()
+    if response.status_code == 200 and wants_ranges(response, threshold):
+        return response
+    return None
 
 
+def save_pdf(url, download_dir, connections=RANGE_CONNECTIONS, threshold=RANGED_THRESHOLD, size=None, engine=None):
+    """
+    Saves a PDF into download_dir. Files of `threshold` bytes or more, on servers that accept byte ranges
+    (checked with a HEAD, skipped when the known `size` is well below threshold), are fetched as up to
+    `connections` parallel ranges and resume where they stopped (see ranged_download); everything else is
+    streamed in one request. Under a FetchEngine, the extra range connections are borrowed from the host's
+    per-host cap, so a large file gets fewer of them while other downloads from its host are running.
+    """
+    filename = os.path.join(download_dir, getFileName(url))
+    with metrics.stage("fetch", items=1):
+        head = None
+        if connections > 1 and (size is None or size * 2 >= threshold):
+            head = probe_ranges(url, threshold)
+        if head is not None:
+            extra = engine.borrow(urlparse(url).netloc.lower(), connections - 1) if engine else nullcontext(connections - 1)
+            try:
+                with extra as count:
+                    return download_ranged(url, filename, head.headers, 1 + count)
+            except RangeNotSatisfied as e:
+                print(f"⚠️ Byte ranges refused ({e}), downloading in one stream: {url}")
+            except requests.HTTPError as e:
+                # Same outcome as a failed single stream; the finished pieces stay on disk for a rerun
+                raise DownloadFailed(e.response.status_code) from e
+
+        response = get_pdf(url)
+        with open(filename, 'wb') as f:
+            for chunk in response.iter_content(chunk_size=8192):
+                f.write(chunk)
+                metrics.add("fetch", bytes_in=len(chunk))
+    return filename
+
+
+def download_image(spreadsheet, max_workers=DEFAULT_WORKERS, per_host=DEFAULT_PER_HOST,
+                   memory_limit=DEFAULT_MEMORY_LIMIT, cpu_workers=DEFAULT_CPU_WORKERS, order="sheet",
+                   bandwidth=ESTIMATED_BANDWIDTH, skip_fitting=False, download_dir=IMAGE_DOWNLOAD_DIR,
+                   store_dir=None, shared=None, settings=None, originals_budget=ORIGINALS_BUDGET, revalidate=True):
     """
-    Downloads images from the 'Location' column for rows marked 'true' in the 'Download' column.
-    Saves the images to the specified output folder.
+    Downloads the Images rows marked for download, fits them within 2000x2000 (or per `settings`, an
+    EncodeSettings) and records their status.
+    Originals stay in the blob store, up to originals_budget bytes, so a rerun with other settings
+    re-encodes from disk: each cached original costs a conditional GET, or no request at all with
+    revalidate=False.
+    store_dir and shared (a SharedFetches) let concurrent audits share one blob store and fetch a URL
+    they have in common only once; see audit_runner.
     """
-    # Define the output folder path
-    home_dir = os.path.expanduser("~")
-    output_folder = os.path.join(home_dir, "Documents", "Stanford Webmaster Files", "Images", "Downloaded Images")
+    # Pillow and SQLite are only needed here
+    from image_processing import EncodeSettings, encode_image, rendition_path
+    from manifest import Manifest, MANIFEST_FILENAME, conditional_headers
 
-    # Ensure the output folder exists
-    os.makedirs(output_folder, exist_ok=True)
+    # Set Download Directory
+    os.makedirs(download_dir, exist_ok=True)
 
-    # Fetch all rows from the Images worksheet
-    try:
-        images_ws = spreadsheet.worksheet('Images')
-        data_rows = images_ws.get_all_values()
-        headers = data_rows[0]
-    except gspread.exceptions.WorksheetNotFound:
-        print("❌ 'Images' worksheet not found. Run filter_links() first.")
-        return
+    # Set up sheet tab
+    image_links = spreadsheet.worksheet('Images')
+    all_values = sheet_cache.get_all_values(image_links)
+    headers = all_values[0] if all_values else []
+    rows = sheet_cache.get_all_records(image_links)
 
-    # Find indices for 'Download' and 'Location' columns
-    try:
-        download_index = headers.index('Download')
-        location_index = headers.index('Location')
-    except ValueError as e:
-        print(f"❌ Required column missing: {e}")
-        return
+    # Resize settings
+    settings = settings or EncodeSettings(max_size=(2000, 2000))  # Fit within 2000x2000 box
 
-    # Iterate through rows and download images
-    downloaded_count = 0
-    for row_num, row in enumerate(data_rows[1:], start=2):
-        if len(row) > download_index and row[download_index].strip().lower() == 'true':
-            if len(row) > location_index:
-                image_url = row[location_index].strip()
-                if image_url:
-                    try:
-                        # Fetch the image
-                        response = requests.get(image_url, stream=True, timeout=30)
-                        response.raise_for_status()
-
-                        # Extract the filename from the URL
-                        filename = os.path.basename(image_url)
-                        if not filename or '.' not in filename:
-                            filename = f"image_{row_num}.jpg"
-                        
-                        output_path = os.path.join(output_folder, filename)
-
-                        # Save the image
-                        with open(output_path, "wb") as file:
-                            file.write(response.content)
-                        
-                        print(f"✅ Row {row_num}: Downloaded {filename}")
-                        downloaded_count += 1
-                        
-                    except Exception as e:
-                        print(f"❌ Row {row_num}: Failed to download {image_url}: {e}")
+    jobs = []
+    fitting = []
+    for row_idx, row in enumerate(rows, start=2):
+        if str(row.get('Download', '')).strip().lower() in ['pending', 'p', 'true']:
+            url = str(row.get('Location', '')).strip()
+            if url:
+                job = FetchJob(row_idx, url, size=parse_size(row.get('Bytes') or row.get('Size', '')))
+                # Rows probe_images found to already fit need no resize
+                probed = ProbeResult(width=row.get('Width') or None, height=row.get('Height') or None)
+                if isinstance(probed.width, int) and isinstance(probed.height, int) and probed.fits(settings.max_size):
+                    fitting.append(job)
                 else:
-                    print(f"⚠️ Row {row_num}: No URL found in 'Location' column.")
-
-    print(f"📊 Total images downloaded: {downloaded_count}")
-
+                    jobs.append(job)
 
+    # Largest-first gives the most savings per minute, smallest-first the fastest feedback
+    jobs = order_jobs(jobs, order)
+    if skip_fitting:
+        print(f"⏭️ Skipping {len(fitting)} images that already fit within {settings.max_size[0]}x{settings.max_size[1]}")
+    else:
+        jobs += order_jobs(fitting, order)
+    index = SizeIndex.from_rows(jobs, lambda job: job.size)
+    if len(index):
+        print(f"📦 {len(jobs)} images queued, {format_bytes(index.total_bytes())} known, "
+              f"about {format_duration(index.estimate_seconds(bandwidth))} at {format_bytes(bandwidth)}/s")
+    else:
+        print(f"📦 {len(jobs)} images queued, sizes unknown (run probe first for an estimate)")
+
+    # Statuses go to the Status column wherever it is (probe_images appends columns), added after the rest if missing
+    add_status = bool(jobs) and "Status" not in headers
+    if add_status:
+        headers.append("Status")
+        if len(headers) > image_links.col_count:
+            with metrics.stage("write_back"):
+                image_links.add_cols(len(headers) - image_links.col_count)
+    status_col = headers.index("Status") + 1 if "Status" in headers else None
+
+    # Rows already processed with the same settings are revalidated with a conditional GET and skipped if unchanged
+    settings_key = settings.key()
+    manifest = Manifest(os.path.join(download_dir, MANIFEST_FILENAME))
+
+    # Originals and outputs are stored once per unique content; files in download_dir link into the store
+    store = BlobStore(store_dir or os.path.join(download_dir, STORE_DIRNAME), originals_budget)
+    store.add_claims(manifest.output_owners())
+
+    def materialize_outputs(encoded_path, named_path):
+        """Links the encoded output and its renditions into download_dir; returns the main output's path."""
+        for rendition in settings.renditions:
+            store.materialize(rendition_path(encoded_path, rendition), rendition_path(named_path, rendition))
+        return store.materialize(encoded_path, named_path)
+
+    def stored(digest):
+        """The stored original with this hash (pinned against eviction until closed), or None if evicted."""
+        blob = store.find_blob(digest)
+        return StoredBody(blob, digest, lambda: store.unpin(digest)) if blob else None
+
+    def cached_original(url):
+        """(body, validators) for url's original from an earlier run, e.g. with other settings, or (None, None)."""
+        original = manifest.get(url)
+        body = stored(original["content_hash"]) if original and original["content_hash"] else None
+        if body is None:
+            return None, None
+        validators = {"etag": original["etag"], "last_modified": original["last_modified"]}
+        if revalidate:
+            # Only a 304 confirms the cached bytes are still what the server has
+            try:
+                spool, _, fresh = fetch_image(url, download_dir, memory_limit, conditional_headers(original), store.tmp_dir)
+            except BaseException:
+                body.close()
+                raise
+            if spool is not None:
+                body.close()
+                return spool, fresh
+            validators = {key: fresh[key] or value for key, value in validators.items()}
+        metrics.add("fetch", cache_hits=1, cache_bytes=body.size)
+        return body, validators
+
+    def fetch_to_store(url):
+        spool, _, validators = fetch_image(url, download_dir, memory_limit, None, store.tmp_dir)
+        with spool:
+            store.put(spool)
+            return spool.sha256, validators
+
+    # Encodes under way, by output path (content hash + settings): identical images wait for the first encode
+    in_flight = {}
+    in_flight_lock = threading.Lock()
+
+    def encoded(data, error=None):
+        """Wakes the rows waiting on this row's encode."""
+        encoded_path = data.pop("encoding", None)
+        if encoded_path:
+            with in_flight_lock:
+                future = in_flight.pop(encoded_path)
+            if error:
+                future.set_exception(error)
+            else:
+                future.set_result(encoded_path)
+
+    def fetch(job):
+        entry = manifest.get_current(job.url, settings_key)
+        output_path = image_output_path(job.url, download_dir)
+        spool = None
+        if entry is None:
+            spool, validators = cached_original(job.url)
+        if spool is None and entry is None and shared is not None:
+            # Another audit in this run may have fetched the URL already; its original is in the shared store
+            (digest, validators), fetched = shared.fetch(job.url, lambda: fetch_to_store(job.url))
+            if not fetched:
+                metrics.add("fetch", shared_hits=1)
+            spool = stored(digest)
+        if spool is None:
+            spool, _, validators = fetch_image(job.url, download_dir, memory_limit,
+                                               conditional_headers(entry), store.tmp_dir)
+        job.data.update(validators)
+        if spool is None:
+            job.data.update(content_hash=entry["content_hash"], output_path=entry["output_path"], skip_reason="unchanged")
+            return None, entry["output_path"]
+
+        digest = spool.sha256
+        job.data["content_hash"] = digest
+        if entry and entry["content_hash"] == digest:
+            # Server ignored the validators but the bytes are the same
+            spool.close()
+            job.data.update(output_path=entry["output_path"], skip_reason="unchanged")
+            return None, entry["output_path"]
+
+        named_path = store.claim(output_path, job.url, digest)
+        job.data["output_path"] = named_path
+        try:
+            store.put(spool)
+            encoded_path = store.output_path(digest, settings_key, os.path.splitext(output_path)[1])
+            with in_flight_lock:
+                first = in_flight.get(encoded_path)
+                if first is None and not os.path.exists(encoded_path):
+                    in_flight[encoded_path] = Future()
+                    job.data["encoding"] = encoded_path
+            if "encoding" not in job.data:
+                # Identical image already encoded with these settings (or being encoded), possibly under another URL
+                spool.close()
+                if first is not None:
+                    first.result()
+                job.data["skip_reason"] = "duplicate"
+                return None, materialize_outputs(encoded_path, named_path)
+        except BaseException:
+            spool.close()
+            raise
+        return spool, (encoded_path, settings)
+
+    # Downloads run on I/O threads while resizing and re-encoding run in a process pool
+    # Statuses are buffered and written back in batches so downloads never wait on the Sheets API
+    pipeline = Pipeline(max_workers, per_host, cpu_workers)
+    with manifest, SheetWriteBuffer(image_links) as status:
+        if add_status:
+            status.update_cell(1, status_col, "Status")
+        results = pipeline.run(jobs, fetch, encode_image)
+        try:
+            for result in results:
+                row_idx, url, data = result.job.row_idx, result.job.url, result.job.data
+                encoded(data, result.error)
+                if result.ok:
+                    if not result.skipped:
+                        materialize_outputs(result.value, data["output_path"])
+                        extra = f" (+{len(settings.renditions)} renditions)" if settings.renditions else ""
+                        print(f"✅ Downloaded and resized: {data['output_path']}{extra}")
+                    elif data.get("skip_reason") == "duplicate":
+                        print(f"♻️ Identical to an image already processed, reused: {data['output_path']}")
+                    else:
+                        print(f"⏭️ Unchanged since last run: {data['output_path']}")
+                    manifest.record(url, data["output_path"], settings_key, etag=data.get("etag"),
+                                    last_modified=data.get("last_modified"), content_hash=data.get("content_hash"))
+                    status.update_cell(row_idx, status_col, 'Downloaded')
+                elif isinstance(result.error, DownloadFailed):
+                    print(f"❌ Failed to download (status {result.error.status_code}): {url}")
+                    status.update_cell(row_idx, status_col, 'Failed')
+                else:
+                    print(f"❌ Error downloading {url}: {result.error}")
+                    status.update_cell(row_idx, status_col, 'Failed')
+        finally:
+            # Rows still waiting on an encode that will not finish give up before the pipeline shuts down
+            with in_flight_lock:
+                for future in in_flight.values():
+                    future.cancel()
+            results.close()
+
+
+def download_pdfs(spreadsheet, max_workers=DEFAULT_WORKERS, per_host=DEFAULT_PER_HOST, download_dir=PDF_DOWNLOAD_DIR,
+                  connections=RANGE_CONNECTIONS, threshold=RANGED_THRESHOLD):
     # Set Download Directory
-    download_dir = "/Users/tpham/Documents/Stanford Webmaster Files/File Reuploads/Automated Downloads"
     os.makedirs(download_dir, exist_ok=True)
 
     # Set up sheet tab
     old_files = spreadsheet.worksheet('Old Files')  # Access "Old Files" sheet
-    rows = old_files.get_all_records()
-
-    # Loop through the sheet
-    for row_idx, row in enumerate(rows, start=2):
-        if row['Type'] == 'PDF' and row['Status'] == 'Pending':
-            url = row['URL']
-            filename = os.path.join(download_dir, getFileName(url))
-            try:
-                response = requests.get(url, headers={
-                    "User-Agent": "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/135.0.0.0 Safari/537.36"
-                }, stream=True)
-
-                if response.status_code == 200:
-                    with open(filename, 'wb') as f:
-                        for chunk in response.iter_content(chunk_size=8192):
-                            f.write(chunk)
-                    print(f"Downloaded: {filename}")
-                    old_files.update_cell(row_idx, 5, 'Downloaded')
-                else:
-                    print(f"Failed to download. Status code: {response.status_code}")
-                    old_files.update_cell(row_idx, 5, 'Failed')
-
-            except Exception as e:
-                print(f"Error downloading: {e}")
+    rows = sheet_cache.get_all_records(old_files)
+
+    jobs = [FetchJob(row_idx, row['URL'], size=parse_size(row.get('Size', '')))
+            for row_idx, row in enumerate(rows, start=2)
+            if row['Type'] == 'PDF' and row['Status'] == 'Pending']
+
+    engine = FetchEngine(max_workers, per_host)
+    fetch = lambda job: save_pdf(job.url, download_dir, connections, threshold, job.size, engine)
+    with SheetWriteBuffer(old_files) as status:
+        for result in engine.run(jobs, fetch):
+            if result.ok:
+                print(f"Downloaded: {result.value}")
+                status.update_cell(result.job.row_idx, 5, 'Downloaded')
+            elif isinstance(result.error, DownloadFailed):
+                print(f"Failed to download. Status code: {result.error.status_code}")
+                status.update_cell(result.job.row_idx, 5, 'Failed')
+            else:
+                print(f"Error downloading: {result.error}")
+
+
+def download_images_browser(spreadsheet, max_workers=DEFAULT_WORKERS, per_host=DEFAULT_PER_HOST,
+                            browsers=DEFAULT_BROWSERS, output_folder=BROWSER_DOWNLOAD_DIR):
     """
     Downloads images using Selenium to bypass 403 restrictions.
     """
-    # Define the output folder path
-    home_dir = os.path.expanduser("~")
-    output_folder = os.path.join(home_dir, "Documents", "Stanford Webmaster Files", "Images", "Downloaded Images")
-    
     # Ensure the output folder exists
     os.makedirs(output_folder, exist_ok=True)
 
     # Fetch all rows from the Images worksheet
     try:
         images_ws = spreadsheet.worksheet('Images')
-        data_rows = images_ws.get_all_values()
+        data_rows = sheet_cache.get_all_values(images_ws)
         headers = data_rows[0]
     except gspread.exceptions.WorksheetNotFound:
         print("❌ 'Images' worksheet not found. Run filter_links() first.")
@@ -468,262 +606,243 @@ def write_image_titles(spreadsheet):
         print(f"❌ Required column missing: {e}")
         return
 
-    # Set up Chrome options
-    chrome_options = Options()
-    chrome_options.add_argument("--headless")  # Run in background
-    chrome_options.add_argument("--no-sandbox")
-    chrome_options.add_argument("--disable-dev-shm-usage")
-    chrome_options.add_argument("--disable-gpu")
-    chrome_options.add_argument("--window-size=1920,1080")
-    chrome_options.add_argument("--user-agent=Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36")
-
-    # Initialize the driver
+    # Long-lived headless browsers; cookies are harvested once per host and reused until they expire or 403 again
+    pool = BrowserPool(browsers)
     try:
-        service = Service(ChromeDriverManager().install())
-        driver = webdriver.Chrome(service=service, options=chrome_options)
+        pool.start()
         print("✅ Chrome driver initialized successfully")
     except Exception as e:
         print(f"❌ Failed to initialize Chrome driver: {e}")
+        pool.close()
         return
+    cookie_cache = CookieCache(pool)
+
+    def fetch_with_cookies(job):
+        image_url = job.url
+
+        # Extract filename from URL
+        filename = os.path.basename(image_url.split('?')[0])
+        if not filename or '.' not in filename:
+            filename = f"image_{job.row_idx}.jpg"
+
+        output_path = os.path.join(output_folder, filename)
+
+        # Download over the shared session with cookies from the browser (same user agent as the browser)
+        cookies = cookie_cache.get(image_url)
+        with metrics.stage("fetch", items=1):
+            response = transport.get(image_url, headers={'Referer': image_url}, cookies=cookies, stream=True)
+            if response.status_code == 403:
+                # Cookies went stale: harvest a fresh set and try once more
+                response.close()
+                cookie_cache.invalidate(image_url, cookies)
+                cookies = cookie_cache.get(image_url)
+                response = transport.get(image_url, headers={'Referer': image_url}, cookies=cookies, stream=True)
+            response.raise_for_status()
+
+            # Save the image
+            with open(output_path, "wb") as file:
+                for chunk in response.iter_content(chunk_size=8192):
+                    file.write(chunk)
+                    metrics.add("fetch", bytes_in=len(chunk))
+        return filename
+
+    jobs = []
+    for row_num, row in enumerate(data_rows[1:], start=2):
+        if len(row) > download_index and row[download_index].strip().lower() == 'true':
+            if len(row) > location_index:
+                image_url = row[location_index].strip()
+                if image_url:
+                    jobs.append(FetchJob(row_num, image_url))
+                else:
+                    print(f"⚠️ Row {row_num}: No URL found in 'Location' column.")
 
     downloaded_count = 0
-    
+
     try:
-        # Iterate through rows and download images
-        for row_num, row in enumerate(data_rows[1:], start=2):
-            if len(row) > download_index and row[download_index].strip().lower() == 'true':
-                if len(row) > location_index:
-                    image_url = row[location_index].strip()
-                    if image_url:
-                        try:
-                            print(f"🔄 Row {row_num}: Attempting to download {image_url}")
-                            
-                            # Navigate to the image URL
-                            driver.get(image_url)
-                            time.sleep(2)  # Wait for page to load
-                            
-                            # Get cookies from the browser session
-                            cookies = driver.get_cookies()
-                            
-                            # Create a cookie jar for requests
-                            cookie_dict = {cookie['name']: cookie['value'] for cookie in cookies}
-                            
-                            # Extract filename from URL
-                            filename = os.path.basename(image_url.split('?')[0])
-                            if not filename or '.' not in filename:
-                                filename = f"image_{row_num}.jpg"
-                            
-                            output_path = os.path.join(output_folder, filename)
-                            
-                            # Download using requests with cookies from Selenium
-                            headers_for_request = {
-                                'User-Agent': 'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36',
-                                'Referer': image_url
-                            }
-                            
-                            response = requests.get(
-                                image_url,
-                                headers=headers_for_request,
-                                cookies=cookie_dict,
-                                stream=True,
-                                timeout=30
-                            )
-                            response.raise_for_status()
-                            
-                            # Save the image
-                            with open(output_path, "wb") as file:
-                                for chunk in response.iter_content(chunk_size=8192):
-                                    file.write(chunk)
-                            
-                            print(f"✅ Row {row_num}: Downloaded {filename}")
-                            downloaded_count += 1
-                            
-                            # Small delay between downloads
-                            time.sleep(1)
-                            
-                        except Exception as e:
-                            print(f"❌ Row {row_num}: Failed to download {image_url}: {e}")
-                    else:
-                        print(f"⚠️ Row {row_num}: No URL found in 'Location' column.")
-    
+        engine = FetchEngine(max_workers, per_host)
+        for result in engine.run(jobs, fetch_with_cookies):
+            if result.ok:
+                print(f"✅ Row {result.job.row_idx}: Downloaded {result.value}")
+                downloaded_count += 1
+            else:
+                print(f"❌ Row {result.job.row_idx}: Failed to download {result.job.url}: {result.error}")
+
     finally:
-        # Always close the driver
-        driver.quit()
+        # Always close the drivers
+        pool.close()
         print(f"📊 Total images downloaded: {downloaded_count}")
 
 
-    # Set Download Directory
-    download_dir = "/Users/tpham/Documents/Stanford Webmaster Files/Images/Automated Downloads"
-    os.makedirs(download_dir, exist_ok=True)
-
-    # Set up sheet tab
-    image_links = spreadsheet.worksheet('Images')  # Access "Old Files" sheet
-    rows = image_links.get_all_records()
-
-    # Loop through the sheet
-    for row_idx, row in enumerate(rows, start=2):
-        if row['Download'] == 'Pending':
-            url = row['Location']
-            filename = os.path.join(download_dir, getFileName(url))
-            try:
-                response = requests.get(url, headers={
-                    "User-Agent": "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/135.0.0.0 Safari/537.36"
-                }, stream=True)
-
-                if response.status_code == 200:
-                    with open(filename, 'wb') as f:
-                        for chunk in response.iter_content(chunk_size=8192):
-                            f.write(chunk)
-                    print(f"Downloaded: {filename}")
-                    image_links.update_cell(row_idx, 6, 'Downloaded')
-                else:
-                    print(f"Failed to download. Status code: {response.status_code}")
-                    image_links.update_cell(row_idx, 6, 'Failed')
-
-            except Exception as e:
-                print(f"Error downloading: {e}")
-
-# def download_image(spreadsheet):
-
-    # Set Download Directory
-    download_dir = "/Users/tpham/Documents/Stanford Webmaster Files/Images/Automated Downloads"
-    os.makedirs(download_dir, exist_ok=True)
-
-    # Set up sheet tab
-    image_links = spreadsheet.worksheet('Images')
-    rows = image_links.get_all_records()
-
-    # Resize settings
-    max_size = (2000, 2000)  # Fit within 2000x2000 box
-
-    for row_idx, row in enumerate(rows, start=2):
-        if row.get('Download', '').strip().lower() == 'pending' or row.get('Download', '').strip().lower() == 'p':
-            url = row.get('Location', '').strip()
-            if not url:
-                continue
-
-            try:
-                response = requests.get(url, headers={
-                    "User-Agent": "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7)"
-                }, stream=True, timeout=30)
-
-                if response.status_code == 200:
-                    # Open image from stream
-                    image = Image.open(BytesIO(response.content))
-                    image.thumbnail(max_size)  # Resize while keeping aspect ratio
-
-                    # Force save as JPEG
-                    base_filename = os.path.splitext(getFileName(url))[0]
-                    output_path = os.path.join(download_dir, f"{base_filename}.jpg")
-
-                    # Convert to RGB if not JPEG-compatible
-                    if image.mode in ("RGBA", "P"):  # Handle transparency or palettes
-                        image = image.convert("RGB")
-
-                    # Save with JPEG compression
-                    image.save(output_path, format='JPEG', quality=95, optimize=True)
-                    print(f"✅ Downloaded and resized: {output_path}")
-
-                    # Mark as downloaded
-                    image_links.update_cell(row_idx, 6, 'Downloaded')
-                else:
-                    print(f"❌ Failed to download (status {response.status_code}): {url}")
-                    image_links.update_cell(row_idx, 6, 'Failed')
-
-            except Exception as e:
-                print(f"❌ Error downloading {url}: {e}")
-                image_links.update_cell(row_idx, 6, 'Failed')
-
-def download_image(spreadsheet):
-    import os
-    import requests
-    from urllib.parse import urlparse, unquote
-    from PIL import Image
-    from io import BytesIO
-
-    # Set Download Directory
-    download_dir = "/Users/tpham/Documents/Stanford Webmaster Files/Images/Automated Downloads"
-    os.makedirs(download_dir, exist_ok=True)
-
-    # Set up sheet tab
-    image_links = spreadsheet.worksheet('Images')
-    rows = image_links.get_all_records()
-
-    # Resize settings
-    max_size = (2000, 2000)  # Fit within 2000x2000 box
-
-    for row_idx, row in enumerate(rows, start=2):
-        if row.get('Download', '').strip().lower() in ['pending', 'p', 'true']:
-            url = row.get('Location', '').strip()
-            if not url:
-                continue
-
-            try:
-                response = requests.get(url, headers={
-                    "User-Agent": "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7)"
-                }, stream=True, timeout=30)
-
-                if response.status_code == 200:
-                    # Open image from stream
-                    image = Image.open(BytesIO(response.content))
-                    icc_profile = image.info.get("icc_profile")  # Try to retain ICC color profile
-                    image.thumbnail(max_size)  # Resize while keeping aspect ratio
-
-                    # Extract file name and extension
-                    parsed_url = urlparse(url)
-                    base_filename = os.path.splitext(os.path.basename(parsed_url.path))[0]
-                    original_ext = os.path.splitext(parsed_url.path)[1].lower()
-                    output_path = os.path.join(download_dir, base_filename + original_ext)
-
-                    # Convert if saving as JPEG and incompatible mode
-                    if original_ext in ['.jpg', '.jpeg'] and image.mode not in ("RGB", "L"):
-                        image = image.convert("RGB")
-
-                    # Save image with proper format and ICC profile if available
-                    save_args = {"optimize": True}
-                    if original_ext in ['.jpg', '.jpeg']:
-                        save_args["format"] = 'JPEG'
-                        save_args["quality"] = 95
-                        if icc_profile:
-                            save_args["icc_profile"] = icc_profile
-                    else:
-                        save_args["format"] = image.format or "PNG"  # fallback
-
-                    image.save(output_path, **save_args)
-
-                    print(f"✅ Downloaded and resized: {output_path}")
-                    image_links.update_cell(row_idx, 6, 'Downloaded')
-                else:
-                    print(f"❌ Failed to download (status {response.status_code}): {url}")
-                    image_links.update_cell(row_idx, 6, 'Failed')
-
-            except Exception as e:
-                print(f"❌ Error downloading {url}: {e}")
-                image_links.update_cell(row_idx, 6, 'Failed')
-
 def getFileName(url):
     path = urlparse(url).path
     filename = os.path.basename(path)
     return unquote(filename)
 
 # Authenticate and run
-def authenticate_google_sheet():
+def authenticate_google_sheet(credentials_file=CREDENTIALS_FILE):
+    from oauth2client.service_account import ServiceAccountCredentials
     scope = ['https://spreadsheets.google.com/feeds', 'https://www.googleapis.com/auth/drive']
-    credentials = ServiceAccountCredentials.from_json_keyfile_name('credentials.json', scope)
+    credentials = ServiceAccountCredentials.from_json_keyfile_name(credentials_file, scope)
     client = gspread.authorize(credentials)
     return client
 
 def open_spreadsheet(client, sheet_name):
-    return client.open(sheet_name)
-
-def main():
-    client = authenticate_google_sheet()
-    spreadsheet = open_spreadsheet(client, 'Media Library Audit - April 2025')
-    
-    # Uncomment the functions you want to run:
-    # filter_links(spreadsheet)
-    # write_image_titles(spreadsheet)
-    download_image(spreadsheet)
+    # Accepts a title or a spreadsheet ID
+    # Every Sheets call on the returned spreadsheet is rate-limited to the API quota and retried on 429
+    opener = client.open_by_key if is_spreadsheet_key(sheet_name) else client.open
+    return sheets_scheduler.wrap(sheets_scheduler.call("read", opener, sheet_name))
+
+def parse_dimensions(text):
+    """'2000x2000' -> (2000, 2000), for argparse."""
+    try:
+        width, height = (int(part) for part in text.lower().split("x"))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"expected WIDTHxHEIGHT, got {text!r}") from None
+    return width, height
+
+
+def parse_renditions(text):
+    """'1200,800:webp' -> (Rendition(1200), Rendition(800, format='webp')), for argparse."""
+    from image_processing import parse_rendition
+    try:
+        return tuple(parse_rendition(spec) for spec in text.split(",") if spec.strip())
+    except ValueError as e:
+        raise argparse.ArgumentTypeError(str(e)) from None
+
+
+def encode_settings(args):
+    from image_processing import EncodeSettings
+    return EncodeSettings(max_size=args.max_size, quality=args.quality, keep_icc=not args.no_icc,
+                          renditions=args.renditions)
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Media library audit: filter the storage report and download its files.")
+    parser.add_argument("--spreadsheet", metavar="NAME", action="append",
+                        help="Spreadsheet title, ID or title glob such as 'Media Library Audit - *' (repeatable; "
+                             f"default: '{DEFAULT_SPREADSHEET}')")
+    parser.add_argument("--parallel", type=int, default=DEFAULT_PARALLEL_AUDITS,
+                        help="Spreadsheets processed at the same time")
+    parser.add_argument("--credentials", default=CREDENTIALS_FILE, help="Service account key file")
+    parser.add_argument("--local", metavar="PATH",
+                        help="Work on a local CSV directory, SQLite file or Parquet directory instead of Google Sheets")
+    parser.add_argument("--sync", metavar="TAB", action="append",
+                        help="With --local: push this tab to the spreadsheet afterwards (repeatable)")
+    parser.add_argument("--read-quota", type=int, default=sheets_scheduler.READ_PER_MINUTE, help="Sheets reads per minute")
+    parser.add_argument("--write-quota", type=int, default=sheets_scheduler.WRITE_PER_MINUTE, help="Sheets writes per minute")
+    parser.add_argument("--metrics-json", default=METRICS_JSON, help="Where to write the run metrics")
+    parser.add_argument("--prometheus-textfile", default=METRICS_PROMETHEUS, help="Also export metrics to this .prom file")
+    parser.add_argument("--profile", metavar="STAGE", action="append", default=[], help="cProfile this stage (repeatable)")
+    parser.add_argument("--trace-memory", metavar="STAGE", action="append", default=[],
+                        help="Record the tracemalloc peak of this stage (repeatable)")
+    parser.add_argument("--profile-dir", default=metrics.DEFAULT_PROFILE_DIR)
+    commands = parser.add_subparsers(dest="command", required=True, metavar="command")
+
+    def concurrency(command):
+        command.add_argument("--workers", type=int, default=DEFAULT_WORKERS, help="Concurrent downloads")
+        command.add_argument("--per-host", type=int, default=DEFAULT_PER_HOST, help="Concurrent downloads per host")
+
+    command = commands.add_parser("filter", help="Copy image rows of the storage report into the Images tab")
+    command.add_argument("--incremental", action="store_true",
+                         help="Update the Images tab in place, keeping Title/Download/Status, instead of recreating it")
+    command.set_defaults(run=lambda spreadsheet, args, audit: filter_links(spreadsheet, incremental=args.incremental))
+
+    command = commands.add_parser("titles", help="Fill the Title column of the Images tab")
+    command.set_defaults(run=lambda spreadsheet, args, audit: write_image_titles(spreadsheet))
+
+    command = commands.add_parser("crawl", help="Crawl the site and fill the \"Found on site\" columns")
+    concurrency(command)
+    command.add_argument("--seed", action="append", help=f"Start URL (repeatable; default {SITE_URL})")
+    command.add_argument("--allow-host", action="append", default=[], help="Also follow links to this host")
+    command.add_argument("--index", default=CRAWL_INDEX_FILENAME, help="Crawl index file, kept between runs")
+    command.add_argument("--max-pages", type=int, default=MAX_PAGES, help="Pages fetched per run")
+    command.add_argument("--max-depth", type=int, default=MAX_DEPTH, help="Links followed away from the seeds")
+    command.add_argument("--max-age", type=float, default=CRAWL_MAX_AGE_HOURS,
+                         help="Hours after which crawled pages are revalidated")
+    command.add_argument("--no-crawl", action="store_true", help="Only fill the columns from the existing index")
+    # The site is crawled once, before the audits; each spreadsheet is then filled from the index
+    command.set_defaults(
+        prepare=lambda args: None if args.no_crawl else crawl_site(
+            args.seed or [SITE_URL], args.index, args.workers, args.per_host, args.max_pages,
+            args.max_depth, args.max_age, args.allow_host),
+        run=lambda spreadsheet, args, audit: fill_from_crawl_index(spreadsheet, args.index))
+
+    command = commands.add_parser("probe", help="Record image dimensions and sizes from their headers")
+    concurrency(command)
+    command.set_defaults(run=lambda spreadsheet, args, audit: probe_images(spreadsheet, args.workers, args.per_host))
+
+    command = commands.add_parser("download", help="Download and resize the images marked for download")
+    concurrency(command)
+    command.add_argument("--output-dir", default=IMAGE_DOWNLOAD_DIR)
+    command.add_argument("--cpu-workers", type=int, default=DEFAULT_CPU_WORKERS, help="Processes resizing images")
+    command.add_argument("--order", choices=ORDERS, default="sheet", help="Download order by file size")
+    command.add_argument("--skip-fitting", action="store_true", help="Skip images the probe found already fit")
+    command.add_argument("--memory-limit", type=int, default=DEFAULT_MEMORY_LIMIT // (1024 * 1024),
+                         help="MB of a download kept in memory before spooling to disk")
+    command.add_argument("--max-size", type=parse_dimensions, default=(2000, 2000), metavar="WxH",
+                         help="Box the images are fitted within")
+    command.add_argument("--quality", type=int, default=95, help="JPEG/WebP quality")
+    command.add_argument("--no-icc", action="store_true", help="Drop embedded ICC color profiles")
+    command.add_argument("--renditions", type=parse_renditions, default=(), metavar="SPEC,...",
+                         help="Extra sizes from the same decode, e.g. '1200,800,400' or '800:webp,400:jpeg:70'")
+    command.add_argument("--originals-budget", type=int, default=ORIGINALS_BUDGET // (1024 * 1024),
+                         help="MB of downloaded originals cached for re-encoding (least recently used evicted)")
+    command.add_argument("--no-revalidate", action="store_true",
+                         help="Re-encode cached originals without asking the server whether they changed")
+    command.set_defaults(run=lambda spreadsheet, args, audit: download_image(
+        spreadsheet, args.workers, args.per_host, args.memory_limit * 1024 * 1024, args.cpu_workers,
+        args.order, skip_fitting=args.skip_fitting, download_dir=audit.folder(args.output_dir),
+        store_dir=audit.store_dir, shared=audit.shared, settings=encode_settings(args),
+        originals_budget=args.originals_budget * 1024 * 1024, revalidate=not args.no_revalidate))
+
+    command = commands.add_parser("download-pdfs", help="Download the pending PDFs of the Old Files tab")
+    concurrency(command)
+    command.add_argument("--output-dir", default=PDF_DOWNLOAD_DIR)
+    command.add_argument("--connections", type=int, default=RANGE_CONNECTIONS,
+                         help="Parallel byte ranges per large file, on top of --workers (1 to stream every file)")
+    command.add_argument("--ranged-threshold", type=int, default=RANGED_THRESHOLD // (1024 * 1024), metavar="MB",
+                         help="Files at least this large are downloaded as parallel ranges")
+    command.set_defaults(run=lambda spreadsheet, args, audit: download_pdfs(
+        spreadsheet, args.workers, args.per_host, audit.folder(args.output_dir),
+        args.connections, args.ranged_threshold * 1024 * 1024))
+
+    command = commands.add_parser("download-browser", help="Download images through a headless browser (403 bypass)")
+    concurrency(command)
+    command.add_argument("--output-dir", default=BROWSER_DOWNLOAD_DIR)
+    command.add_argument("--browsers", type=int, default=DEFAULT_BROWSERS, help="Headless Chrome instances")
+    command.set_defaults(run=lambda spreadsheet, args, audit: download_images_browser(
+        spreadsheet, args.workers, args.per_host, args.browsers, audit.folder(args.output_dir)))
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    metrics.configure(args.profile, args.trace_memory, args.profile_dir)
+    sheets_scheduler.configure(args.read_quota, args.write_quota)
+    patterns = args.spreadsheet or [DEFAULT_SPREADSHEET]
+
+    # One client, one quota scheduler and one HTTP pool serve every spreadsheet of the run
+    client = None
+    if args.local:
+        targets, open_target = [args.local], open_workbook
+    else:
+        client = authenticate_google_sheet(args.credentials)
+        targets, open_target = resolve_targets(client, patterns), lambda target: open_spreadsheet(client, target)
+
+    runner = AuditRunner(open_target, args.parallel, getattr(args, "output_dir", None))
+    try:
+        # Work shared by every spreadsheet of the run (the crawl) happens once, up front
+        if getattr(args, "prepare", None):
+            args.prepare(args)
+        results = runner.run(targets, lambda spreadsheet, audit: args.run(spreadsheet, args, audit))
+    finally:
+        metrics.emit(args.metrics_json, args.prometheus_textfile)
+
+    if args.local and args.sync and results[0].ok:
+        client = authenticate_google_sheet(args.credentials)
+        sync_to_sheets(open_workbook(args.local), open_spreadsheet(client, patterns[0]), args.sync)
+    if not all(result.ok for result in results):
+        raise SystemExit(1)
 
 if __name__ == "__main__":
     main()
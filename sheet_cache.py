@@ -0,0 +1,113 @@
+import gzip
+import json
+import os
+import threading
+
+from gspread.utils import numericise_all, to_records
+
+import metrics
+
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "filter-large-files", "sheets")
+
+
+class SheetCache:
+    """
+    Read-through cache for worksheet contents, keyed by spreadsheet ID, sheet ID and the spreadsheet's
+    Drive modifiedTime. A hit costs one Drive metadata call instead of a full Sheets read.
+
+    Snapshots live in memory for the process (so every stage shares them) and on disk as gzip'd
+    column lists, so the next run can reuse them while the sheet is unchanged. Anything that writes
+    to a spreadsheet should call invalidate(), because Drive's modifiedTime can lag behind a write.
+    """
+
+    def __init__(self, cache_dir=DEFAULT_CACHE_DIR):
+        self.cache_dir = cache_dir
+        self._memory = {}  # (spreadsheet id, sheet id) -> (revision, rows)
+        self._lock = threading.Lock()
+
+    def _path(self, spreadsheet_id, sheet_id):
+        return os.path.join(self.cache_dir, f"{spreadsheet_id}-{sheet_id}.json.gz")
+
+    def _load(self, key, revision):
+        try:
+            with gzip.open(self._path(*key), "rt", encoding="utf-8") as f:
+                snapshot = json.load(f)
+        except (FileNotFoundError, OSError, ValueError):
+            return None
+        if snapshot.get("revision") != revision:
+            return None
+        # Stored column by column; rebuild the row-major list gspread would have returned
+        columns = snapshot["columns"]
+        return [list(row) for row in zip(*columns)] if columns else [[] for _ in range(snapshot["rows"])]
+
+    def _store(self, key, revision, rows):
+        os.makedirs(self.cache_dir, exist_ok=True)
+        width = max((len(row) for row in rows), default=0)
+        columns = [[row[i] if i < len(row) else "" for row in rows] for i in range(width)]
+        tmp = self._path(*key) + ".tmp"
+        with gzip.open(tmp, "wt", encoding="utf-8") as f:
+            json.dump({"revision": revision, "rows": len(rows), "columns": columns}, f, separators=(",", ":"))
+        os.replace(tmp, self._path(*key))
+
+    def get_all_values(self, worksheet):
+        with metrics.stage("sheet_read", items=1):
+            return self._get_all_values(worksheet)
+
+    def _get_all_values(self, worksheet):
+        if not getattr(worksheet, "cacheable", True):
+            return worksheet.get_all_values()
+        spreadsheet = worksheet.spreadsheet
+        key = (spreadsheet.id, worksheet.id)
+        revision = spreadsheet.get_lastUpdateTime()
+        with self._lock:
+            cached = self._memory.get(key)
+        if cached and cached[0] == revision:
+            metrics.add("sheet_read", cache_hits=1)
+            return [list(row) for row in cached[1]]
+
+        rows = self._load(key, revision)
+        if rows is None:
+            rows = worksheet.get_all_values()
+            self._store(key, revision, rows)
+        else:
+            metrics.add("sheet_read", cache_hits=1)
+        with self._lock:
+            self._memory[key] = (revision, rows)
+        return [list(row) for row in rows]
+
+    def get_all_records(self, worksheet):
+        """Same shape as gspread's Worksheet.get_all_records() with default arguments."""
+        values = self.get_all_values(worksheet)
+        if not values:
+            return []
+        return to_records(values[0], [numericise_all(row) for row in values[1:]])
+
+    def invalidate(self, spreadsheet, sheet_id=None):
+        """Drops cached snapshots of one sheet, or of every sheet in the spreadsheet."""
+        with self._lock:
+            keys = [key for key in self._memory if key[0] == spreadsheet.id and sheet_id in (None, key[1])]
+            for key in keys:
+                del self._memory[key]
+        prefix = f"{spreadsheet.id}-"
+        if os.path.isdir(self.cache_dir):
+            for name in os.listdir(self.cache_dir):
+                if name.startswith(prefix) and (sheet_id is None or name == f"{prefix}{sheet_id}.json.gz"):
+                    try:
+                        os.remove(os.path.join(self.cache_dir, name))
+                    except FileNotFoundError:
+                        pass
+
+
+_default = SheetCache()
+
+
+def get_all_values(worksheet):
+    return _default.get_all_values(worksheet)
+
+
+def get_all_records(worksheet):
+    return _default.get_all_records(worksheet)
+
+
+def invalidate(spreadsheet, sheet_id=None):
+    _default.invalidate(spreadsheet, sheet_id)
@@ -0,0 +1,106 @@
+import atexit
+import contextvars
+import threading
+import time
+
+from gspread.utils import rowcol_to_a1
+
+import metrics
+import sheet_cache
+
+# Flush after this many pending cells or this many seconds, whichever comes first
+DEFAULT_FLUSH_ROWS = 50
+DEFAULT_FLUSH_SECONDS = 10.0
+
+
+class SheetWriteBuffer:
+    """
+    Collects single-cell status writes and sends them to the worksheet as one batch_update.
+    Flushing happens on a background thread so callers never wait on the Sheets API.
+    Use it as a context manager; whatever is still pending is flushed on exit, even after an exception.
+    """
+
+    def __init__(self, worksheet, flush_rows=DEFAULT_FLUSH_ROWS, flush_seconds=DEFAULT_FLUSH_SECONDS):
+        self.worksheet = worksheet
+        self.flush_rows = max(1, flush_rows)
+        self.flush_seconds = flush_seconds
+        self._pending = {}  # (row, col) -> value, later writes to the same cell win
+        self._cond = threading.Condition()
+        self._flush_lock = threading.Lock()
+        self._oldest = time.monotonic()
+        self._closed = False
+        self._thread = threading.Thread(target=contextvars.copy_context().run, args=(self._run,), daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    def update_cell(self, row, col, value):
+        with self._cond:
+            if not self._pending:
+                self._oldest = time.monotonic()
+                self._cond.notify()
+            self._pending[(row, col)] = value
+            if len(self._pending) >= self.flush_rows:
+                self._cond.notify()
+
+    def flush(self):
+        """Writes everything pending in one batch_update. Returns False if the write failed."""
+        with self._flush_lock:
+            with self._cond:
+                pending, self._pending = self._pending, {}
+            if not pending:
+                return True
+            data = [{"range": rowcol_to_a1(row, col), "values": [[value]]}
+                    for (row, col), value in sorted(pending.items())]
+            try:
+                with metrics.stage("write_back", items=len(data)):
+                    self.worksheet.batch_update(data)
+                sheet_cache.invalidate(self.worksheet.spreadsheet, self.worksheet.id)
+            except Exception as e:
+                print(f"❌ Failed to write {len(data)} status updates, will retry: {e}")
+                with self._cond:
+                    # Keep anything newer that was queued while we were writing
+                    for key, value in pending.items():
+                        self._pending.setdefault(key, value)
+                    self._oldest = time.monotonic()
+                return False
+        return True
+
+    def _due(self):
+        if not self._pending:
+            return False
+        return (len(self._pending) >= self.flush_rows
+                or time.monotonic() - self._oldest >= self.flush_seconds)
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._closed and not self._due():
+                    if self._pending:
+                        self._cond.wait(timeout=self.flush_seconds - (time.monotonic() - self._oldest))
+                    else:
+                        self._cond.wait()
+                if self._closed:
+                    return
+            if not self.flush():
+                # Back off before retrying a failed write
+                with self._cond:
+                    if not self._closed:
+                        self._cond.wait(timeout=self.flush_seconds)
+
+    def close(self):
+        with self._cond:
+            if self._closed:
+                return
+            self._closed = True
+            self._cond.notify()
+        self._thread.join()
+        atexit.unregister(self.close)
+        if not self.flush() and self._pending:
+            print(f"❌ {len(self._pending)} status updates could not be written to '{self.worksheet.title}'")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+        return False
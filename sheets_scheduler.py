@@ -0,0 +1,234 @@
+import random
+import threading
+import time
+
+from gspread.exceptions import APIError
+from gspread.utils import a1_to_rowcol, rowcol_to_a1
+
+import metrics
+import transport
+
+# Google's default Sheets quotas are 60 read and 60 write requests per minute per user (300 per project)
+READ_PER_MINUTE = 60
+WRITE_PER_MINUTE = 60
+DRIVE_PER_MINUTE = 600
+
+# Truncated exponential backoff on 429 and 5xx, as Google recommends
+MAX_RETRIES = 8
+BACKOFF_BASE = 1.0
+BACKOFF_MAX = 64.0
+RETRY_CODES = {429, 500, 502, 503, 504}
+# A 5xx may come after the server applied the request, so calls that aren't safe to repeat only retry 429s
+THROTTLED_CODES = {429}
+
+# gspread methods by the quota they count against; anything else is passed straight through
+READ_METHODS = {"worksheet", "worksheets", "get_worksheet", "get_worksheet_by_id", "fetch_sheet_metadata",
+                "get_all_values", "get_all_records", "get_values", "get", "batch_get", "row_values", "col_values",
+                "acell", "cell", "range", "open", "open_by_key", "open_by_url"}
+WRITE_METHODS = {"update", "update_cell", "update_cells", "update_acell", "batch_update", "batch_clear", "clear",
+                 "format", "batch_format", "append_row", "append_rows", "insert_row", "insert_rows", "delete_rows",
+                 "delete_columns", "add_rows", "add_cols", "resize", "add_worksheet", "del_worksheet",
+                 "duplicate_sheet", "values_update", "values_append", "values_clear", "values_batch_update"}
+DRIVE_METHODS = {"get_lastUpdateTime"}
+# Writes that would apply twice if repeated (append, insert, add, delete by position)
+NON_IDEMPOTENT_METHODS = {"append_row", "append_rows", "insert_row", "insert_rows", "delete_rows", "delete_columns",
+                          "add_rows", "add_cols", "add_worksheet", "del_worksheet", "duplicate_sheet", "values_append"}
+
+
+class TokenBucket:
+    """Allows per_minute calls a minute on average, in bursts of up to `burst`. Thread-safe."""
+
+    def __init__(self, per_minute, burst=None):
+        self.rate = per_minute / 60.0
+        self.capacity = burst or per_minute
+        self.tokens = float(self.capacity)
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """Takes one token, sleeping until there is one. Returns the seconds spent waiting."""
+        waited = 0.0
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if now >= self.paused_until and self.tokens >= 1:
+                    self.tokens -= 1
+                    return waited
+                delay = max(self.paused_until - now, (1 - self.tokens) / self.rate)
+            time.sleep(delay)
+            waited += delay
+
+    def pause(self, seconds):
+        """Holds back every caller for `seconds`, e.g. after the API answered 429."""
+        with self._lock:
+            self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+            self.tokens = 0.0
+
+
+def coalesce(data):
+    """
+    Merges value-range writes ({"range": "A1", "values": [[...]]}, ...) into the fewest rectangles:
+    adjacent cells in a row become one run, and runs over the same columns on consecutive rows are stacked.
+    Later writes to a cell win. Ranges with a sheet name ("Images!A1") are passed through untouched.
+    """
+    passthrough = [item for item in data if "!" in item["range"]]
+    cells = {}
+    for item in data:
+        if "!" in item["range"]:
+            continue
+        row, col = a1_to_rowcol(item["range"].split(":")[0])
+        for i, values in enumerate(item["values"]):
+            for j, value in enumerate(values):
+                cells[(row + i, col + j)] = value
+
+    runs = {}  # row -> [[first col, last col, values]]
+    for row, col in sorted(cells):
+        row_runs = runs.setdefault(row, [])
+        if row_runs and row_runs[-1][1] == col - 1:
+            row_runs[-1][1] = col
+            row_runs[-1][2].append(cells[(row, col)])
+        else:
+            row_runs.append([col, col, [cells[(row, col)]]])
+
+    blocks = []  # [first row, last row, first col, last col, rows]
+    open_blocks = {}  # (first col, last col) -> block that ends on the previous row
+    for row in sorted(runs):
+        for first_col, last_col, values in runs[row]:
+            block = open_blocks.get((first_col, last_col))
+            if block and block[1] == row - 1:
+                block[1] = row
+                block[4].append(values)
+            else:
+                block = [row, row, first_col, last_col, [values]]
+                blocks.append(block)
+                open_blocks[(first_col, last_col)] = block
+
+    merged = []
+    for first_row, last_row, first_col, last_col, rows in blocks:
+        start, end = rowcol_to_a1(first_row, first_col), rowcol_to_a1(last_row, last_col)
+        merged.append({"range": start if start == end else f"{start}:{end}", "values": rows})
+    return merged + passthrough
+
+
+class SheetsScheduler:
+    """
+    Every Sheets (and Drive metadata) call of the run goes through here: it waits for a token from the
+    read, write or Drive bucket, then retries 429 and 5xx answers with backoff, pausing the whole bucket
+    so other threads don't keep hitting the limit. Calls made with idempotent=False are only retried on 429.
+    Waits and retries are recorded in the run metrics.
+    """
+
+    def __init__(self, read_per_minute=READ_PER_MINUTE, write_per_minute=WRITE_PER_MINUTE,
+                 drive_per_minute=DRIVE_PER_MINUTE, max_retries=MAX_RETRIES):
+        self.buckets = {
+            "read": TokenBucket(read_per_minute),
+            "write": TokenBucket(write_per_minute),
+            "drive": TokenBucket(drive_per_minute),
+        }
+        self.max_retries = max_retries
+
+    def backoff_delay(self, attempt, error):
+        delay = transport.retry_after(getattr(error, "response", None))
+        if delay is None:
+            delay = min(BACKOFF_MAX, BACKOFF_BASE * 2 ** attempt) + random.uniform(0, 1)
+        return min(delay, BACKOFF_MAX)
+
+    def call(self, kind, fn, *args, idempotent=True, **kwargs):
+        bucket = self.buckets[kind]
+        retry_codes = RETRY_CODES if idempotent else THROTTLED_CODES
+        for attempt in range(self.max_retries + 1):
+            waited = bucket.acquire()
+            metrics.add(api_calls=1, quota_wait_seconds=waited)
+            try:
+                return fn(*args, **kwargs)
+            except APIError as e:
+                if e.code not in retry_codes or attempt == self.max_retries:
+                    raise
+                delay = self.backoff_delay(attempt, e)
+                print(f"⏳ Sheets API answered {e.code}; backing off {delay:.1f}s")
+                bucket.pause(delay)
+                metrics.add(retries=1, quota_wait_seconds=delay)
+
+    def wrap(self, spreadsheet):
+        """The spreadsheet with every API call (and those of its worksheets) routed through this scheduler."""
+        return ThrottledSpreadsheet(spreadsheet, self)
+
+
+class _Throttled:
+    non_idempotent = NON_IDEMPOTENT_METHODS
+
+    def __init__(self, target, scheduler):
+        self._target = target
+        self._scheduler = scheduler
+
+    def _kind(self, name):
+        if name in READ_METHODS:
+            return "read"
+        if name in WRITE_METHODS:
+            return "write"
+        if name in DRIVE_METHODS:
+            return "drive"
+        return None
+
+    def _wrap_result(self, value):
+        return value
+
+    def __getattr__(self, name):
+        value = getattr(self._target, name)
+        kind = self._kind(name)
+        if kind is None or not callable(value):
+            return value
+
+        idempotent = name not in self.non_idempotent
+
+        def call(*args, **kwargs):
+            return self._wrap_result(self._scheduler.call(kind, value, *args, idempotent=idempotent, **kwargs))
+        return call
+
+
+class ThrottledSpreadsheet(_Throttled):
+    # Spreadsheet.batch_update carries structural requests (appendCells, deleteDimension, addSheet, ...)
+    non_idempotent = NON_IDEMPOTENT_METHODS | {"batch_update"}
+
+    def _wrap_result(self, value):
+        # Worksheets handed out (worksheet(), worksheets(), add_worksheet()) are throttled too
+        if isinstance(value, list):
+            return [self._wrap_result(item) for item in value]
+        if hasattr(value, "spreadsheet") and hasattr(value, "title") and not isinstance(value, _Throttled):
+            return ThrottledWorksheet(value, self._scheduler, self)
+        return value
+
+    def del_worksheet(self, worksheet):
+        if isinstance(worksheet, ThrottledWorksheet):
+            worksheet = worksheet._target
+        return self._scheduler.call("write", self._target.del_worksheet, worksheet, idempotent=False)
+
+
+class ThrottledWorksheet(_Throttled):
+    def __init__(self, target, scheduler, spreadsheet):
+        super().__init__(target, scheduler)
+        self.spreadsheet = spreadsheet
+
+    def batch_update(self, data, **kwargs):
+        return self._scheduler.call("write", self._target.batch_update, coalesce(data), **kwargs)
+
+
+_default = SheetsScheduler()
+
+
+def configure(read_per_minute=READ_PER_MINUTE, write_per_minute=WRITE_PER_MINUTE,
+              drive_per_minute=DRIVE_PER_MINUTE, max_retries=MAX_RETRIES):
+    global _default
+    _default = SheetsScheduler(read_per_minute, write_per_minute, drive_per_minute, max_retries)
+    return _default
+
+
+def wrap(spreadsheet):
+    return _default.wrap(spreadsheet)
+
+
+def call(kind, fn, *args, idempotent=True, **kwargs):
+    return _default.call(kind, fn, *args, idempotent=idempotent, **kwargs)
@@ -0,0 +1,129 @@
+import bisect
+import heapq
+import re
+
+# Used for the up-front transfer time estimate when no better figure is given
+ESTIMATED_BANDWIDTH = 10 * 1024 * 1024  # bytes per second
+
+ORDERS = ("sheet", "largest", "smallest")
+
+_SIZE_RE = re.compile(r'^\s*([\d.,]+)\s*([KMGT]?i?B?|bytes?)?\s*$', re.IGNORECASE)
+_SIZE_UNITS = {"": 1, "B": 1, "BYTE": 1, "BYTES": 1, "K": 1024, "M": 1024 ** 2, "G": 1024 ** 3, "T": 1024 ** 4}
+
+
+def parse_size(value):
+    """Parses a report size such as "12.4 MB", "850 KB" or "1048576" into bytes. Returns None if unreadable."""
+    match = _SIZE_RE.match(str(value))
+    if not match:
+        return None
+    try:
+        number = float(match.group(1).replace(",", ""))
+    except ValueError:
+        return None
+    unit = (match.group(2) or "").upper()
+    multiplier = _SIZE_UNITS.get(unit) or _SIZE_UNITS.get(unit[:1], 1)
+    return int(number * multiplier)
+
+
+class SizeIndex:
+    """
+    Index of items by size in bytes, built once from the report's "Size" strings.
+    Top-N queries use a heap and never sort; the first range query sorts once and bisects after that.
+    Items whose size could not be parsed are kept out of the index but still counted.
+    """
+
+    def __init__(self, items=()):
+        self._items = []  # (size_bytes, seq, key); seq keeps equal sizes in insertion order
+        self._sorted = True
+        self.unknown = []
+        for size, key in items:
+            self.add(size, key)
+
+    @classmethod
+    def from_rows(cls, rows, size_of):
+        """Indexes rows by size_of(row), which may return a raw report string such as "12.4 MB"."""
+        index = cls()
+        for row in rows:
+            index.add(size_of(row), row)
+        return index
+
+    def add(self, size, key):
+        size_bytes = size if isinstance(size, int) else parse_size(size)
+        if size_bytes is None:
+            self.unknown.append(key)
+            return
+        item = (size_bytes, len(self._items) + len(self.unknown), key)
+        if self._sorted and self._items and size_bytes < self._items[-1][0]:
+            self._sorted = False
+        self._items.append(item)
+
+    def __len__(self):
+        return len(self._items)
+
+    def _ensure_sorted(self):
+        if not self._sorted:
+            self._items.sort(key=lambda item: (item[0], item[1]))
+            self._sorted = True
+
+    def largest(self, n):
+        """The n largest (size, key) pairs, largest first."""
+        if self._sorted:
+            return [(size, key) for size, _, key in reversed(self._items[-n:])] if n > 0 else []
+        top = heapq.nlargest(n, self._items, key=lambda item: (item[0], -item[1]))
+        return [(size, key) for size, _, key in top]
+
+    def smallest(self, n):
+        """The n smallest (size, key) pairs, smallest first."""
+        if self._sorted:
+            return [(size, key) for size, _, key in self._items[:n]]
+        top = heapq.nsmallest(n, self._items, key=lambda item: (item[0], item[1]))
+        return [(size, key) for size, _, key in top]
+
+    def between(self, low=None, high=None):
+        """(size, key) pairs with low <= size <= high, smallest first. Either bound may be None."""
+        self._ensure_sorted()
+        lo = 0 if low is None else bisect.bisect_left(self._items, (low, -1))
+        hi = len(self._items) if high is None else bisect.bisect_right(self._items, (high, float("inf")))
+        return [(size, key) for size, _, key in self._items[lo:hi]]
+
+    def total_bytes(self):
+        return sum(item[0] for item in self._items)
+
+    def estimate_seconds(self, bandwidth=ESTIMATED_BANDWIDTH):
+        """Rough transfer time for everything indexed; unknown sizes are counted at the average size."""
+        total = self.total_bytes()
+        if self.unknown and self._items:
+            total += total / len(self._items) * len(self.unknown)
+        return total / bandwidth if bandwidth else 0.0
+
+
+def order_jobs(jobs, order="sheet"):
+    """
+    Orders fetch jobs by job.size: "largest" first for the most savings per minute,
+    "smallest" first for fast feedback, or "sheet" to keep sheet order. Unknown sizes go last.
+    """
+    if order not in ORDERS:
+        raise ValueError(f"Unknown order {order!r}, expected one of {ORDERS}")
+    jobs = list(jobs)
+    if order == "sheet":
+        return jobs
+    known = [job for job in jobs if job.size is not None]
+    unknown = [job for job in jobs if job.size is None]
+    known.sort(key=lambda job: job.size, reverse=(order == "largest"))
+    return known + unknown
+
+
+def format_bytes(n):
+    for unit in ("B", "KB", "MB", "GB"):
+        if abs(n) < 1024:
+            return f"{n:.1f} {unit}" if unit != "B" else f"{int(n)} B"
+        n /= 1024
+    return f"{n:.1f} TB"
+
+
+def format_duration(seconds):
+    if seconds < 90:
+        return f"{seconds:.0f}s"
+    if seconds < 90 * 60:
+        return f"{seconds / 60:.0f} min"
+    return f"{seconds / 3600:.1f} h"
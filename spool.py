@@ -0,0 +1,143 @@
+import hashlib
+import os
+import tempfile
+from io import BytesIO
+
+# Bodies up to this size stay in memory; anything larger goes straight to a temp file
+DEFAULT_MEMORY_LIMIT = 8 * 1024 * 1024
+CHUNK_SIZE = 64 * 1024
+
+
+class Spool:
+    """
+    Holds a downloaded body in memory while it is small and in a temp file once it passes memory_limit.
+    Above the limit the bytes are written through in chunks and never sit fully in Python memory.
+    """
+
+    def __init__(self, memory_limit=DEFAULT_MEMORY_LIMIT, dir=None):
+        self.memory_limit = memory_limit
+        self.dir = dir
+        self.size = 0
+        self.path = None
+        self._hash = hashlib.sha256()
+        self._chunks = []
+        self._data = None
+        self._file = None
+
+    @property
+    def in_memory(self):
+        return self.path is None
+
+    def rollover(self):
+        """Moves the body to a temp file; later writes go straight to disk."""
+        if self.path is not None:
+            return
+        fd, self.path = tempfile.mkstemp(suffix=".part", dir=self.dir)
+        self._file = os.fdopen(fd, "wb")
+        for chunk in self._chunks:
+            self._file.write(chunk)
+        self._chunks = []
+
+    @property
+    def sha256(self):
+        """Hex digest of everything written so far."""
+        return self._hash.hexdigest()
+
+    def write(self, chunk):
+        self._hash.update(chunk)
+        if self._file is None and self.size + len(chunk) > self.memory_limit:
+            self.rollover()
+        if self._file is not None:
+            self._file.write(chunk)
+        else:
+            self._chunks.append(chunk)
+        self.size += len(chunk)
+
+    def finish(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        elif self._data is None:
+            self._data = b"".join(self._chunks)
+            self._chunks = []
+        return self
+
+    def open(self):
+        """Returns a readable binary file over the body."""
+        self.finish()
+        if self.path is not None:
+            return open(self.path, "rb")
+        return BytesIO(self._data)
+
+    def source(self):
+        """The body as bytes while it is in memory, otherwise the path of its temp file."""
+        self.finish()
+        return self._data if self.path is None else self.path
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        if self.path is not None:
+            try:
+                os.remove(self.path)
+            except FileNotFoundError:
+                pass
+            self.path = None
+        self._chunks = []
+        self._data = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+        return False
+
+
+class StoredBody:
+    """
+    A body already on disk under its content hash (a blob in the BlobStore), usable wherever a Spool is.
+    close() leaves the file alone, since the store owns it, and calls release (e.g. to unpin the blob).
+    """
+
+    def __init__(self, path, sha256, release=None):
+        self.path = path
+        self.sha256 = sha256
+        self.size = os.path.getsize(path)
+        self._release = release
+
+    in_memory = False
+
+    def finish(self):
+        return self
+
+    def open(self):
+        return open(self.path, "rb")
+
+    def source(self):
+        return self.path
+
+    def close(self):
+        release, self._release = self._release, None
+        if release:
+            release()
+
+
+def spool_response(response, memory_limit=DEFAULT_MEMORY_LIMIT, dir=None, chunk_size=CHUNK_SIZE):
+    """Streams a requests response (opened with stream=True) into a Spool."""
+    spool = Spool(memory_limit, dir)
+    try:
+        # Skip the in-memory stage entirely when the server tells us the body is large
+        length = response.headers.get("Content-Length")
+        if length and length.isdigit() and int(length) > memory_limit:
+            spool.rollover()
+        for chunk in response.iter_content(chunk_size=chunk_size):
+            if chunk:
+                spool.write(chunk)
+        return spool.finish()
+    except BaseException:
+        spool.close()
+        raise
+    finally:
+        response.close()
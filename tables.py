@@ -0,0 +1,565 @@
+import csv
+import glob
+import itertools
+import os
+import sqlite3
+import threading
+import zlib
+
+from gspread.exceptions import WorksheetNotFound
+from gspread.utils import a1_to_rowcol, numericise_all, rowcol_to_a1, to_records
+
+# Rows per chunk for streaming reads and writes
+CHUNK_ROWS = 10000
+
+BACKENDS = ("csv", "sqlite", "parquet")
+SQLITE_EXTENSIONS = (".db", ".sqlite", ".sqlite3")
+
+# CSV fields in storage reports can be long (URL lists); lift the default 128 KB cap
+csv.field_size_limit(16 * 1024 * 1024)
+
+
+def cell_map(updates):
+    """[(row, col, values), ...] with 1-based anchors -> {row: {col: value}}. Later updates to a cell win."""
+    cells = {}
+    for row, col, values in updates:
+        for r, row_values in enumerate(values):
+            target = cells.setdefault(row + r, {})
+            for c, value in enumerate(row_values):
+                target[col + c] = "" if value is None else str(value)
+    return cells
+
+
+def apply_changes(row, changes):
+    row = list(row)
+    width = max(changes)
+    if len(row) < width:
+        row.extend([""] * (width - len(row)))
+    for col, value in changes.items():
+        row[col - 1] = value
+    return row
+
+
+def updated_rows(rows, updates):
+    """Streams rows with updates applied, appending rows (and blank filler rows) for updates past the end."""
+    cells = cell_map(updates)
+    row_num = 0
+    for row_num, row in enumerate(rows, start=1):
+        changes = cells.pop(row_num, None)
+        yield apply_changes(row, changes) if changes else row
+    for target in sorted(cells):
+        while row_num < target - 1:
+            row_num += 1
+            yield []
+        row_num = target
+        yield apply_changes([], cells[target])
+
+
+def column_names(header):
+    """Header cells as unique, non-empty column names for backends that store the header as their schema."""
+    names, seen = [], set()
+    for i, name in enumerate(header, start=1):
+        name = str(name) if name not in (None, "") else f"column{i}"
+        candidate, n = name, 2
+        while candidate in seen:
+            candidate, n = f"{name}_{n}", n + 1
+        seen.add(candidate)
+        names.append(candidate)
+    return names
+
+
+def cell_text(value):
+    return "" if value is None else str(value)
+
+
+class TableBackend:
+    """
+    Storage for named tabs of rows, addressed like a sheet: row 1 is the header, rows and columns are 1-based.
+    Subclasses implement tabs, read_chunks, write_table and delete_table; batch_update, append_columns,
+    append_rows and delete_rows default to one streaming rewrite of the tab.
+    """
+
+    def tabs(self):
+        raise NotImplementedError
+
+    def read_chunks(self, tab, chunk_size=CHUNK_ROWS):
+        """Yields lists of up to chunk_size rows, header first."""
+        raise NotImplementedError
+
+    def write_table(self, tab, rows):
+        """Replaces (or creates) tab with rows, which may be any iterable and is consumed once."""
+        raise NotImplementedError
+
+    def delete_table(self, tab):
+        raise NotImplementedError
+
+    def rows(self, tab, chunk_size=CHUNK_ROWS):
+        return itertools.chain.from_iterable(self.read_chunks(tab, chunk_size))
+
+    def header(self, tab):
+        return next(iter(self.rows(tab, chunk_size=1)), [])
+
+    def batch_update(self, tab, updates):
+        """Writes [(row, col, values), ...], where values is a 2D list anchored at (row, col)."""
+        if updates:
+            self.write_table(tab, updated_rows(self.rows(tab), updates))
+
+    def append_columns(self, tab, headers):
+        width = len(self.header(tab))
+        self.batch_update(tab, [(1, width + 1, [list(headers)])])
+
+    def append_rows(self, tab, rows):
+        if rows:
+            count = sum(1 for _ in self.rows(tab))
+            self.batch_update(tab, [(count + 1, 1, rows)])
+
+    def delete_rows(self, tab, first, last):
+        """Removes rows first..last (1-based, inclusive); the rows below move up."""
+        kept = (row for n, row in enumerate(self.rows(tab), start=1) if not first <= n <= last)
+        self.write_table(tab, kept)
+
+
+class CsvBackend(TableBackend):
+    """A directory with one <tab>.csv file per tab."""
+
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, tab):
+        return os.path.join(self.directory, f"{tab}.csv")
+
+    def tabs(self):
+        return sorted(os.path.splitext(os.path.basename(p))[0] for p in glob.glob(os.path.join(self.directory, "*.csv")))
+
+    def read_chunks(self, tab, chunk_size=CHUNK_ROWS):
+        with open(self._path(tab), newline="", encoding="utf-8") as f:
+            reader = csv.reader(f)
+            while True:
+                chunk = list(itertools.islice(reader, chunk_size))
+                if not chunk:
+                    return
+                yield chunk
+
+    def write_table(self, tab, rows):
+        path = self._path(tab)
+        tmp = path + ".tmp"
+        # Written next to the original and swapped in at the end, so rows may be streamed from the tab itself
+        with open(tmp, "w", newline="", encoding="utf-8") as f:
+            csv.writer(f).writerows(rows)
+        os.replace(tmp, path)
+
+    def delete_table(self, tab):
+        os.remove(self._path(tab))
+
+
+class SqliteBackend(TableBackend):
+    """
+    One SQLite table per tab. The header is the table's column names and sheet row N is rowid N - 1,
+    which is how `sqlite3 .import` lays out a CSV export. Updates are applied in place.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _quote(name):
+        return '"' + str(name).replace('"', '""') + '"'
+
+    def _columns(self, tab):
+        return [row[1] for row in self.conn.execute(f"PRAGMA table_info({self._quote(tab)})")]
+
+    def tabs(self):
+        rows = self.conn.execute(
+            "SELECT name FROM sqlite_master WHERE type = 'table' AND name NOT LIKE 'sqlite_%' ORDER BY name"
+        )
+        return [row[0] for row in rows]
+
+    def read_chunks(self, tab, chunk_size=CHUNK_ROWS):
+        columns = self._columns(tab)
+        if not columns:
+            raise WorksheetNotFound(tab)
+        cursor = self.conn.cursor()
+        cursor.execute(f"SELECT * FROM {self._quote(tab)} ORDER BY rowid")
+        chunk = [columns]
+        while True:
+            chunk.extend([cell_text(v) for v in row] for row in cursor.fetchmany(chunk_size - len(chunk)))
+            if not chunk:
+                return
+            yield chunk
+            if len(chunk) < chunk_size:
+                return
+            chunk = []
+
+    def _ensure_columns(self, tab, width, names=None):
+        columns = self._columns(tab)
+        for col in range(len(columns) + 1, width + 1):
+            name = column_names(columns + [names.get(col, "") if names else ""])[-1]
+            self.conn.execute(f"ALTER TABLE {self._quote(tab)} ADD COLUMN {self._quote(name)} TEXT")
+            columns.append(name)
+        return columns
+
+    def write_table(self, tab, rows):
+        rows = iter(rows)
+        header = column_names(next(rows, []) or [""])
+        with self._lock, self.conn:
+            self.conn.execute(f"DROP TABLE IF EXISTS {self._quote(tab)}")
+            self.conn.execute(f"CREATE TABLE {self._quote(tab)} ({', '.join(self._quote(c) + ' TEXT' for c in header)})")
+            width = len(header)
+            while True:
+                chunk = list(itertools.islice(rows, CHUNK_ROWS))
+                if not chunk:
+                    break
+                longest = max(len(row) for row in chunk)
+                if longest > width:
+                    width = len(self._ensure_columns(tab, longest))
+                placeholders = ", ".join("?" * width)
+                self.conn.executemany(
+                    f"INSERT INTO {self._quote(tab)} VALUES ({placeholders})",
+                    [list(row) + [""] * (width - len(row)) for row in chunk],
+                )
+
+    def delete_table(self, tab):
+        with self._lock, self.conn:
+            self.conn.execute(f"DROP TABLE IF EXISTS {self._quote(tab)}")
+
+    def batch_update(self, tab, updates):
+        cells = cell_map(updates)
+        if not cells:
+            return
+        quoted = self._quote(tab)
+        with self._lock, self.conn:
+            header_changes = cells.pop(1, {})
+            width = max([max(changes) for changes in cells.values()] + list(header_changes) + [0])
+            columns = self._ensure_columns(tab, width, header_changes)
+            for col, name in header_changes.items():
+                name = name or f"column{col}"
+                if columns[col - 1] != name:
+                    others = columns[:col - 1] + columns[col:]
+                    new_name = column_names(others + [name])[-1]
+                    self.conn.execute(f"ALTER TABLE {quoted} RENAME COLUMN {self._quote(columns[col - 1])} TO {self._quote(new_name)}")
+                    columns[col - 1] = new_name
+            if not cells:
+                return
+
+            last = self.conn.execute(f"SELECT COALESCE(MAX(rowid), 0) FROM {quoted}").fetchone()[0]
+            needed = max(cells) - 1
+            if needed > last:
+                self.conn.executemany(f"INSERT INTO {quoted} (rowid) VALUES (?)", [(r,) for r in range(last + 1, needed + 1)])
+
+            by_column = {}
+            for row, changes in cells.items():
+                for col, value in changes.items():
+                    by_column.setdefault(col, []).append((value, row - 1))
+            for col, params in by_column.items():
+                self.conn.executemany(f"UPDATE {quoted} SET {self._quote(columns[col - 1])} = ? WHERE rowid = ?", params)
+
+    def append_rows(self, tab, rows):
+        if not rows:
+            return
+        quoted = self._quote(tab)
+        with self._lock, self.conn:
+            width = len(self._ensure_columns(tab, max(len(row) for row in rows)))
+            self.conn.executemany(
+                f"INSERT INTO {quoted} VALUES ({', '.join('?' * width)})",
+                [[cell_text(v) for v in row] + [""] * (width - len(row)) for row in rows],
+            )
+
+    def delete_rows(self, tab, first, last):
+        quoted = self._quote(tab)
+        count = last - first + 1
+        with self._lock, self.conn:
+            self.conn.execute(f"DELETE FROM {quoted} WHERE rowid BETWEEN ? AND ?", (first - 1, last - 1))
+            # Renumber the rows below so row N stays rowid N - 1; via negative ids to avoid collisions
+            self.conn.execute(f"UPDATE {quoted} SET rowid = -rowid WHERE rowid > ?", (last - 1,))
+            self.conn.execute(f"UPDATE {quoted} SET rowid = -rowid - ? WHERE rowid < 0", (count,))
+
+    def close(self):
+        self.conn.close()
+
+
+def _pyarrow():
+    try:
+        import pyarrow
+        import pyarrow.parquet
+    except ImportError:
+        raise ImportError("Parquet tables need pyarrow: pip install pyarrow") from None
+    return pyarrow, pyarrow.parquet
+
+
+class ParquetBackend(TableBackend):
+    """
+    A directory with one <tab>.parquet file per tab; the header is the file's column names.
+    Every column is written as text. Parquet files are immutable, so updates rewrite the file in one pass.
+    Needs pyarrow, which is only imported when a Parquet table is used.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, tab):
+        return os.path.join(self.directory, f"{tab}.parquet")
+
+    def tabs(self):
+        return sorted(os.path.splitext(os.path.basename(p))[0] for p in glob.glob(os.path.join(self.directory, "*.parquet")))
+
+    def read_chunks(self, tab, chunk_size=CHUNK_ROWS):
+        _, pq = _pyarrow()
+        parquet_file = pq.ParquetFile(self._path(tab))
+        yield [list(parquet_file.schema_arrow.names)]
+        for batch in parquet_file.iter_batches(batch_size=chunk_size):
+            columns = [[cell_text(v) for v in column.to_pylist()] for column in batch.columns]
+            if columns:
+                yield [list(row) for row in zip(*columns)]
+
+    def write_table(self, tab, rows):
+        pa, pq = _pyarrow()
+        rows = iter(rows)
+        header = next(rows, [])
+        first = list(itertools.islice(rows, CHUNK_ROWS))
+        # The schema is fixed up front: as wide as the header or the widest row of the first chunk
+        width = max([len(header)] + [len(row) for row in first]) or 1
+        names = column_names(list(header) + [""] * (width - len(header)))
+        schema = pa.schema([(name, pa.string()) for name in names])
+
+        path = self._path(tab)
+        tmp = path + ".tmp"
+        with pq.ParquetWriter(tmp, schema) as writer:
+            chunk = first
+            while True:
+                padded = [list(row[:width]) + [""] * (width - len(row)) for row in chunk]
+                columns = [pa.array([row[i] for row in padded], type=pa.string()) for i in range(width)]
+                writer.write_table(pa.Table.from_arrays(columns, schema=schema))
+                chunk = list(itertools.islice(rows, CHUNK_ROWS))
+                if not chunk:
+                    break
+        os.replace(tmp, path)
+
+    def delete_table(self, tab):
+        os.remove(self._path(tab))
+
+
+class GspreadBackend(TableBackend):
+    """The TableBackend interface over a gspread Spreadsheet, used to sync local results back to Sheets."""
+
+    def __init__(self, spreadsheet):
+        self.spreadsheet = spreadsheet
+
+    def tabs(self):
+        return [ws.title for ws in self.spreadsheet.worksheets()]
+
+    def read_chunks(self, tab, chunk_size=CHUNK_ROWS):
+        ws = self.spreadsheet.worksheet(tab)
+        for start in range(1, ws.row_count + 1, chunk_size):
+            chunk = ws.get_values(f"{start}:{min(start + chunk_size - 1, ws.row_count)}")
+            if chunk:
+                yield chunk
+
+    def write_table(self, tab, rows):
+        rows = iter(rows)
+        first = list(itertools.islice(rows, CHUNK_ROWS))
+        width = max([len(row) for row in first] + [1])
+        try:
+            self.spreadsheet.del_worksheet(self.spreadsheet.worksheet(tab))
+        except WorksheetNotFound:
+            pass
+        ws = self.spreadsheet.add_worksheet(title=tab, rows=max(1, len(first)), cols=width)
+        chunk, start = first, 1
+        while chunk:
+            chunk_width = max(len(row) for row in chunk)
+            if chunk_width > ws.col_count:
+                ws.add_cols(chunk_width - ws.col_count)
+            if start + len(chunk) - 1 > ws.row_count:
+                ws.add_rows(start + len(chunk) - 1 - ws.row_count)
+            ws.update(chunk, f"A{start}", value_input_option="RAW")
+            start += len(chunk)
+            chunk = list(itertools.islice(rows, CHUNK_ROWS))
+
+    def delete_table(self, tab):
+        self.spreadsheet.del_worksheet(self.spreadsheet.worksheet(tab))
+
+    def batch_update(self, tab, updates):
+        ws = self.spreadsheet.worksheet(tab)
+        ws.batch_update([{"range": rowcol_to_a1(row, col), "values": values} for row, col, values in updates])
+
+    def append_columns(self, tab, headers):
+        ws = self.spreadsheet.worksheet(tab)
+        width = ws.col_count
+        ws.add_cols(len(headers))
+        ws.update([list(headers)], rowcol_to_a1(1, width + 1))
+
+    def append_rows(self, tab, rows):
+        if rows:
+            self.spreadsheet.worksheet(tab).append_rows(rows, value_input_option="RAW")
+
+    def delete_rows(self, tab, first, last):
+        self.spreadsheet.worksheet(tab).delete_rows(first, last)
+
+
+def open_backend(path, backend=None):
+    """CSV directory, SQLite file or Parquet directory at path; guessed from the path unless backend is given."""
+    if backend is None:
+        if path.lower().endswith(SQLITE_EXTENSIONS):
+            backend = "sqlite"
+        elif glob.glob(os.path.join(path, "*.parquet")) or path.lower().endswith(".parquet"):
+            backend = "parquet"
+        else:
+            backend = "csv"
+    if backend == "csv":
+        return CsvBackend(path)
+    if backend == "sqlite":
+        return SqliteBackend(path)
+    if backend == "parquet":
+        return ParquetBackend(path)
+    raise ValueError(f"Unknown table backend {backend!r}, expected one of {BACKENDS}")
+
+
+class LocalWorksheet:
+    """
+    The part of gspread's Worksheet that the pipeline stages use, over one tab of a TableBackend,
+    so filter_links, write_image_titles and download_image run unchanged on a local export.
+    """
+
+    # Local tabs are read straight from disk; sheet_cache snapshots would only duplicate them
+    cacheable = False
+
+    def __init__(self, spreadsheet, title):
+        self.spreadsheet = spreadsheet
+        self.title = title
+        self.id = zlib.crc32(title.encode("utf-8")) & 0x7FFFFFFF
+
+    @property
+    def backend(self):
+        return self.spreadsheet.backend
+
+    @property
+    def col_count(self):
+        return len(self.backend.header(self.title))
+
+    def iter_rows(self, chunk_size=CHUNK_ROWS):
+        """Yields the tab in chunks of rows, header first, without loading it all."""
+        return self.backend.read_chunks(self.title, chunk_size)
+
+    def get_all_values(self):
+        rows = list(self.backend.rows(self.title))
+        width = max((len(row) for row in rows), default=0)
+        return [row + [""] * (width - len(row)) for row in rows]
+
+    def get_all_records(self):
+        values = self.get_all_values()
+        if not values:
+            return []
+        return to_records(values[0], [numericise_all(row) for row in values[1:]])
+
+    def update(self, range_name, values=None, **kwargs):
+        # Accepts both gspread argument orders: update("A1", values) and update(values, "A1")
+        if not isinstance(range_name, str):
+            range_name, values = values or "A1", range_name
+        row, col = a1_to_rowcol(range_name.split(":")[0])
+        self.backend.batch_update(self.title, [(row, col, values)])
+
+    def batch_update(self, data, **kwargs):
+        updates = [(*a1_to_rowcol(item["range"].split(":")[0]), item["values"]) for item in data]
+        self.backend.batch_update(self.title, updates)
+
+    def update_cell(self, row, col, value):
+        self.backend.batch_update(self.title, [(row, col, [[value]])])
+
+    def add_cols(self, cols):
+        self.backend.append_columns(self.title, [""] * cols)
+
+
+def request_cell_text(cell):
+    """Text of one cell of a Sheets updateCells request, as Sheets would display it."""
+    value = cell.get("userEnteredValue", {})
+    if "boolValue" in value:
+        return "TRUE" if value["boolValue"] else "FALSE"
+    if "numberValue" in value:
+        number = value["numberValue"]
+        return str(int(number)) if float(number).is_integer() else str(number)
+    return str(value.get("stringValue", value.get("formulaValue", "")))
+
+
+class LocalSpreadsheet:
+    """
+    The part of gspread's Spreadsheet that the pipeline stages use, over a TableBackend.
+    batch_update understands the requests filter_engine builds; formatting-only requests are ignored.
+    Requests apply in order, as in Sheets: cell updates are held back per tab and written before any
+    request that moves that tab's rows.
+    """
+
+    def __init__(self, backend, title=None):
+        self.backend = backend
+        path = getattr(backend, "directory", None) or getattr(backend, "path", "")
+        self.id = os.path.abspath(path)
+        self.title = title or os.path.basename(os.path.normpath(path))
+
+    def worksheets(self):
+        return [LocalWorksheet(self, tab) for tab in self.backend.tabs()]
+
+    def worksheet(self, title):
+        if title not in self.backend.tabs():
+            raise WorksheetNotFound(title)
+        return LocalWorksheet(self, title)
+
+    def batch_update(self, body):
+        titles = {ws.id: ws.title for ws in self.worksheets()}
+        pending = {}  # tab -> [(row, col, values)], written once per tab at the end
+
+        def flush(tab):
+            updates = pending.pop(tab, None)
+            if updates:
+                self.backend.batch_update(tab, updates)
+
+        for request in body.get("requests", []):
+            if "deleteDimension" in request:
+                grid = request["deleteDimension"]["range"]
+                if grid.get("dimension", "ROWS") == "ROWS":
+                    tab = titles[grid["sheetId"]]
+                    flush(tab)
+                    self.backend.delete_rows(tab, grid["startIndex"] + 1, grid["endIndex"])
+            elif "appendCells" in request:
+                append = request["appendCells"]
+                tab = titles[append["sheetId"]]
+                flush(tab)
+                rows = [[request_cell_text(cell) for cell in row.get("values", [])] for row in append["rows"]]
+                self.backend.append_rows(tab, rows)
+            elif "deleteSheet" in request:
+                tab = titles.pop(request["deleteSheet"]["sheetId"])
+                pending.pop(tab, None)
+                self.backend.delete_table(tab)
+            elif "addSheet" in request:
+                props = request["addSheet"]["properties"]
+                columns = props.get("gridProperties", {}).get("columnCount", 1)
+                titles[props.get("sheetId", zlib.crc32(props["title"].encode("utf-8")) & 0x7FFFFFFF)] = props["title"]
+                self.backend.write_table(props["title"], [[""] * columns])
+            elif "updateCells" in request:
+                update = request["updateCells"]
+                start = update["start"]
+                values = [[request_cell_text(cell) for cell in row.get("values", [])] for row in update["rows"]]
+                tab = titles[start["sheetId"]]
+                pending.setdefault(tab, []).append((start.get("rowIndex", 0) + 1, start.get("columnIndex", 0) + 1, values))
+        for tab in list(pending):
+            flush(tab)
+        return {}
+
+
+def open_workbook(path, backend=None):
+    """A LocalSpreadsheet over the CSV directory, SQLite file or Parquet directory at path."""
+    return LocalSpreadsheet(open_backend(path, backend))
+
+
+def copy_tabs(source, target, tabs=None, chunk_size=CHUNK_ROWS):
+    """Streams tabs (all by default) from one TableBackend to another, replacing them in the target."""
+    for tab in tabs or source.tabs():
+        target.write_table(tab, source.rows(tab, chunk_size))
+        yield tab
+
+
+def sync_to_sheets(workbook, spreadsheet, tabs=None):
+    """Pushes tabs of a local workbook to a gspread Spreadsheet. Nothing goes to Sheets unless this is called."""
+    for tab in copy_tabs(workbook.backend, GspreadBackend(spreadsheet), tabs):
+        print(f"☁️  Synced '{tab}' to '{spreadsheet.title}'")